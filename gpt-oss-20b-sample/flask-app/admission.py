@@ -0,0 +1,337 @@
+"""
+Admission control in front of the Ollama backend.
+
+At most CHAT_CONCURRENCY chats are generated at once; the rest wait in a
+bounded queue. Waiting chats are admitted round-robin across clients, so
+one client sending a burst cannot push everyone else's wait up: each
+client's own chats are served in order, and every waiting client gets a
+turn before any client gets a second one.
+
+Settings (environment variables):
+
+- CHAT_CONCURRENCY: chats generated at once (default 2)
+- CHAT_QUEUE_SIZE: chats that may wait (default 32)
+- CHAT_QUEUE_PER_CLIENT: chats one client may have waiting (default 4)
+- CHAT_QUEUE_TIMEOUT: seconds a chat may wait before it is dropped (default 300)
+
+The queue works with both worker threads (Ticket.wait) and asyncio tasks
+(Ticket.wait_async), so the Flask and ASGI apps share this module.
+
+The queue lives in process memory, so the limits only hold if every chat
+goes through one process: run the Flask app as a single process with
+threads (e.g. gunicorn -w 1 --threads 64) or the ASGI app under one
+uvicorn worker. With N worker processes each has its own queue, and up to
+N * CHAT_CONCURRENCY chats reach Ollama at once. The defaults suit one
+Ollama instance serving a handful of users; a load test, or a deployment
+expecting more waiting clients, should raise CHAT_QUEUE_SIZE and
+CHAT_QUEUE_PER_CLIENT (see loadtest.py).
+"""
+
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Wait times kept for the percentiles in stats()
+WAIT_SAMPLES = 500
+
+# Weight of the latest chat in the running mean of generation time
+SERVICE_TIME_WEIGHT = 0.2
+
+# Longest Retry-After sent with a 429, in seconds
+MAX_RETRY_AFTER = 300
+
+
+# Keys of FairQueue.stats() that only ever increase
+QUEUE_COUNTERS = ("admitted", "queued_total", "rejected", "timed_out", "wait_seconds_total")
+
+
+class QueueFull(Exception):
+    """The queue, or the client's share of it, is full."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """A chat's place in the queue, and then its generation slot."""
+
+    def __init__(self, queue, client_id):
+        self.queue = queue
+        self.client_id = client_id
+        self.enqueued = time.monotonic()
+        self.admitted = None
+        self.finished = False
+        self._event = threading.Event()
+        self._loop = None
+        self._future = None
+
+    @property
+    def granted(self):
+        return self.admitted is not None
+
+    def position(self):
+        """1-based place among the waiting chats, or 0 once admitted."""
+        return self.queue.position(self)
+
+    def wait(self, timeout):
+        """Block until admitted; False if timeout seconds passed first."""
+        return self._event.wait(timeout)
+
+    async def wait_async(self, timeout):
+        """Wait until admitted without blocking the event loop."""
+        with self.queue._lock:
+            if self.granted:
+                return True
+            if self._future is None:
+                self._loop = asyncio.get_running_loop()
+                self._future = self._loop.create_future()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return self.granted
+
+    def _wake(self):
+        """Called by the queue, with its lock held, when the ticket is admitted."""
+        self._event.set()
+        if self._future is not None:
+            self._loop.call_soon_threadsafe(_set_result, self._future)
+
+    def release(self):
+        """Give up the place in the queue, or the slot once admitted. Idempotent."""
+        self.queue.release(self)
+
+
+def _set_result(future):
+    if not future.done():
+        future.set_result(True)
+
+
+class FairQueue:
+    """Concurrency limiter with a bounded, per-client round-robin queue."""
+
+    def __init__(self, concurrency=2, max_queued=32, max_per_client=4, timeout=300.0):
+        self.concurrency = concurrency
+        self.max_queued = max_queued
+        self.max_per_client = max_per_client
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queued = 0
+        # client id -> waiting tickets; the first client is served next
+        self._waiting = OrderedDict()
+        self._wait_samples = deque(maxlen=WAIT_SAMPLES)
+        self._service_mean = None
+        self.admitted = 0
+        self.queued_total = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_seconds_total = 0.0
+
+    def enqueue(self, client_id):
+        """
+        Take a generation slot, or a place in the queue.
+
+        Raises:
+            QueueFull: if the queue or the client's share of it is full
+        """
+        with self._lock:
+            ticket = Ticket(self, client_id)
+            if self._active < self.concurrency and not self._waiting:
+                self._grant(ticket)
+                return ticket
+            waiting = self._waiting.get(client_id)
+            if self._queued >= self.max_queued:
+                self.rejected += 1
+                raise QueueFull(f"{self._queued} chats are waiting", self._retry_after())
+            if waiting is not None and len(waiting) >= self.max_per_client:
+                self.rejected += 1
+                raise QueueFull(f"You already have {len(waiting)} chats waiting",
+                                self._retry_after())
+            if waiting is None:
+                waiting = self._waiting[client_id] = deque()
+            waiting.append(ticket)
+            self._queued += 1
+            self.queued_total += 1
+            return ticket
+
+    def _retry_after(self):
+        """Estimate seconds until a queue place frees up (lock held)."""
+        service = self._service_mean or 30.0
+        estimate = (self._queued + 1) * service / self.concurrency
+        return min(MAX_RETRY_AFTER, max(1, math.ceil(estimate)))
+
+    def _grant(self, ticket):
+        """Admit a ticket (lock held)."""
+        ticket.admitted = time.monotonic()
+        self._active += 1
+        self.admitted += 1
+        wait = ticket.admitted - ticket.enqueued
+        self._wait_samples.append(wait)
+        self.wait_seconds_total += wait
+        ticket._wake()
+
+    def _dispatch(self):
+        """Admit waiting tickets, one client at a time, while slots are free (lock held)."""
+        while self._active < self.concurrency and self._waiting:
+            client_id, waiting = next(iter(self._waiting.items()))
+            ticket = waiting.popleft()
+            self._queued -= 1
+            if waiting:
+                self._waiting.move_to_end(client_id)
+            else:
+                del self._waiting[client_id]
+            self._grant(ticket)
+
+    def release(self, ticket, timed_out=False):
+        """Remove a waiting ticket or free an admitted ticket's slot."""
+        with self._lock:
+            if ticket.finished:
+                return
+            ticket.finished = True
+            if ticket.granted:
+                self._active -= 1
+                service = time.monotonic() - ticket.admitted
+                if self._service_mean is None:
+                    self._service_mean = service
+                else:
+                    self._service_mean += SERVICE_TIME_WEIGHT * (service - self._service_mean)
+            else:
+                waiting = self._waiting.get(ticket.client_id)
+                if waiting is not None and ticket in waiting:
+                    waiting.remove(ticket)
+                    self._queued -= 1
+                    if not waiting:
+                        del self._waiting[ticket.client_id]
+                if timed_out:
+                    self.timed_out += 1
+            self._dispatch()
+
+    def position(self, ticket):
+        """
+        Return how many chats, including this one, will be admitted before
+        or with the ticket if nothing else changes; 0 once admitted.
+        """
+        with self._lock:
+            if ticket.granted or ticket.finished:
+                return 0
+            waiting = self._waiting.get(ticket.client_id)
+            if waiting is None:
+                return 0
+            rank = waiting.index(ticket)
+            position = rank + 1
+            ahead = True
+            for client_id, others in self._waiting.items():
+                if client_id == ticket.client_id:
+                    ahead = False
+                    continue
+                # Clients ahead in the rotation get rank + 1 turns before
+                # this ticket's turn, clients behind it get rank turns
+                position += min(len(others), rank + 1 if ahead else rank)
+            return position
+
+    def stats(self):
+        """Return current occupancy, counters and queue wait percentiles."""
+        with self._lock:
+            waits = sorted(self._wait_samples)
+            stats = {
+                "concurrency": self.concurrency,
+                "active": self._active,
+                "queued": self._queued,
+                "clients_waiting": len(self._waiting),
+                "max_queued": self.max_queued,
+                "admitted": self.admitted,
+                "queued_total": self.queued_total,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "wait_seconds_total": self.wait_seconds_total,
+                "service_seconds_mean": self._service_mean or 0.0,
+            }
+        stats.update({
+            "wait_seconds_p50": _percentile(waits, 0.50),
+            "wait_seconds_p95": _percentile(waits, 0.95),
+            "wait_seconds_max": waits[-1] if waits else 0.0,
+        })
+        return stats
+
+
+def _percentile(values, fraction):
+    """Return the nearest-rank fraction-th percentile of sorted values (0 if empty)."""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def queue_from_env():
+    """Build a queue from the CHAT_* environment variables."""
+    return FairQueue(
+        concurrency=int(os.environ.get("CHAT_CONCURRENCY", 2)),
+        max_queued=int(os.environ.get("CHAT_QUEUE_SIZE", 32)),
+        max_per_client=int(os.environ.get("CHAT_QUEUE_PER_CLIENT", 4)),
+        timeout=float(os.environ.get("CHAT_QUEUE_TIMEOUT", 300)),
+    )
+
+
+class QueueTimeout(Exception):
+    """A chat waited in the queue for longer than the queue timeout."""
+
+
+# Seconds between queue-position checks while a chat waits
+QUEUE_UPDATE_INTERVAL = 1.0
+
+
+def queue_frame(position):
+    """
+    Format a queue-position control frame for the reply stream: an ASCII
+    record separator, a JSON object and a newline. Position 0 means the
+    chat was admitted and the reply follows.
+    """
+    return "\x1e" + json.dumps({"queue_position": position}) + "\n"
+
+
+def _check_deadline(ticket):
+    """Drop a ticket whose wait ran out; return the seconds it has left."""
+    remaining = ticket.enqueued + ticket.queue.timeout - time.monotonic()
+    if remaining <= 0:
+        ticket.queue.release(ticket, timed_out=True)
+        raise QueueTimeout(f"No free slot within {ticket.queue.timeout:.0f}s")
+    return remaining
+
+
+def wait_for_turn(ticket, updates=False, interval=QUEUE_UPDATE_INTERVAL):
+    """
+    Block until a ticket is admitted, yielding queue_frame()s as its
+    position changes if updates is set.
+
+    Raises:
+        QueueTimeout: if the queue timeout passed first
+    """
+    position = None
+    while not ticket.granted:
+        if updates:
+            current = ticket.position()
+            if current and current != position:
+                position = current
+                yield queue_frame(position)
+        ticket.wait(min(interval, _check_deadline(ticket)))
+    if position is not None:
+        yield queue_frame(0)
+
+
+async def wait_for_turn_async(ticket, updates=False, interval=QUEUE_UPDATE_INTERVAL):
+    """Async version of wait_for_turn."""
+    position = None
+    while not ticket.granted:
+        if updates:
+            current = ticket.position()
+            if current and current != position:
+                position = current
+                yield queue_frame(position)
+        await ticket.wait_async(min(interval, _check_deadline(ticket)))
+    if position is not None:
+        yield queue_frame(0)
@@ -0,0 +1,69 @@
+"""
+ASGI version of the chat proxy, with the same /chat contract and UI as app.py.
+
+Each streaming reply is a coroutine rather than a worker thread, so one
+process can hold hundreds of open generations. Run it with:
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 8000
+
+or, under gunicorn, with a uvicorn worker:
+
+    gunicorn -k uvicorn.workers.UvicornWorker -w 1 asgi_app:app
+"""
+
+import contextlib
+
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+from chat_flow import ChatError, ChatTurn, chat_metrics, client_address
+from ui import CHAT_HTML
+from upstream_async import async_client_from_env
+
+ollama = async_client_from_env()
+
+
+async def chat(request: Request):
+    """Stream a reply; see app.chat for the request format, sessions and caching."""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    peer = request.client.host if request.client else None
+    try:
+        turn = ChatTurn(data, client_address(request.headers, peer))
+    except ChatError as e:
+        return JSONResponse({"error": str(e)}, status_code=e.status, headers=e.headers)
+    # The background task frees the ticket if the stream never started
+    return StreamingResponse(turn.stream_async(ollama.chat_stream), media_type="text/plain",
+                             headers=turn.headers, background=BackgroundTask(turn.release))
+
+
+async def metrics(request: Request):
+    """Ollama client, session, queue and cache counters in the Prometheus text format."""
+    return PlainTextResponse(chat_metrics(ollama.stats()), media_type="text/plain; version=0.0.4")
+
+
+async def index(request: Request):
+    return HTMLResponse(CHAT_HTML)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Open the first connection now so it is not part of the first chat's latency
+    await ollama.warm()
+    yield
+    await ollama.aclose()
+
+
+app = Starlette(
+    routes=[
+        Route("/", index),
+        Route("/chat", chat, methods=["POST"]),
+        Route("/metrics", metrics),
+    ],
+    lifespan=lifespan,
+)
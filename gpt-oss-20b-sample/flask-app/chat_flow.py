@@ -0,0 +1,223 @@
+"""
+The /chat request flow shared by the Flask app (app.py) and the ASGI app (asgi_app.py).
+
+A ChatTurn validates the request body, loads the session history, answers
+from the response cache or takes a place in the admission queue, and then
+streams the reply with either a blocking or an async Ollama client. The
+apps only turn its results into framework responses.
+"""
+
+import os
+
+from admission import QUEUE_COUNTERS, QueueFull, QueueTimeout, queue_from_env, wait_for_turn, wait_for_turn_async
+from conversations import SESSION_COUNTERS, store_from_env
+from response_cache import CACHE_COUNTERS, cache_from_env, cache_key
+from upstream import CLIENT_COUNTERS, UpstreamBusy, render_metrics
+
+MODEL_NAME = "gpt-oss:20b"
+
+# How long Ollama keeps the model, and its KV cache, loaded between turns
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE")
+
+# Multi-turn histories for clients that send a session_id (see conversations.py)
+conversations = store_from_env()
+
+# Concurrency limit and fair queue in front of Ollama (see admission.py)
+chat_queue = queue_from_env()
+
+# Optional cache of completed replies, off unless CHAT_CACHE_MB is set (see response_cache.py)
+response_cache = cache_from_env()
+
+
+def chat_payload(messages, options=None):
+    """Build the Ollama /api/chat request body."""
+    payload = {
+        "model": MODEL_NAME,
+        "messages": messages,
+        "stream": True
+    }
+    if options:
+        payload["options"] = options
+    if OLLAMA_KEEP_ALIVE:
+        payload["keep_alive"] = OLLAMA_KEEP_ALIVE
+    return payload
+
+
+# Whether X-Client-IP and X-Forwarded-For come from a trusted proxy. Any
+# client can send them, so they are only read behind one: by default on
+# App Service (which sets WEBSITE_INSTANCE_ID), or with TRUST_PROXY_HEADERS=1
+TRUST_PROXY_HEADERS = os.environ.get(
+    "TRUST_PROXY_HEADERS", "1" if os.environ.get("WEBSITE_INSTANCE_ID") else "0"
+).lower() in ("1", "true", "yes", "on")
+
+
+def _strip_port(address):
+    """Drop a port from "1.2.3.4:5678" or "[2001:db8::1]:5678"; bare IPv6 is kept."""
+    if address.startswith("["):
+        return address[1:].partition("]")[0]
+    if address.count(":") == 1:
+        return address.partition(":")[0]
+    return address
+
+
+def client_address(headers, peer, trust_proxy=TRUST_PROXY_HEADERS):
+    """
+    The caller's IP address, which the queue shares out fairly.
+
+    Without trust_proxy this is the connection's address. Behind App
+    Service's front end the connection comes from the front end, which
+    sets X-Client-IP and appends the address it accepted the request from
+    to X-Forwarded-For. Earlier X-Forwarded-For entries are sent by the
+    client and could be forged to get a fresh queue share per request, so
+    only the last one is used. The front end includes the source port,
+    which is stripped so that all of a client's connections count as one.
+
+    Args:
+        headers: The request headers (case-insensitive mapping)
+        peer: The address of the connection
+        trust_proxy: Read the proxy headers (see TRUST_PROXY_HEADERS)
+    """
+    address = None
+    if trust_proxy:
+        address = headers.get("X-Client-IP")
+        if not address:
+            forwarded = headers.get("X-Forwarded-For")
+            address = forwarded.split(",")[-1] if forwarded else None
+    address = _strip_port(address.strip()) if address else ""
+    return address or peer or "unknown"
+
+
+class ChatError(Exception):
+    """A /chat request answered with a JSON error instead of a stream."""
+
+    def __init__(self, message, status=400, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class ChatTurn:
+    """
+    One /chat request, from validation to the end of its reply.
+
+    Building a ChatTurn raises ChatError for an invalid request (400) or a
+    full queue (429). Otherwise the reply is either cached or the turn
+    holds a queue ticket, which release() frees; stream() and
+    stream_async() release it themselves once they have run.
+    """
+
+    def __init__(self, data, client_id):
+        """
+        Args:
+            data: The decoded JSON request body
+            client_id: The caller's address, used for fair queueing
+        """
+        if not isinstance(data, dict) or not data.get("prompt"):
+            raise ChatError("Prompt is required.")
+        if not isinstance(data["prompt"], str):
+            raise ChatError("prompt must be a string.")
+        if data.get("session_id") is not None and not isinstance(data["session_id"], str):
+            raise ChatError("session_id must be a string or null.")
+        self.prompt = data["prompt"]
+        self.options = data.get("options")
+        if self.options is not None and not isinstance(self.options, dict):
+            raise ChatError("options must be an object.")
+        self.queue_updates = bool(data.get("queue_updates"))
+
+        self.session_id = None
+        if "session_id" in data:
+            self.session_id, self.messages = conversations.start_turn(data["session_id"], self.prompt)
+        else:
+            self.messages = [{"role": "user", "content": self.prompt}]
+
+        self.key = None
+        self.cached = None
+        if response_cache is not None and data.get("cache", True) is not False:
+            self.key = cache_key(MODEL_NAME, self.messages, self.options)
+            self.cached = response_cache.get(self.key)
+
+        self.ticket = None
+        if self.cached is None:
+            try:
+                self.ticket = chat_queue.enqueue(client_id)
+            except QueueFull as e:
+                raise ChatError(f"Server is busy: {e}", 429,
+                                {"Retry-After": str(e.retry_after)}) from e
+
+    @property
+    def headers(self):
+        """X-Session-Id and X-Cache headers for the streamed response."""
+        headers = {}
+        if self.session_id:
+            headers["X-Session-Id"] = self.session_id
+        if self.key:
+            headers["X-Cache"] = "MISS" if self.cached is None else "HIT"
+        return headers
+
+    def release(self):
+        """Free the queue slot, if the turn holds one; safe to call twice."""
+        if self.ticket is not None:
+            self.ticket.release()
+
+    def _finish(self, reply):
+        # Only completed turns become part of the history and the cache
+        if self.session_id:
+            conversations.finish_turn(self.session_id, self.prompt, "".join(reply))
+        if self.key and self.cached is None:
+            response_cache.put(self.key, reply)
+
+    def stream(self, chat_stream):
+        """Yield the reply, generating it with the blocking chat_stream(payload)."""
+        if self.cached is not None:
+            yield from response_cache.replay(self.cached)
+            self._finish(self.cached)
+            return
+        reply = []
+        try:
+            yield from wait_for_turn(self.ticket, self.queue_updates)
+            for content in chat_stream(chat_payload(self.messages, self.options)):
+                reply.append(content)
+                yield content
+        except (QueueTimeout, UpstreamBusy) as e:
+            yield f"[Error: server busy, {str(e)}]"
+            return
+        except Exception as e:
+            yield f"[Error: {str(e)}]"
+            return
+        finally:
+            self.release()
+        self._finish(reply)
+
+    async def stream_async(self, chat_stream):
+        """Async version of stream(), for an async chat_stream(payload)."""
+        if self.cached is not None:
+            async for chunk in response_cache.replay_async(self.cached):
+                yield chunk
+            self._finish(self.cached)
+            return
+        reply = []
+        try:
+            async for frame in wait_for_turn_async(self.ticket, self.queue_updates):
+                yield frame
+            async for content in chat_stream(chat_payload(self.messages, self.options)):
+                reply.append(content)
+                yield content
+        except (QueueTimeout, UpstreamBusy) as e:
+            yield f"[Error: server busy, {str(e)}]"
+            return
+        except Exception as e:
+            yield f"[Error: {str(e)}]"
+            return
+        finally:
+            self.release()
+        self._finish(reply)
+
+
+def chat_metrics(client_stats):
+    """Ollama client, session, queue and cache counters in the Prometheus text format."""
+    body = (render_metrics("ollama_client", client_stats, CLIENT_COUNTERS)
+            + render_metrics("chat_sessions", conversations.stats(), SESSION_COUNTERS)
+            + render_metrics("chat_queue", chat_queue.stats(), QUEUE_COUNTERS))
+    if response_cache is not None:
+        body += render_metrics("chat_cache", response_cache.stats(), CACHE_COUNTERS)
+    return body
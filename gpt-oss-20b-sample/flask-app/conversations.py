@@ -0,0 +1,197 @@
+"""
+Server-side multi-turn chat sessions.
+
+Each session keeps its message history so clients only send the new
+prompt and a session id. Histories are trimmed to a token budget in
+blocks: when a conversation outgrows the budget, the oldest turns are
+dropped until it is back down to a fraction of it. Between trims every
+request starts with exactly the messages of the previous one, so Ollama
+can reuse its KV cache for that prefix and only evaluates the new turn.
+
+Settings (environment variables):
+
+- CHAT_SESSION_MB: memory budget for all histories (default 64)
+- CHAT_SESSION_TTL: seconds an idle session is kept (default 3600)
+- CHAT_HISTORY_TOKENS: estimated tokens of history sent per request (default 3000)
+- CHAT_TRIM_TO: fraction of the budget kept after a trim (default 0.5)
+"""
+
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+# Rough characters per token, used to estimate history size without a tokenizer
+CHARS_PER_TOKEN = 4
+
+# Tokens added per message for the chat template's role markers
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text):
+    """Estimate the token count of a message."""
+    return len(text) // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+
+
+# Keys of ConversationStore.stats() that only ever increase
+SESSION_COUNTERS = ("created", "expired", "evicted", "trims", "messages_trimmed")
+
+
+class Conversation:
+    """The message history of one chat session."""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.messages = []
+        self.tokens = 0
+        self.nbytes = 0
+        self.last_used = time.monotonic()
+
+    def _append(self, role, content):
+        self.messages.append({"role": role, "content": content})
+        self.tokens += estimate_tokens(content)
+        self.nbytes += len(content.encode())
+
+    def _drop_oldest_turn(self):
+        """Drop the oldest user message and the replies that followed it."""
+        dropped = 0
+        while self.messages:
+            message = self.messages.pop(0)
+            self.tokens -= estimate_tokens(message["content"])
+            self.nbytes -= len(message["content"].encode())
+            dropped += 1
+            if not self.messages or self.messages[0]["role"] == "user":
+                break
+        return dropped
+
+
+class ConversationStore:
+    """
+    Thread-safe LRU store of conversations with a byte budget and idle TTL.
+
+    Turns of one session are expected to arrive one after the other; two
+    concurrent turns on the same session are both recorded, in the order
+    they finish.
+    """
+
+    def __init__(self, max_bytes, ttl, token_budget, trim_to=0.5):
+        """
+        Args:
+            max_bytes: Memory budget for the message text of all sessions
+            ttl: Seconds a session may stay unused before it expires
+            token_budget: Estimated tokens of history plus prompt per request
+            trim_to: Fraction of token_budget a history is trimmed down to
+                once it no longer fits
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.token_budget = token_budget
+        self.trim_to = trim_to
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+        self.trims = 0
+        self.messages_trimmed = 0
+
+    def _remove(self, session_id):
+        conversation = self._sessions.pop(session_id, None)
+        if conversation is not None:
+            self._bytes -= conversation.nbytes
+
+    def _purge_expired(self, now):
+        """Remove sessions idle for longer than the TTL (oldest first)."""
+        while self._sessions:
+            session_id, conversation = next(iter(self._sessions.items()))
+            if now - conversation.last_used <= self.ttl:
+                break
+            self._remove(session_id)
+            self.expired += 1
+
+    def start_turn(self, session_id, prompt):
+        """
+        Return (session_id, messages) for a new prompt.
+
+        Unknown or expired session ids get a new id, which is returned.
+        messages is the history followed by the new prompt. Nothing is
+        stored yet: finish_turn adds the prompt and reply, and creates the
+        session, so chats that are rejected or fail leave no empty session.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._purge_expired(now)
+            conversation = self._sessions.get(session_id) if session_id else None
+            if conversation is None:
+                return secrets.token_urlsafe(16), [{"role": "user", "content": prompt}]
+            self._sessions.move_to_end(session_id)
+            conversation.last_used = now
+
+            prompt_tokens = estimate_tokens(prompt)
+            if conversation.tokens + prompt_tokens > self.token_budget:
+                # Trim well below the budget so the next turns keep a stable prefix
+                target = self.token_budget * self.trim_to - prompt_tokens
+                before = conversation.nbytes
+                dropped = 0
+                while conversation.messages and conversation.tokens > target:
+                    dropped += conversation._drop_oldest_turn()
+                self._bytes -= before - conversation.nbytes
+                self.trims += 1
+                self.messages_trimmed += dropped
+
+            messages = conversation.messages + [{"role": "user", "content": prompt}]
+        return session_id, messages
+
+    def finish_turn(self, session_id, prompt, reply):
+        """Add a completed prompt and reply to a session's history, creating it if new."""
+        with self._lock:
+            conversation = self._sessions.get(session_id)
+            if conversation is None:
+                conversation = self._sessions[session_id] = Conversation(session_id)
+                self.created += 1
+            else:
+                self._sessions.move_to_end(session_id)
+            before = conversation.nbytes
+            conversation._append("user", prompt)
+            conversation._append("assistant", reply)
+            conversation.last_used = time.monotonic()
+            self._bytes += conversation.nbytes - before
+            while self._bytes > self.max_bytes and len(self._sessions) > 1:
+                oldest = next(iter(self._sessions))
+                if oldest == session_id:
+                    self._sessions.move_to_end(session_id)
+                    continue
+                self._remove(oldest)
+                self.evicted += 1
+
+    def end(self, session_id):
+        """Forget a session."""
+        with self._lock:
+            self._remove(session_id)
+
+    def stats(self):
+        """Return counters and current sizes."""
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "token_budget": self.token_budget,
+                "created": self.created,
+                "expired": self.expired,
+                "evicted": self.evicted,
+                "trims": self.trims,
+                "messages_trimmed": self.messages_trimmed,
+            }
+
+
+def store_from_env():
+    """Build a store from the CHAT_* environment variables."""
+    return ConversationStore(
+        max_bytes=int(float(os.environ.get("CHAT_SESSION_MB", 64)) * 1024 * 1024),
+        ttl=float(os.environ.get("CHAT_SESSION_TTL", 3600)),
+        token_budget=int(os.environ.get("CHAT_HISTORY_TOKENS", 3000)),
+        trim_to=float(os.environ.get("CHAT_TRIM_TO", 0.5)),
+    )
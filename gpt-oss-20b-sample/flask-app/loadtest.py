@@ -0,0 +1,182 @@
+"""
+Load test for the chat proxy: finds how many /chat streams it can hold at once.
+
+Each step opens N concurrent /chat streams and reports the time to first
+token, the total stream time and the number of failed streams. The
+concurrency ceiling is the largest step with no failures and a p95 time to
+first token under --max-ttft.
+
+To measure the proxy rather than the model, run a mock Ollama that streams
+canned tokens at a fixed pace and point the proxy at it. All load-test
+streams come from one address, so the admission queue (see admission.py)
+must let them all in at once, or the steps measure its 429s instead:
+
+    python loadtest.py --mock-upstream 11435 &
+    export OLLAMA_HOST=http://127.0.0.1:11435 CHAT_CONCURRENCY=400 \
+        CHAT_QUEUE_SIZE=400 CHAT_QUEUE_PER_CLIENT=400
+    uvicorn asgi_app:app --port 8000 &
+    python loadtest.py --url http://127.0.0.1:8000 --steps 50,100,200,400
+
+Compare with the Flask app as one gunicorn process with threads, since the
+queue is per process:
+    gunicorn -w 1 --threads 64 -b :5000 app:app
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import statistics
+import sys
+import time
+
+import httpx
+
+
+async def _mock_connection(reader, writer, tokens, interval):
+    """Serve keep-alive requests on one connection like Ollama's /api/chat."""
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            length = 0
+            while True:
+                header = await reader.readline()
+                if header in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = header.decode().partition(":")
+                if name.strip().lower() == "content-length":
+                    length = int(value)
+            if length:
+                await reader.readexactly(length)
+
+            if not request_line.startswith(b"POST"):
+                body = b'{"version":"mock"}'
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: %d\r\n\r\n%s" % (len(body), body))
+                await writer.drain()
+                continue
+
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+                         b"Transfer-Encoding: chunked\r\n\r\n")
+            for i in range(tokens + 1):
+                await asyncio.sleep(interval)
+                event = {"model": "mock", "message": {"role": "assistant",
+                         "content": "" if i == tokens else f"token{i} "}, "done": i == tokens}
+                chunk = (json.dumps(event) + "\n").encode()
+                writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                await writer.drain()
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def run_mock_upstream(port, tokens, interval):
+    """Run a mock Ollama server until interrupted."""
+    server = await asyncio.start_server(
+        lambda r, w: _mock_connection(r, w, tokens, interval), "127.0.0.1", port,
+        backlog=4096
+    )
+    print(f"Mock Ollama on http://127.0.0.1:{port}: {tokens} tokens every {interval}s",
+          file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+
+async def _one_chat(client, url, prompt):
+    """Stream one chat; return (time to first token, total time, error or None)."""
+    start = time.perf_counter()
+    first = None
+    try:
+        async with client.stream("POST", f"{url}/chat", json={"prompt": prompt}) as r:
+            if r.status_code != 200:
+                return None, time.perf_counter() - start, f"HTTP {r.status_code}"
+            async for chunk in r.aiter_text():
+                if first is None and chunk:
+                    first = time.perf_counter() - start
+                    if chunk.startswith("[Error"):
+                        return first, time.perf_counter() - start, chunk.strip()
+    except httpx.HTTPError as e:
+        return first, time.perf_counter() - start, type(e).__name__
+    return first, time.perf_counter() - start, None if first is not None else "empty reply"
+
+
+def _p95(values):
+    """Nearest-rank 95th percentile: the smallest value at least 95% of values are at or below."""
+    if not values:
+        return float("nan")
+    return sorted(values)[math.ceil(0.95 * len(values)) - 1]
+
+
+async def run_step(url, concurrency, timeout):
+    """Open concurrency streams at once and summarise them."""
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(
+            _one_chat(client, url, f"load test {i}") for i in range(concurrency)
+        ))
+        wall = time.perf_counter() - start
+    ttft = [r[0] for r in results if r[2] is None]
+    totals = [r[1] for r in results if r[2] is None]
+    errors = [r[2] for r in results if r[2] is not None]
+    return {
+        "concurrency": concurrency,
+        "ok": len(ttft),
+        "failed": len(errors),
+        "ttft_p50": statistics.median(ttft) if ttft else float("nan"),
+        "ttft_p95": _p95(ttft),
+        "stream_p95": _p95(totals),
+        "wall": wall,
+        "first_error": errors[0] if errors else "",
+    }
+
+
+async def run_load_test(url, steps, timeout, max_ttft):
+    print(f"{'streams':>8} {'ok':>6} {'failed':>6} {'ttft p50':>9} {'ttft p95':>9} "
+          f"{'stream p95':>10} {'wall':>7}")
+    ceiling = 0
+    for concurrency in steps:
+        step = await run_step(url, concurrency, timeout)
+        print(f"{step['concurrency']:>8} {step['ok']:>6} {step['failed']:>6} "
+              f"{step['ttft_p50']:>8.3f}s {step['ttft_p95']:>8.3f}s "
+              f"{step['stream_p95']:>9.3f}s {step['wall']:>6.1f}s  {step['first_error']}")
+        if step["failed"] or not step["ttft_p95"] <= max_ttft:
+            break
+        ceiling = concurrency
+    print(f"Concurrency ceiling: {ceiling} streams"
+          f" (no failures, p95 time to first token <= {max_ttft}s)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="base URL of the chat app")
+    parser.add_argument("--steps", default="10,50,100,200,400",
+                        help="comma-separated numbers of concurrent streams")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-stream timeout in seconds")
+    parser.add_argument("--max-ttft", type=float, default=2.0,
+                        help="p95 time to first token allowed at the ceiling, in seconds")
+    parser.add_argument("--mock-upstream", type=int, metavar="PORT",
+                        help="run a mock Ollama on PORT instead of a load test")
+    parser.add_argument("--tokens", type=int, default=50, help="tokens per mock reply")
+    parser.add_argument("--token-interval", type=float, default=0.05,
+                        help="seconds between mock tokens")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.mock_upstream:
+            asyncio.run(run_mock_upstream(args.mock_upstream, args.tokens, args.token_interval))
+        else:
+            steps = [int(s) for s in args.steps.split(",") if s.strip()]
+            asyncio.run(run_load_test(args.url.rstrip("/"), steps, args.timeout, args.max_ttft))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""
+Exact-match cache of completed chat replies.
+
+A reply is cached under the model, the messages (the whole history for
+multi-turn sessions, with surrounding whitespace and line endings
+normalized) and the sampling options, and stored as the chunks it was
+streamed in. A hit is replayed through the same streaming response
+without touching Ollama or the queue, optionally paced to look like a
+live generation.
+
+The cache is off unless CHAT_CACHE_MB is set. Settings (environment variables):
+
+- CHAT_CACHE_MB: memory budget for cached replies (default 0, disabled)
+- CHAT_CACHE_TTL: seconds a reply stays cached (default 3600)
+- CHAT_CACHE_PACING: seconds between replayed chunks (default 0, no pacing)
+
+Clients can bypass the cache for one request with "cache": false.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+_line_ending = re.compile(r"\r\n?")
+
+# Keys of ResponseCache.stats() that only ever increase
+CACHE_COUNTERS = ("hits", "misses", "stores", "expired", "evicted")
+
+
+def normalize_content(text):
+    """
+    Trim surrounding whitespace and use \\n line endings.
+
+    Whitespace inside a message is kept as is: indentation in code, table
+    alignment and blank lines between paragraphs change what the model is
+    asked, so prompts that differ there must not share a reply.
+    """
+    return _line_ending.sub("\n", text).strip()
+
+
+def cache_key(model, messages, options=None):
+    """Return the cache key for a chat request."""
+    normalized = [
+        {"role": m["role"], "content": normalize_content(m["content"])} for m in messages
+    ]
+    request = json.dumps({"model": model, "messages": normalized, "options": options or {}},
+                         sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(request.encode(), digest_size=20).hexdigest()
+
+
+class ResponseCache:
+    """Thread-safe LRU cache of streamed replies with a byte budget and TTL."""
+
+    def __init__(self, max_bytes, ttl, pacing=0.0):
+        """
+        Args:
+            max_bytes: Memory budget for the text of all cached replies
+            ttl: Seconds a reply stays cached after it was stored
+            pacing: Seconds between chunks when a hit is replayed
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.pacing = pacing
+        self._lock = threading.Lock()
+        # key -> (stored at, chunks, size in bytes)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def get(self, key):
+        """Return the cached chunks for key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                self._remove(key)
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, chunks):
+        """Cache a completed reply, evicting least recently used ones to fit."""
+        chunks = tuple(chunks)
+        size = sum(len(chunk.encode()) for chunk in chunks)
+        if not chunks or size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            while self._entries and self._bytes + size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evicted += 1
+            self._entries[key] = (time.monotonic(), chunks, size)
+            self._bytes += size
+            self.stores += 1
+
+    def replay(self, chunks):
+        """Yield cached chunks, paced if configured."""
+        for i, chunk in enumerate(chunks):
+            if i and self.pacing:
+                time.sleep(self.pacing)
+            yield chunk
+
+    async def replay_async(self, chunks):
+        """Async version of replay."""
+        for i, chunk in enumerate(chunks):
+            if i and self.pacing:
+                await asyncio.sleep(self.pacing)
+            yield chunk
+
+    def stats(self):
+        """Return counters and current sizes."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
+
+
+def cache_from_env():
+    """Build a cache from the CHAT_CACHE_* environment variables, or None if disabled."""
+    max_bytes = int(float(os.environ.get("CHAT_CACHE_MB", 0)) * 1024 * 1024)
+    if not max_bytes:
+        return None
+    return ResponseCache(
+        max_bytes,
+        ttl=float(os.environ.get("CHAT_CACHE_TTL", 3600)),
+        pacing=float(os.environ.get("CHAT_CACHE_PACING", 0)),
+    )
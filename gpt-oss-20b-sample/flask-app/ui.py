@@ -0,0 +1,120 @@
+"""
+The chat page, shared by the Flask app and the ASGI app.
+"""
+
+CHAT_HTML = r'''
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <title>GPT-OSS-20B Chat</title>
+    <style>
+        body { font-family: Arial, sans-serif; margin: 40px; }
+        #chatbox { width: 100%; height: 300px; border: 1px solid #ccc; padding: 10px; overflow-y: auto; margin-bottom: 10px; }
+        #prompt { width: 70%; padding: 8px; }
+        #send, #new-chat { padding: 8px 16px; }
+    </style>
+</head>
+<body>
+    <h2>GPT-OSS-20B Chat</h2>
+    <div id="chatbox"></div>
+    <input type="text" id="prompt" placeholder="Type your message..." />
+    <button id="send">Send</button>
+    <button id="new-chat">New chat</button>
+    <script>
+        const chatbox = document.getElementById('chatbox');
+        const promptInput = document.getElementById('prompt');
+        const sendBtn = document.getElementById('send');
+        // The server keeps the conversation; null starts a new one
+        let sessionId = null;
+        function appendMessage(sender, text) {
+            const msgDiv = document.createElement('div');
+            msgDiv.innerHTML = `<b>${sender}:</b> <span>${text}</span>`;
+            chatbox.appendChild(msgDiv);
+            chatbox.scrollTop = chatbox.scrollHeight;
+            return msgDiv.querySelector('span');
+        }
+        async function streamBotResponse(prompt) {
+            appendMessage('You', prompt);
+            // Create bot message element with 'thinking...' text
+            const botSpan = appendMessage('Bot', '');
+            botSpan.textContent = '';
+            // Add a spinner or thinking message
+            const thinkingSpan = document.createElement('span');
+            thinkingSpan.innerHTML = ' <span style="color: #888;">Bot is thinking...</span>';
+            botSpan.parentNode.appendChild(thinkingSpan);
+            try {
+                const res = await fetch('/chat', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ prompt, session_id: sessionId, queue_updates: true })
+                });
+                if (!res.ok) {
+                    // e.g. 429 when the queue is full
+                    const err = await res.json().catch(() => ({}));
+                    const retry = res.headers.get('Retry-After');
+                    thinkingSpan.remove();
+                    botSpan.textContent = 'Error: ' + (err.error || res.status) +
+                        (retry ? ` (try again in ${retry}s)` : '');
+                    return;
+                }
+                sessionId = res.headers.get('X-Session-Id') || sessionId;
+                if (!res.body) throw new Error('No response body');
+                const reader = res.body.getReader();
+                let decoder = new TextDecoder();
+                let done = false;
+                let firstChunk = true;
+                let pending = '';
+                while (!done) {
+                    const { value, done: doneReading } = await reader.read();
+                    done = doneReading;
+                    if (value) {
+                        pending += decoder.decode(value, { stream: true });
+                        // Queue position frames ("\x1e" + JSON + newline) come
+                        // before the reply starts
+                        while (firstChunk && pending.startsWith('\x1e')) {
+                            const end = pending.indexOf('\n');
+                            if (end < 0) break;
+                            const position = JSON.parse(pending.slice(1, end)).queue_position;
+                            pending = pending.slice(end + 1);
+                            thinkingSpan.innerHTML = position > 0
+                                ? ` <span style="color: #888;">Waiting in queue (position ${position})...</span>`
+                                : ' <span style="color: #888;">Bot is thinking...</span>';
+                        }
+                        if (!pending || (firstChunk && pending.startsWith('\x1e'))) continue;
+                        if (firstChunk) {
+                            // Remove thinking message on first chunk
+                            thinkingSpan.remove();
+                            firstChunk = false;
+                        }
+                        botSpan.textContent += pending;
+                        pending = '';
+                        chatbox.scrollTop = chatbox.scrollHeight;
+                    }
+                }
+                if (firstChunk) {
+                    // If no chunk ever arrived, remove thinking message
+                    thinkingSpan.remove();
+                }
+            } catch (e) {
+                thinkingSpan.remove();
+                botSpan.textContent = 'Error: ' + e;
+            }
+        }
+        sendBtn.onclick = function() {
+            const prompt = promptInput.value.trim();
+            if (!prompt) return;
+            promptInput.value = '';
+            streamBotResponse(prompt);
+        };
+        document.getElementById('new-chat').onclick = function() {
+            sessionId = null;
+            chatbox.innerHTML = '';
+        };
+        promptInput.addEventListener('keydown', function(e) {
+            if (e.key === 'Enter') sendBtn.click();
+        });
+    </script>
+</body>
+</html>
+'''
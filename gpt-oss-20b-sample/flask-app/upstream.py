@@ -0,0 +1,187 @@
+"""
+Pooled HTTP client for the Ollama API.
+
+One requests.Session per process keeps connections to OLLAMA_HOST alive
+between chats, so only the first request pays for the TCP connect. The
+number of pooled connections, the timeouts and the number of generations
+streamed at once are configured through environment variables:
+
+- OLLAMA_HOST: base URL of the Ollama server (default http://localhost:11434)
+- OLLAMA_POOL_SIZE: keep-alive connections kept in the pool (default 10)
+- OLLAMA_MAX_STREAMS: chats streamed from Ollama at once (default: pool size)
+- OLLAMA_CONNECT_TIMEOUT: seconds to open a connection (default 5)
+- OLLAMA_READ_TIMEOUT: seconds to wait for the next chunk of a reply (default 300)
+- OLLAMA_STREAM_WAIT: seconds a chat waits for a free stream slot (default 30)
+"""
+
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class UpstreamBusy(Exception):
+    """All stream slots stayed in use for the whole wait time."""
+
+
+class OllamaClient:
+    """Thread-safe, pooled client for Ollama's streaming chat API."""
+
+    def __init__(self, host, pool_size=10, max_streams=None, connect_timeout=5.0,
+                 read_timeout=300.0, stream_wait=30.0):
+        self.host = host.rstrip("/")
+        self.pool_size = pool_size
+        self.max_streams = max_streams or pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.stream_wait = stream_wait
+
+        self.session = requests.Session()
+        # pool_block makes threads wait for a pooled connection instead of
+        # opening throwaway ones; POSTs are never retried
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                              pool_block=True, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._adapter = adapter
+        self._slots = threading.BoundedSemaphore(self.max_streams)
+
+        self._lock = threading.Lock()
+        self.active_streams = 0
+        self.streams_total = 0
+        self.stream_errors = 0
+        self.busy_rejections = 0
+        self.first_token_seconds_total = 0.0
+        self.prompt_tokens_total = 0
+        self.prompt_eval_seconds_total = 0.0
+
+    def chat_stream(self, payload):
+        """
+        Send a chat request with "stream": true and yield the content of
+        each message chunk as it arrives.
+
+        Raises:
+            UpstreamBusy: if no stream slot freed up within stream_wait
+            requests.RequestException: on connection errors, timeouts and
+                error statuses from Ollama
+        """
+        if not self._slots.acquire(timeout=self.stream_wait):
+            with self._lock:
+                self.busy_rejections += 1
+            raise UpstreamBusy(f"{self.max_streams} chats are already running")
+        with self._lock:
+            self.active_streams += 1
+            self.streams_total += 1
+        start = time.perf_counter()
+        first_token = True
+        try:
+            with self.session.post(f"{self.host}/api/chat", json=payload,
+                                   stream=True, timeout=self.timeout) as r:
+                r.raise_for_status()
+                # Read to the end of the body, past the "done" event, so the
+                # connection goes back to the pool instead of being closed
+                for line in r.iter_lines(decode_unicode=True):
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    content = event.get("message", {}).get("content")
+                    if content:
+                        if first_token:
+                            first_token = False
+                            with self._lock:
+                                self.first_token_seconds_total += time.perf_counter() - start
+                        yield content
+                    if event.get("done"):
+                        self._record_prompt_eval(event)
+        except Exception:
+            with self._lock:
+                self.stream_errors += 1
+            raise
+        finally:
+            with self._lock:
+                self.active_streams -= 1
+            self._slots.release()
+
+    def _record_prompt_eval(self, event):
+        """
+        Add the prompt evaluation figures of a final "done" event. With a
+        reused KV cache, prompt_eval_count covers only the new tokens.
+        """
+        with self._lock:
+            self.prompt_tokens_total += event.get("prompt_eval_count", 0)
+            self.prompt_eval_seconds_total += event.get("prompt_eval_duration", 0) / 1e9
+
+    def warm(self):
+        """Open a pooled connection ahead of the first chat. Errors are ignored."""
+        try:
+            self.session.get(f"{self.host}/api/version", timeout=self.timeout).close()
+        except requests.RequestException:
+            pass
+
+    def stats(self):
+        """Return the pool configuration, connection counters and stream counters."""
+        connections_opened = requests_sent = idle = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            connections_opened += pool.num_connections
+            requests_sent += pool.num_requests
+            # The pool queue holds None for slots without an open connection
+            idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        with self._lock:
+            return {
+                "pool_size": self.pool_size,
+                "max_streams": self.max_streams,
+                "connections_opened": connections_opened,
+                "connections_idle": idle,
+                "requests_sent": requests_sent,
+                "active_streams": self.active_streams,
+                "streams_total": self.streams_total,
+                "stream_errors": self.stream_errors,
+                "busy_rejections": self.busy_rejections,
+                "first_token_seconds_total": self.first_token_seconds_total,
+                "prompt_tokens_total": self.prompt_tokens_total,
+                "prompt_eval_seconds_total": self.prompt_eval_seconds_total,
+            }
+
+    def close(self):
+        self.session.close()
+
+
+def client_from_env():
+    """Build a client from the OLLAMA_* environment variables."""
+    pool_size = int(os.environ.get("OLLAMA_POOL_SIZE", 10))
+    return OllamaClient(
+        os.environ.get("OLLAMA_HOST", "http://localhost:11434"),
+        pool_size=pool_size,
+        max_streams=int(os.environ.get("OLLAMA_MAX_STREAMS", pool_size)),
+        connect_timeout=float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", 5)),
+        read_timeout=float(os.environ.get("OLLAMA_READ_TIMEOUT", 300)),
+        stream_wait=float(os.environ.get("OLLAMA_STREAM_WAIT", 30)),
+    )
+
+
+# Keys of the client stats() that only ever increase
+CLIENT_COUNTERS = (
+    "connections_opened", "requests_sent", "streams_total", "stream_errors",
+    "busy_rejections", "first_token_seconds_total", "prompt_tokens_total",
+    "prompt_eval_seconds_total",
+)
+
+
+def render_metrics(prefix, stats, counters=()):
+    """
+    Render a stats dict in the Prometheus text format. Keys listed in
+    counters are exported as counters, so rate() works on them; the rest
+    are gauges.
+    """
+    lines = []
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        lines.append(f"# TYPE {name} {'counter' if key in counters else 'gauge'}")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
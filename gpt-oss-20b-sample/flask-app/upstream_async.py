@@ -0,0 +1,129 @@
+"""
+Async pooled client for the Ollama API, used by the ASGI app (asgi_app.py).
+
+A streaming chat costs one coroutine and one socket instead of a worker
+thread, so a single process can hold hundreds of open generations. It
+reads the same OLLAMA_* variables as upstream.py, except that
+OLLAMA_MAX_STREAMS defaults to 500 here: OLLAMA_POOL_SIZE is the number of
+idle keep-alive connections kept, and up to OLLAMA_MAX_STREAMS connections
+may be open at once.
+"""
+
+import asyncio
+import json
+import os
+import time
+
+import httpx
+
+from upstream import UpstreamBusy
+
+
+class AsyncOllamaClient:
+    """Pooled httpx client for Ollama's streaming chat API."""
+
+    def __init__(self, host, pool_size=10, max_streams=500, connect_timeout=5.0,
+                 read_timeout=300.0, stream_wait=30.0):
+        self.host = host.rstrip("/")
+        self.pool_size = pool_size
+        self.max_streams = max_streams
+        self.stream_wait = stream_wait
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_streams,
+                                max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout,
+                                  pool=stream_wait),
+        )
+        self._slots = asyncio.Semaphore(max_streams)
+
+        self.active_streams = 0
+        self.streams_total = 0
+        self.stream_errors = 0
+        self.busy_rejections = 0
+        self.first_token_seconds_total = 0.0
+        self.prompt_tokens_total = 0
+        self.prompt_eval_seconds_total = 0.0
+
+    async def chat_stream(self, payload):
+        """
+        Send a chat request with "stream": true and yield the content of
+        each message chunk as it arrives.
+
+        Raises:
+            UpstreamBusy: if no stream slot freed up within stream_wait
+            httpx.HTTPError: on connection errors, timeouts and error
+                statuses from Ollama
+        """
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.stream_wait)
+        except asyncio.TimeoutError:
+            self.busy_rejections += 1
+            raise UpstreamBusy(f"{self.max_streams} chats are already running")
+        self.active_streams += 1
+        self.streams_total += 1
+        start = time.perf_counter()
+        first_token = True
+        try:
+            async with self.client.stream("POST", f"{self.host}/api/chat",
+                                          json=payload) as r:
+                r.raise_for_status()
+                # Read to the end of the body so the connection is kept alive
+                async for line in r.aiter_lines():
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    content = event.get("message", {}).get("content")
+                    if content:
+                        if first_token:
+                            first_token = False
+                            self.first_token_seconds_total += time.perf_counter() - start
+                        yield content
+                    if event.get("done"):
+                        self._record_prompt_eval(event)
+        except Exception:
+            self.stream_errors += 1
+            raise
+        finally:
+            self.active_streams -= 1
+            self._slots.release()
+
+    def _record_prompt_eval(self, event):
+        """Add the prompt evaluation figures of a final "done" event."""
+        self.prompt_tokens_total += event.get("prompt_eval_count", 0)
+        self.prompt_eval_seconds_total += event.get("prompt_eval_duration", 0) / 1e9
+
+    async def warm(self):
+        """Open a pooled connection ahead of the first chat. Errors are ignored."""
+        try:
+            await self.client.get(f"{self.host}/api/version")
+        except httpx.HTTPError:
+            pass
+
+    def stats(self):
+        """Return the pool configuration and stream counters."""
+        return {
+            "pool_size": self.pool_size,
+            "max_streams": self.max_streams,
+            "active_streams": self.active_streams,
+            "streams_total": self.streams_total,
+            "stream_errors": self.stream_errors,
+            "busy_rejections": self.busy_rejections,
+            "first_token_seconds_total": self.first_token_seconds_total,
+            "prompt_tokens_total": self.prompt_tokens_total,
+            "prompt_eval_seconds_total": self.prompt_eval_seconds_total,
+        }
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+def async_client_from_env():
+    """Build an async client from the OLLAMA_* environment variables."""
+    return AsyncOllamaClient(
+        os.environ.get("OLLAMA_HOST", "http://localhost:11434"),
+        pool_size=int(os.environ.get("OLLAMA_POOL_SIZE", 10)),
+        max_streams=int(os.environ.get("OLLAMA_MAX_STREAMS", 500)),
+        connect_timeout=float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", 5)),
+        read_timeout=float(os.environ.get("OLLAMA_READ_TIMEOUT", 300)),
+        stream_wait=float(os.environ.get("OLLAMA_STREAM_WAIT", 30)),
+    )
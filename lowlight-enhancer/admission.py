@@ -0,0 +1,273 @@
+"""
+Admission control for image requests.
+A small, highly compressed upload can decode to hundreds of megapixels, and
+the enhancement pipeline holds several full-size planes per image. Image
+dimensions are therefore read from the header before anything is decoded:
+oversized images are rejected or decoded at a reduced scale, and every
+admitted image reserves its pixels from a process-wide in-flight budget,
+waiting for room if the budget is in use.
+"""
+
+import io
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+
+from PIL import Image
+
+# Scale denominators the JPEG decoder can apply while decoding
+JPEG_REDUCTIONS = (1, 2, 4, 8)
+
+
+class AdmissionError(Exception):
+    """An image request that cannot be served; carries the HTTP status."""
+
+    status_code = 500
+    retry_after: Optional[int] = None
+
+
+class ImageTooLarge(AdmissionError):
+    """The image has more pixels than a single request may use."""
+
+    status_code = 413
+
+
+class BudgetExhausted(AdmissionError):
+    """The in-flight pixel budget stayed full for the whole admission timeout."""
+
+    status_code = 503
+    retry_after = 5
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Read-only binary file over a bytes-like object.
+
+    io.BytesIO copies any buffer that is not a bytes object, so wrapping a
+    view of the request buffer in it would copy the whole upload; this
+    reader only copies the chunks that are read.
+    """
+
+    def __init__(self, data):
+        self._view = memoryview(data).cast('B')
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        if base + offset < 0:
+            raise ValueError(f"Negative seek position {base + offset}")
+        self._pos = base + offset
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else self._pos + size
+        chunk = self._view[self._pos:end].tobytes()
+        self._pos += len(chunk)
+        return chunk
+
+    def readinto(self, buffer) -> int:
+        chunk = self._view[self._pos:self._pos + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+
+def read_image_header(data) -> Optional[Tuple[int, int, str]]:
+    """
+    Return (width, height, format) from an image's header without decoding it.
+
+    Returns None if Pillow does not recognise the format.
+
+    Raises:
+        ImageTooLarge: if Pillow's own decompression bomb limit is exceeded
+    """
+    try:
+        with Image.open(BufferReader(data)) as img:
+            return img.size[0], img.size[1], img.format
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e)) from e
+    except Exception:
+        return None
+
+
+def jpeg_reduction(width: int, height: int, max_pixels: int) -> Optional[int]:
+    """
+    Return the smallest JPEG decode scale denominator that brings the image
+    within max_pixels, or None if even 1/8 is too large.
+    """
+    for reduction in JPEG_REDUCTIONS:
+        if -(-width // reduction) * -(-height // reduction) <= max_pixels:
+            return reduction
+    return None
+
+
+class DecodePlan:
+    """How an admitted image will be decoded."""
+
+    def __init__(self, width: int, height: int, reduction: int = 1, reserve: int = 0):
+        """
+        Args:
+            width: Width stored in the header (0 if unknown)
+            height: Height stored in the header (0 if unknown)
+            reduction: JPEG decode scale denominator (1 = full size)
+            reserve: Pixels to hold in the budget when the size is unknown
+        """
+        self.width = width
+        self.height = height
+        self.reduction = reduction
+        self.reserve = reserve
+
+    @property
+    def pixels(self) -> int:
+        """Pixels of the decoded image, or the reservation if its size is unknown."""
+        if not self.width or not self.height:
+            return self.reserve
+        return -(-self.width // self.reduction) * -(-self.height // self.reduction)
+
+
+def draft_reduction(width: int, height: int, side: int) -> int:
+    """
+    Return the scale denominator Pillow's JPEG draft mode picks when asked
+    for at least side x side pixels.
+    """
+    scale = min(width // side, height // side)
+    return max(r for r in JPEG_REDUCTIONS if r <= max(scale, 1))
+
+
+def plan_decode(
+    data,
+    max_pixels: int,
+    downscale: bool = True,
+    draft_side: Optional[int] = None
+) -> DecodePlan:
+    """
+    Decide how to decode an upload from its header.
+
+    Args:
+        data: Encoded image bytes
+        max_pixels: Most pixels one decoded image may have
+        downscale: Decode oversized JPEGs at a reduced scale instead of
+            rejecting them
+        draft_side: For previews decoded in JPEG draft mode, the requested
+            size; the plan then accounts for the reduced decode
+
+    Raises:
+        ImageTooLarge: if the image is over max_pixels and cannot be
+            decoded small enough
+    """
+    header = read_image_header(data)
+    if header is None:
+        # Unknown to Pillow; OpenCV may still decode it, so it is checked
+        # again after decoding. Until then, assume the largest allowed size
+        return DecodePlan(0, 0, reserve=max_pixels)
+
+    width, height, fmt = header
+    if draft_side and fmt == 'JPEG':
+        plan = DecodePlan(width, height, draft_reduction(width, height, draft_side))
+        if plan.pixels <= max_pixels:
+            return plan
+    if width * height <= max_pixels:
+        return DecodePlan(width, height)
+
+    reduction = jpeg_reduction(width, height, max_pixels) if downscale and fmt == 'JPEG' else None
+    if reduction is None:
+        raise ImageTooLarge(
+            f"Image is {width}x{height} ({width * height / 1e6:.1f} MP); "
+            f"the limit is {max_pixels / 1e6:.1f} MP"
+        )
+    return DecodePlan(width, height, reduction)
+
+
+class PixelBudget:
+    """
+    Process-wide budget of pixels being processed at once.
+
+    Requests reserve their decoded pixel count before decoding and wait, in
+    arrival order, until the budget has room. A request larger than the
+    whole budget is admitted once nothing else is in flight, so it can
+    still run, alone.
+    """
+
+    def __init__(self, max_pixels: int, timeout: float = 30.0):
+        """
+        Args:
+            max_pixels: Pixels that may be in flight at once
+            timeout: Seconds a request may wait for room
+        """
+        self.max_pixels = max_pixels
+        self.timeout = timeout
+        self._changed = threading.Condition()
+        self._in_flight = 0
+        self._waiters = []
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+
+    def _fits(self, pixels: int) -> bool:
+        """True if pixels can be admitted now."""
+        return self._in_flight == 0 or self._in_flight + pixels <= self.max_pixels
+
+    @contextmanager
+    def reserve(self, pixels: int) -> Iterator[None]:
+        """
+        Hold pixels of the budget for the duration of the block.
+
+        Raises:
+            BudgetExhausted: if there was no room within the timeout
+        """
+        with self._changed:
+            if self._waiters or not self._fits(pixels):
+                self._wait(pixels)
+            self._in_flight += pixels
+            self.admitted += 1
+        try:
+            yield
+        finally:
+            with self._changed:
+                self._in_flight -= pixels
+                self._changed.notify_all()
+
+    def _wait(self, pixels: int) -> None:
+        """Queue behind earlier waiters until pixels fit (lock held)."""
+        ticket = object()
+        self._waiters.append(ticket)
+        self.queued += 1
+        start = time.monotonic()
+        deadline = start + self.timeout
+        try:
+            while self._waiters[0] is not ticket or not self._fits(pixels):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.rejected += 1
+                    raise BudgetExhausted(
+                        f"Server is busy ({self._in_flight / 1e6:.0f} MP in flight), try again later"
+                    )
+                self._changed.wait(remaining)
+        finally:
+            self._waiters.remove(ticket)
+            self.wait_seconds_total += time.monotonic() - start
+            self._changed.notify_all()
+
+    def stats(self) -> dict:
+        """Return the budget, current use and counters."""
+        with self._changed:
+            return {
+                'max_pixels': self.max_pixels,
+                'in_flight_pixels': self._in_flight,
+                'waiting': len(self._waiters),
+                'admitted': self.admitted,
+                'queued': self.queued,
+                'rejected': self.rejected,
+                'wait_seconds_total': self.wait_seconds_total,
+            }
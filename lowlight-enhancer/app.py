@@ -5,12 +5,23 @@ A simple Flask application for enhancing low-light images with side-by-side comp
 
 import os
 import io
+import json
+import uuid
 import base64
-from flask import Flask, render_template, request, jsonify
+from contextlib import ExitStack, contextmanager
+from flask import Flask, render_template, request, jsonify, Response, g, has_request_context, stream_with_context, url_for
 from PIL import Image
 import numpy as np
 import cv2
-from enhancer import LowLightEnhancer
+from admission import AdmissionError, BufferReader, ImageTooLarge, PixelBudget, plan_decode
+from enhancer import ENHANCEMENT_PRESETS, get_shared_enhancer
+from exposure import FULL, ExposurePolicy
+from result_cache import ResultCache, content_digest, make_cache_key
+from sessions import ImageSession, SessionStore
+from jobs import DONE, FAILED, JobQueue, QueueFull
+from metrics import StageMetrics, render_stats
+from timing import StageTimer, stage
+from workers import get_worker_pool
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
@@ -19,12 +30,423 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 UPLOAD_FOLDER = 'uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Cache of encoded results; the disk tier is off unless ENHANCE_DISK_CACHE_MB is set
+result_cache = ResultCache(
+    max_bytes=int(os.environ.get('ENHANCE_CACHE_MB', 256)) * 1024 * 1024,
+    disk_dir=os.path.join(UPLOAD_FOLDER, 'cache'),
+    disk_max_bytes=int(os.environ.get('ENHANCE_DISK_CACHE_MB', 0)) * 1024 * 1024
+)
 
-def pil_to_base64(img):
-    """Convert PIL Image to base64 string."""
-    buffered = io.BytesIO()
-    img.save(buffered, format="PNG")
-    return base64.b64encode(buffered.getvalue()).decode()
+# Upload-once sessions: prepared LAB planes kept under a token
+session_store = SessionStore(
+    max_bytes=int(os.environ.get('ENHANCE_SESSION_MB', 512)) * 1024 * 1024,
+    ttl=float(os.environ.get('ENHANCE_SESSION_TTL', 600))
+)
+
+# Background jobs for large requests; few workers so interactive requests keep the CPU
+job_queue = JobQueue(
+    workers=int(os.environ.get('ENHANCE_JOB_WORKERS', 1)),
+    max_queued=int(os.environ.get('ENHANCE_JOB_QUEUE', 16)),
+    result_ttl=float(os.environ.get('ENHANCE_JOB_TTL', 600))
+)
+
+# Admission control: most pixels one request may decode, what to do with
+# larger images ('downscale' decodes JPEGs at 1/2-1/8 scale, 'reject'
+# returns 413) and the pixels all requests may have in flight at once
+MAX_REQUEST_PIXELS = int(float(os.environ.get('ENHANCE_MAX_MEGAPIXELS', 50)) * 1_000_000)
+DOWNSCALE_OVERSIZE = os.environ.get('ENHANCE_OVERSIZE', 'downscale') == 'downscale'
+pixel_budget = PixelBudget(
+    max_pixels=int(float(os.environ.get('ENHANCE_PIXEL_BUDGET_MEGAPIXELS', 150)) * 1_000_000),
+    timeout=float(os.environ.get('ENHANCE_ADMISSION_TIMEOUT', 30))
+)
+
+# Exposure analysis: with 'auto', uploads that are already well lit skip the
+# pipeline (or get only the tone curve). ENHANCE_AUTO=1 makes it the default
+AUTO_DEFAULT = os.environ.get('ENHANCE_AUTO', '0').lower() in ('1', 'true', 'yes', 'on')
+exposure_policy = ExposurePolicy(
+    skip_mean=float(os.environ.get('ENHANCE_AUTO_SKIP_MEAN', 115)),
+    lut_mean=float(os.environ.get('ENHANCE_AUTO_LUT_MEAN', 80)),
+    min_spread=float(os.environ.get('ENHANCE_AUTO_MIN_SPREAD', 120)),
+    max_shadow_fraction=float(os.environ.get('ENHANCE_AUTO_MAX_SHADOWS', 0.2))
+)
+
+# Request and stage duration histograms served on /metrics
+stage_metrics = StageMetrics()
+
+# Endpoints left out of the request histograms (monitoring and streams)
+UNTIMED_ENDPOINTS = {'metrics', 'static', 'job_events', 'cache_stats', 'sessions_stats', 'jobs_stats'}
+
+# Request bodies parsed in the 'read' stage
+FORM_MIMETYPES = {'multipart/form-data', 'application/x-www-form-urlencoded'}
+
+
+# Output formats for binary responses: name -> (OpenCV extension, MIME type)
+OUTPUT_FORMATS = {
+    'png': ('.png', 'image/png'),
+    'jpeg': ('.jpg', 'image/jpeg'),
+    'webp': ('.webp', 'image/webp'),
+}
+RESPONSE_MODES = ('json', 'binary', 'multipart')
+DEFAULT_QUALITY = 90
+
+# Live preview settings: longest side of the proxy image and JPEG quality
+PREVIEW_MAX_SIDE = 640
+PREVIEW_MAX_SIDE_LIMIT = 2048
+PREVIEW_QUALITY = 80
+
+# Longest side of the preset strip thumbnails
+VARIANTS_MAX_SIDE = 320
+
+# Frames smaller than this are enhanced in the request thread even when the
+# process pool is enabled (ENHANCE_PROCESSES), as the hand-off costs more
+PROCESS_MIN_PIXELS = int(os.environ.get('ENHANCE_PROCESS_MIN_PIXELS', 1_000_000))
+
+# Decode flags for uploads: 3-channel BGR, keep pixel orientation as stored
+DECODE_FLAGS = cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION
+
+# Decode flags for JPEGs decoded at a reduced scale, by scale denominator
+REDUCED_DECODE_FLAGS = {
+    1: DECODE_FLAGS,
+    2: cv2.IMREAD_REDUCED_COLOR_2 | cv2.IMREAD_IGNORE_ORIENTATION,
+    4: cv2.IMREAD_REDUCED_COLOR_4 | cv2.IMREAD_IGNORE_ORIENTATION,
+    8: cv2.IMREAD_REDUCED_COLOR_8 | cv2.IMREAD_IGNORE_ORIENTATION,
+}
+
+
+def read_upload(file_storage):
+    """
+    Return the bytes of an upload.
+    
+    Uploads held in memory are returned as a view of the request buffer
+    rather than a copy; larger ones spooled to disk are read once.
+    """
+    stream = getattr(file_storage, 'stream', file_storage)
+    with stage('read'):
+        if isinstance(stream, io.BytesIO):
+            return stream.getbuffer()
+        return file_storage.read()
+
+
+@contextmanager
+def admit_image(data, draft_side=None):
+    """
+    Check an upload's dimensions from its header and hold its pixels in
+    the in-flight budget for the duration of the block.
+    
+    Args:
+        data: Raw uploaded bytes
+        draft_side: Requested preview size when the image will be decoded
+            in JPEG draft mode
+    
+    Yields:
+        DecodePlan with the scale to decode at
+    
+    Raises:
+        ImageTooLarge: if the image cannot be decoded within the limit
+        BudgetExhausted: if the budget stayed full for the admission timeout
+    """
+    with ExitStack() as stack:
+        with stage('admission'):
+            plan = plan_decode(data, MAX_REQUEST_PIXELS, DOWNSCALE_OVERSIZE, draft_side)
+            stack.enter_context(pixel_budget.reserve(plan.pixels))
+        yield plan
+
+
+@contextmanager
+def admit_prepared(prepared):
+    """
+    Hold a session image's pixels in the in-flight budget while it is
+    rendered, as admit_image does for uploads.
+    
+    Raises:
+        BudgetExhausted: if the budget stayed full for the admission timeout
+    """
+    height, width = prepared.shape[:2]
+    with ExitStack() as stack:
+        with stage('admission'):
+            stack.enter_context(pixel_budget.reserve(height * width))
+        yield
+
+
+def decode_image_bytes(data, reduction=1):
+    """
+    Decode uploaded bytes straight into a contiguous BGR uint8 array.
+    
+    OpenCV decodes directly from the request buffer; formats it cannot
+    read (such as GIF) fall back to Pillow.
+    
+    Args:
+        data: Raw uploaded bytes
+        reduction: JPEG decode scale denominator from the admission plan
+    """
+    with stage('decode'):
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), REDUCED_DECODE_FLAGS[reduction])
+        if image is None:
+            img_pil = Image.open(BufferReader(data))
+            if img_pil.mode != 'RGB':
+                img_pil = img_pil.convert('RGB')
+            image = cv2.cvtColor(np.asarray(img_pil), cv2.COLOR_RGB2BGR)
+    # Formats without a header Pillow understands are only checked here
+    if image.shape[0] * image.shape[1] > MAX_REQUEST_PIXELS:
+        raise ImageTooLarge(f"Image is {image.shape[1]}x{image.shape[0]}; the limit is "
+                            f"{MAX_REQUEST_PIXELS / 1e6:.1f} MP")
+    return image
+
+
+def decode_preview_image(data, max_side=PREVIEW_MAX_SIDE):
+    """
+    Decode a downscaled RGB proxy of an uploaded image.
+    
+    JPEG uploads are decoded in draft mode, which lets the decoder skip
+    straight to a reduced scale (1/2, 1/4 or 1/8) so the full-size image is
+    never materialised.
+    
+    Returns:
+        RGB uint8 numpy array
+    """
+    with stage('decode'):
+        img_pil = Image.open(BufferReader(data))
+        if img_pil.format == 'JPEG':
+            img_pil.draft('RGB', (max_side, max_side))
+        
+        if img_pil.mode != 'RGB':
+            img_pil = img_pil.convert('RGB')
+        img_pil.thumbnail((max_side, max_side), Image.BILINEAR)
+        return np.asarray(img_pil)
+
+
+def encode_array(image, fmt='png', quality=DEFAULT_QUALITY, bgr=True):
+    """
+    Encode a numpy image to bytes.
+    
+    Args:
+        image: uint8 image array
+        fmt: One of OUTPUT_FORMATS
+        quality: Quality for lossy formats (1-100)
+        bgr: False if the image is in RGB channel order
+        
+    Returns:
+        Encoded image bytes
+    """
+    with stage('encode'):
+        if not bgr:
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        params = {
+            'jpeg': [cv2.IMWRITE_JPEG_QUALITY, quality],
+            'webp': [cv2.IMWRITE_WEBP_QUALITY, quality],
+        }.get(fmt, [])
+        ok, encoded = cv2.imencode(OUTPUT_FORMATS[fmt][0], image, params)
+        if not ok:
+            raise ValueError(f"Could not encode image as {fmt}")
+        return encoded.tobytes()
+
+
+def data_url(payload, mimetype):
+    """Wrap encoded bytes in a base64 data URL."""
+    with stage('base64'):
+        return f'data:{mimetype};base64,{base64.b64encode(payload).decode()}'
+
+
+def analyze_exposure(image, bgr=True):
+    """
+    Decide how much enhancement an image needs and keep the report for the
+    X-Enhance-Decision header of the current request.
+    """
+    with stage('analysis'):
+        report = exposure_policy.analyze(image, bgr)
+    if has_request_context():
+        g.exposure_report = report
+    return report
+
+
+def enhance_array(image, clip_limit=2.0, gamma=1.2, brightness=1.1, bgr=True,
+                  auto=False, report=None):
+    """
+    Enhance a numpy image with the web app's settings.
+    
+    With auto, the image is analysed first and well-lit images skip some or
+    all of the pipeline; report is an analysis already made for image.
+    """
+    enhancer = get_shared_enhancer()
+    if auto or report is not None:
+        enhanced, _ = enhancer.enhance_auto(
+            image, clip_limit, gamma, brightness, saturation_mode='lab', bgr=bgr,
+            policy=exposure_policy, report=report or analyze_exposure(image, bgr)
+        )
+        return enhanced
+    return enhancer.enhance_image(
+        image,
+        clip_limit=clip_limit,
+        gamma=gamma,
+        brightness_boost=brightness,
+        saturation_mode='lab',
+        bgr=bgr
+    )
+
+
+def enhance_image_bytes(data, clip_limit=2.0, gamma=1.2, brightness=1.1):
+    """
+    Decode and enhance uploaded image bytes.
+    
+    The image stays in OpenCV's BGR order from decode to encode, so no
+    channel-swapping copies are made.
+    
+    Returns:
+        Enhanced image as a BGR numpy array
+    """
+    with admit_image(data) as plan:
+        return enhance_array(
+            decode_image_bytes(data, plan.reduction), clip_limit, gamma, brightness
+        )
+
+
+def enhance_and_encode(data, clip_limit, gamma, brightness, fmt, quality=DEFAULT_QUALITY,
+                       auto=False):
+    """
+    Decode, enhance and encode uploaded image bytes.
+    
+    With ENHANCE_PROCESSES set, large frames are enhanced in the shared-memory
+    process pool and encoded straight from the shared output buffer. With
+    auto, only frames that need the full pipeline go to the pool.
+    
+    Returns:
+        Encoded image bytes
+    """
+    with admit_image(data) as plan:
+        image = decode_image_bytes(data, plan.reduction)
+        report = analyze_exposure(image) if auto else None
+        pool = get_worker_pool()
+        if (pool is not None and image.shape[0] * image.shape[1] >= PROCESS_MIN_PIXELS
+                and (report is None or report.decision == FULL)):
+            return pool.enhance(
+                image, clip_limit, gamma, brightness, saturation_mode='lab', bgr=True,
+                consume=lambda enhanced: encode_array(enhanced, fmt, quality)
+            )
+        return encode_array(
+            enhance_array(image, clip_limit, gamma, brightness, report=report), fmt, quality
+        )
+
+
+def preview_image_bytes(data, max_side=PREVIEW_MAX_SIDE, clip_limit=2.0,
+                        gamma=1.2, brightness=1.1, auto=False):
+    """
+    Enhance a downscaled proxy of an uploaded image for live previews.
+    
+    Args:
+        data: Raw uploaded bytes
+        max_side: Longest side of the preview in pixels
+        clip_limit: CLAHE clip limit
+        gamma: Gamma correction value
+        brightness: Brightness boost factor
+        auto: Analyse the exposure first, see enhance_array
+        
+    Returns:
+        Enhanced preview as an RGB numpy array
+    """
+    with admit_image(data, draft_side=max_side):
+        proxy = decode_preview_image(data, max_side)
+        return enhance_array(proxy, clip_limit, gamma, brightness, bgr=False, auto=auto)
+
+
+def create_session(data, preview_max_side=PREVIEW_MAX_SIDE):
+    """
+    Decode an upload once and prepare it for repeated enhancement.
+    
+    Args:
+        data: Raw uploaded bytes
+        preview_max_side: Longest side of the preview proxy
+        
+    Returns:
+        ImageSession keyed by the content digest of data
+    """
+    enhancer = get_shared_enhancer()
+    with admit_image(data) as plan:
+        full = enhancer.prepare(decode_image_bytes(data, plan.reduction), bgr=True)
+        preview = enhancer.prepare(decode_preview_image(data, preview_max_side), bgr=False)
+    # Keep a private copy: data may be a view of the request buffer
+    return ImageSession(content_digest(data), bytes(data), full, preview)
+
+
+def render_enhanced(data, session, clip_limit, gamma, brightness, fmt, quality, auto=False):
+    """
+    Enhance an upload or session image and encode it.
+    
+    Sessions only re-run the stages after CLAHE when the clip limit was
+    used before. auto applies to uploads only: session images are always
+    fully enhanced.
+    
+    Returns:
+        Encoded image bytes
+    """
+    if session is None:
+        return enhance_and_encode(data, clip_limit, gamma, brightness, fmt, quality, auto)
+    with admit_prepared(session.full):
+        enhanced = session.full.render(
+            clip_limit, gamma, brightness, saturation_mode='lab'
+        )
+        return encode_array(enhanced, fmt, quality)
+
+
+# Leading bytes of common image formats -> MIME type
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF8', 'image/gif'),
+    (b'BM', 'image/bmp'),
+    (b'II*\x00', 'image/tiff'),
+    (b'MM\x00*', 'image/tiff'),
+)
+
+
+def upload_mimetype(data):
+    """Return the MIME type of uploaded image bytes from their signature."""
+    head = bytes(data[:16])
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, mimetype in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return mimetype
+    return 'application/octet-stream'
+
+
+# Upload types every browser can show in an <img>; others are re-encoded
+BROWSER_IMAGE_TYPES = {'image/jpeg', 'image/png', 'image/webp', 'image/gif'}
+
+
+def original_data_url(data):
+    """
+    Return the upload as a data URL a browser can display.
+    
+    JPEG, PNG, WebP and GIF uploads are sent as uploaded; other formats
+    (TIFF, BMP, ...) are decoded and re-encoded as PNG.
+    """
+    mimetype = upload_mimetype(data)
+    if mimetype in BROWSER_IMAGE_TYPES:
+        return data_url(data, mimetype)
+    with admit_image(data) as plan:
+        image = decode_image_bytes(data, plan.reduction)
+        return data_url(encode_array(image, 'png'), 'image/png')
+
+
+def process_image_bytes(data, clip_limit=2.0, gamma=1.2, brightness=1.1, auto=False,
+                        session=None):
+    """
+    Process uploaded image bytes for the JSON response.
+    
+    Browser-safe originals are returned as uploaded rather than re-encoded;
+    the enhanced image is encoded once as PNG. With a session, the enhanced
+    image is rendered from its prepared image, as in render_enhanced.
+    
+    Returns:
+        dict with 'original' and 'enhanced' base64 data URLs
+    """
+    enhanced = render_enhanced(
+        data, session, clip_limit, gamma, brightness, 'png', DEFAULT_QUALITY, auto
+    )
+    return {
+        'original': original_data_url(data),
+        'enhanced': data_url(enhanced, 'image/png')
+    }
 
 
 def process_uploaded_image(file_storage, clip_limit=2.0, gamma=1.2, brightness=1.1):
@@ -40,36 +462,106 @@ def process_uploaded_image(file_storage, clip_limit=2.0, gamma=1.2, brightness=1
     Returns:
         dict with 'original' and 'enhanced' base64 encoded images
     """
-    # Read image from file storage
-    img_pil = Image.open(file_storage)
-    
-    # Convert to RGB if necessary
-    if img_pil.mode != 'RGB':
-        img_pil = img_pil.convert('RGB')
+    return process_image_bytes(
+        read_upload(file_storage), clip_limit, gamma, brightness
+    )
+
+
+def multipart_response(parts):
+    """
+    Build a multipart/mixed response.
     
-    # Convert to numpy array
-    img_array = np.array(img_pil)
+    Args:
+        parts: list of (name, content_type, bytes) tuples
+    """
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, content_type, payload in parts:
+        body.write(f'--{boundary}\r\n'.encode())
+        body.write(f'Content-Disposition: inline; name="{name}"\r\n'.encode())
+        body.write(f'Content-Type: {content_type}\r\n'.encode())
+        body.write(f'Content-Length: {len(payload)}\r\n\r\n'.encode())
+        body.write(payload)
+        body.write(b'\r\n')
+    body.write(f'--{boundary}--\r\n'.encode())
+    return Response(body.getvalue(), mimetype=f'multipart/mixed; boundary={boundary}')
+
+
+def error_response(error):
+    """
+    Turn an exception from image processing into a JSON error response:
+    admission errors keep their status (413 or 503), anything else is a 500.
+    """
+    if isinstance(error, AdmissionError):
+        response = jsonify({'error': str(error)})
+        if error.retry_after:
+            response.headers['Retry-After'] = str(error.retry_after)
+        return response, error.status_code
+    return jsonify({'error': str(error)}), 500
+
+
+def parse_output_options(form):
+    """
+    Read the response mode, output format and quality from a request form.
     
-    # Enhance the image
-    enhancer = LowLightEnhancer()
-    enhanced_array = enhancer.enhance_image(
-        img_array,
-        clip_limit=clip_limit,
-        gamma=gamma,
-        brightness_boost=brightness
-    )
+    Raises:
+        ValueError: if an option is not recognised
+    """
+    response_mode = form.get('response', 'json')
+    if response_mode not in RESPONSE_MODES:
+        raise ValueError(f"response must be one of {', '.join(RESPONSE_MODES)}")
     
-    # Convert back to PIL
-    enhanced_pil = Image.fromarray(enhanced_array)
+    fmt = form.get('format', 'png').lower()
+    if fmt == 'jpg':
+        fmt = 'jpeg'
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(OUTPUT_FORMATS)}")
     
-    # Convert to base64
-    original_b64 = pil_to_base64(img_pil)
-    enhanced_b64 = pil_to_base64(enhanced_pil)
+    quality = int(form.get('quality', DEFAULT_QUALITY))
+    if not 1 <= quality <= 100:
+        raise ValueError("quality must be between 1 and 100")
     
-    return {
-        'original': f'data:image/png;base64,{original_b64}',
-        'enhanced': f'data:image/png;base64,{enhanced_b64}'
-    }
+    return response_mode, fmt, quality
+
+
+@app.before_request
+def start_stage_timer():
+    """
+    Time the stages of each request on its thread. Form uploads are parsed
+    here, inside the 'read' stage, so it covers receiving the body rather
+    than only handing out the parsed buffer.
+    """
+    g.stage_timer = StageTimer().__enter__()
+    if request.endpoint not in UNTIMED_ENDPOINTS and request.mimetype in FORM_MIMETYPES:
+        with stage('read'):
+            request.form
+
+
+@app.after_request
+def add_server_timing(response):
+    """Report the request's stages in a Server-Timing header and in /metrics."""
+    timer = g.pop('stage_timer', None)
+    if timer is not None:
+        timer.__exit__(None, None, None)
+        response.headers['Server-Timing'] = timer.server_timing()
+        if request.endpoint not in UNTIMED_ENDPOINTS:
+            stage_metrics.observe(
+                request.endpoint or 'unknown', timer.stages, timer.elapsed,
+                response.status_code
+            )
+    # Set when an upload went through exposure analysis ('auto')
+    report = g.pop('exposure_report', None)
+    if report is not None:
+        response.headers['X-Enhance-Decision'] = report.header_value()
+    return response
+
+
+@app.teardown_request
+def stop_stage_timer(exc=None):
+    """Deactivate the timer if the request failed before after_request ran."""
+    timer = g.pop('stage_timer', None)
+    if timer is not None:
+        timer.__exit__(None, None, None)
 
 
 @app.route('/')
@@ -78,28 +570,448 @@ def index():
     return render_template('index.html')
 
 
-@app.route('/enhance', methods=['POST'])
-def enhance():
-    """Handle image enhancement requests."""
+def parse_enhance_params(form):
+    """
+    Read clip_limit, gamma and brightness from a request form.
+    
+    Raises:
+        ValueError: if a value is not a number
+    """
+    return (
+        float(form.get('clip_limit', 2.0)),
+        float(form.get('gamma', 1.2)),
+        float(form.get('brightness', 1.1)),
+    )
+
+
+def parse_auto(form):
+    """Read the 'auto' flag from a request form, defaulting to ENHANCE_AUTO."""
+    value = form.get('auto')
+    if value is None:
+        return AUTO_DEFAULT
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def auto_output_key(output_key, auto):
+    """Keep auto and regular results apart in the result cache."""
+    return f'{output_key}:auto' if auto else output_key
+
+
+def read_image_source():
+    """
+    Resolve the image a request refers to: an upload or a session token.
+    
+    Returns:
+        (data, digest, session, error_response). session is None for plain
+        uploads; error_response is set when the request cannot be served.
+    """
+    token = request.form.get('token')
+    if token:
+        session = session_store.get(token)
+        if session is None:
+            return None, None, None, (jsonify({'error': 'Unknown or expired token'}), 404)
+        return session.data, session.token, session, None
+    
     if 'image' not in request.files:
-        return jsonify({'error': 'No image provided'}), 400
+        return None, None, None, (jsonify({'error': 'No image provided'}), 400)
     
     file = request.files['image']
     
     if file.filename == '':
-        return jsonify({'error': 'No image selected'}), 400
+        return None, None, None, (jsonify({'error': 'No image selected'}), 400)
+    
+    # Read the upload once: it is both the cache key and the decoder input
+    data = read_upload(file)
+    return data, content_digest(data), None, None
+
+
+@app.route('/upload', methods=['POST'])
+def upload():
+    """
+    Decode an image once and return a token for later /enhance and
+    /preview requests, which then only need to send parameters.
+    """
+    data, digest, _, error = read_image_source()
+    if error:
+        return error
+    
+    try:
+        preview_max_side = int(request.form.get('max_side', PREVIEW_MAX_SIDE))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    preview_max_side = max(64, min(preview_max_side, PREVIEW_MAX_SIDE_LIMIT))
+    
+    session = session_store.get(digest)
+    try:
+        if session is None:
+            session = create_session(data, preview_max_side)
+            if not session_store.put(session):
+                return jsonify({'error': 'Image too large to keep in a session'}), 413
+    except Exception as e:
+        return error_response(e)
+    
+    height, width = session.full.shape[:2]
+    return jsonify({
+        'token': session.token,
+        'width': width,
+        'height': height,
+        'ttl_seconds': session_store.ttl,
+    })
+
+
+@app.route('/enhance', methods=['POST'])
+def enhance():
+    """
+    Handle image enhancement requests.
     
+    The image is either uploaded as 'image' or referenced by a 'token' from
+    /upload, in which case only the tone and saturation stages are re-run
+    when just gamma or brightness changed.
+    
+    With 'auto' (or ENHANCE_AUTO), uploads are analysed first and
+    well-lit ones are returned as they are or only tone-mapped; the
+    decision is reported in the X-Enhance-Decision header.
+    """
     # Get parameters from form
-    clip_limit = float(request.form.get('clip_limit', 2.0))
-    gamma = float(request.form.get('gamma', 1.2))
-    brightness = float(request.form.get('brightness', 1.1))
+    try:
+        clip_limit, gamma, brightness = parse_enhance_params(request.form)
+        response_mode, fmt, quality = parse_output_options(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    data, digest, session, error = read_image_source()
+    if error:
+        return error
+    auto = parse_auto(request.form) and session is None
     
     try:
+        output_key = 'json' if response_mode == 'json' else f'{fmt}:{quality}'
+        key = make_cache_key(
+            digest, (clip_limit, gamma, brightness), auto_output_key(output_key, auto)
+        )
+        payload = result_cache.get(key)
+        cache_status = 'HIT' if payload is not None else 'MISS'
+        
         # Process the image
-        result = process_uploaded_image(file, clip_limit, gamma, brightness)
-        return jsonify(result)
+        if response_mode == 'json':
+            if payload is None:
+                result = process_image_bytes(
+                    data, clip_limit, gamma, brightness, auto, session
+                )
+                payload = json.dumps(result).encode()
+                result_cache.put(key, payload)
+            response = Response(payload, mimetype='application/json')
+            response.headers['X-Cache'] = cache_status
+            return response
+        
+        # Binary modes return only the enhanced image; the client already
+        # has the original
+        if payload is None:
+            payload = render_enhanced(
+                data, session, clip_limit, gamma, brightness, fmt, quality, auto
+            )
+            result_cache.put(key, payload)
+        mimetype = OUTPUT_FORMATS[fmt][1]
+        
+        if response_mode == 'binary':
+            response = Response(payload, mimetype=mimetype)
+        else:
+            # Only the header is parsed here, which is cheap even on cache hits
+            width, height = Image.open(io.BytesIO(payload)).size
+            metadata = json.dumps({
+                'width': width,
+                'height': height,
+                'format': fmt,
+            }).encode()
+            response = multipart_response([
+                ('metadata', 'application/json', metadata),
+                ('enhanced', mimetype, payload),
+            ])
+        response.headers['X-Cache'] = cache_status
+        return response
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
+
+
+@app.route('/preview', methods=['POST'])
+def preview():
+    """Enhance a low-resolution proxy of the image for slider interaction."""
+    try:
+        clip_limit, gamma, brightness = parse_enhance_params(request.form)
+        max_side = int(request.form.get('max_side', PREVIEW_MAX_SIDE))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    max_side = max(64, min(max_side, PREVIEW_MAX_SIDE_LIMIT))
+    
+    data, digest, session, error = read_image_source()
+    if error:
+        return error
+    auto = parse_auto(request.form) and session is None
+    
+    try:
+        # Token previews use the proxy prepared at upload time
+        if session is not None:
+            max_side = max(session.preview.shape[:2])
+        key = make_cache_key(
+            digest, (clip_limit, gamma, brightness),
+            auto_output_key(f'preview:{max_side}', auto)
+        )
+        payload = result_cache.get(key)
+        cache_status = 'HIT' if payload is not None else 'MISS'
+        if payload is None:
+            if session is not None:
+                with admit_prepared(session.preview):
+                    rendered = session.preview.render(
+                        clip_limit, gamma, brightness, saturation_mode='lab'
+                    )
+                    payload = encode_array(
+                        rendered, 'jpeg', PREVIEW_QUALITY, bgr=session.preview.is_bgr
+                    )
+            else:
+                rendered = preview_image_bytes(
+                    data, max_side, clip_limit, gamma, brightness, auto
+                )
+                payload = encode_array(rendered, 'jpeg', PREVIEW_QUALITY, bgr=False)
+            result_cache.put(key, payload)
+        
+        response = Response(payload, mimetype='image/jpeg')
+        response.headers['X-Cache'] = cache_status
+        return response
+    except Exception as e:
+        return error_response(e)
+
+
+@app.route('/variants', methods=['POST'])
+def variants():
+    """
+    Render a strip of preset variants of the image.
+    
+    Optional form fields: 'presets' (comma-separated names, default all)
+    and 'max_side' (thumbnail size). The LAB conversion is shared by all
+    variants and CLAHE runs once per distinct clip limit. Session images
+    are rendered from their preview proxy.
+    """
+    names = request.form.get('presets')
+    names = [n.strip() for n in names.split(',')] if names else list(ENHANCEMENT_PRESETS)
+    unknown = [n for n in names if n not in ENHANCEMENT_PRESETS]
+    if unknown:
+        return jsonify({'error': f"Unknown presets: {', '.join(unknown)}"}), 400
+    try:
+        max_side = int(request.form.get('max_side', VARIANTS_MAX_SIDE))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    max_side = max(64, min(max_side, PREVIEW_MAX_SIDE_LIMIT))
+    
+    data, digest, session, error = read_image_source()
+    if error:
+        return error
+    
+    try:
+        # Token thumbnails come from the preview proxy, so they are at most
+        # its size and differ from an upload's; keep them apart in the cache
+        source = 'upload'
+        if session is not None:
+            max_side = min(max_side, max(session.preview.shape[:2]))
+            source = 'proxy'
+        key = make_cache_key(digest, (), f"variants:{','.join(names)}:{max_side}:{source}")
+        payload = result_cache.get(key)
+        cache_status = 'HIT' if payload is not None else 'MISS'
+        if payload is None:
+            if session is not None:
+                # Render from the session's preview proxy and downscale the
+                # results, so the original is never decoded again
+                prepared = session.preview
+            else:
+                with admit_image(data, draft_side=max_side):
+                    proxy = decode_preview_image(data, max_side)
+                    prepared = get_shared_enhancer().prepare(proxy, bgr=False)
+            
+            presets = {name: ENHANCEMENT_PRESETS[name] for name in names}
+            images = {}
+            with admit_prepared(prepared):
+                rendered_arrays = prepared.render_variants(presets, saturation_mode='lab')
+            for name, rendered in rendered_arrays.items():
+                height, width = rendered.shape[:2]
+                scale = max_side / max(height, width)
+                if scale < 1:
+                    rendered = cv2.resize(
+                        rendered, (round(width * scale), round(height * scale)),
+                        interpolation=cv2.INTER_AREA
+                    )
+                encoded = encode_array(
+                    rendered, 'jpeg', PREVIEW_QUALITY, bgr=prepared.is_bgr
+                )
+                images[name] = data_url(encoded, 'image/jpeg')
+            
+            payload = json.dumps({
+                'variants': [
+                    {
+                        'name': name,
+                        'clip_limit': presets[name][0],
+                        'gamma': presets[name][1],
+                        'brightness': presets[name][2],
+                        'image': images[name],
+                    }
+                    for name in names
+                ]
+            }).encode()
+            result_cache.put(key, payload)
+        
+        response = Response(payload, mimetype='application/json')
+        response.headers['X-Cache'] = cache_status
+        return response
+    except Exception as e:
+        return error_response(e)
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Queue an enhancement to run in the background.
+    
+    Takes the same 'image' or 'token', parameters, 'format' and 'quality'
+    fields as /enhance and returns 202 with a job id straight away. Poll
+    /jobs/<id>, or stream /jobs/<id>/events, then fetch /jobs/<id>/result.
+    """
+    try:
+        clip_limit, gamma, brightness = parse_enhance_params(request.form)
+        _, fmt, quality = parse_output_options(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    data, digest, session, error = read_image_source()
+    if error:
+        return error
+    
+    if session is None:
+        # Reject oversized images now rather than failing the job later
+        try:
+            plan_decode(data, MAX_REQUEST_PIXELS, DOWNSCALE_OVERSIZE)
+        except AdmissionError as e:
+            return error_response(e)
+    
+    auto = parse_auto(request.form) and session is None
+    key = make_cache_key(
+        digest, (clip_limit, gamma, brightness), auto_output_key(f'{fmt}:{quality}', auto)
+    )
+    # Keep a private copy: data may be a view of the request buffer
+    data = bytes(data)
+    
+    def run():
+        with StageTimer() as timer:
+            payload = result_cache.get(key)
+            if payload is None:
+                payload = render_enhanced(
+                    data, session, clip_limit, gamma, brightness, fmt, quality, auto
+                )
+                result_cache.put(key, payload)
+        stage_metrics.observe('job', timer.stages, timer.elapsed)
+        return payload
+    
+    try:
+        job = job_queue.submit(run, OUTPUT_FORMATS[fmt][1])
+    except QueueFull as e:
+        response = jsonify({'error': f'Job queue is full ({e}), try again later'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    
+    status_url = url_for('job_status', job_id=job.id)
+    info = job_queue.describe(job)
+    info.update({
+        'status_url': status_url,
+        'events_url': url_for('job_events', job_id=job.id),
+        'result_url': url_for('job_result', job_id=job.id),
+    })
+    response = jsonify(info)
+    response.headers['Location'] = status_url
+    return response, 202
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Report a job's status and queue position."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(job_queue.describe(job))
+
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Stream a job's status changes as server-sent events until it finishes."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    
+    def events():
+        for info in job_queue.watch(job):
+            if info is None:
+                yield ': keep-alive\n\n'
+            else:
+                yield f"event: status\ndata: {json.dumps(info)}\n\n"
+    
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    """Return a finished job's enhanced image, or its status if not done yet."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    if job.status == DONE:
+        return Response(job.result, mimetype=job.mimetype)
+    if job.status == FAILED:
+        return jsonify(job_queue.describe(job)), 500
+    response = jsonify(job_queue.describe(job))
+    response.headers['Retry-After'] = '1'
+    return response, 202
+
+
+@app.route('/jobs/stats')
+def jobs_stats():
+    """Report job queue depth, counters and queue wait times."""
+    return jsonify(job_queue.stats())
+
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Report result cache hit/miss counters and sizes."""
+    return jsonify(result_cache.stats())
+
+
+@app.route('/sessions/stats')
+def sessions_stats():
+    """Report upload session counters and sizes."""
+    return jsonify(session_store.stats())
+
+
+@app.route('/metrics')
+def metrics():
+    """
+    Expose request/stage duration histograms and the cache, session, job
+    queue, admission and exposure decision counters in the Prometheus text
+    format.
+    """
+    lines = stage_metrics.render()
+    lines += render_stats('enhancer_cache', result_cache.stats(), 'Result cache statistic.',
+                          counters=('hits', 'disk_hits', 'misses'))
+    lines += render_stats('enhancer_sessions', session_store.stats(), 'Upload session statistic.',
+                          counters=('created', 'expired', 'evicted'))
+    lines += render_stats('enhancer_jobs', job_queue.stats(), 'Background job queue statistic.',
+                          counters=('submitted', 'completed', 'failed', 'rejected', 'expired'))
+    lines += render_stats('enhancer_admission', pixel_budget.stats(), 'Pixel budget admission statistic.',
+                          counters=('admitted', 'queued', 'rejected', 'wait_seconds_total'))
+    lines += render_stats('enhancer_exposure', exposure_policy.stats(), 'Exposure analysis threshold or decision count.',
+                          counters=('decisions',))
+    pool = get_worker_pool()
+    if pool is not None:
+        lines += render_stats('enhancer_workers', pool.stats(), 'Shared-memory worker pool statistic.',
+                              counters=('calls', 'segments_created'))
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,339 @@
+"""
+Batch Low-Light Image Enhancement
+Enhance many image files in parallel, spreading decode, enhance and encode
+across a pool of worker processes.
+
+Usage:
+    python batch.py input_images output_images --pattern "*.jpg" --workers 8
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from enhancer import SATURATION_MODES, check_saturation_mode, get_shared_enhancer
+from manifest import BatchManifest, bytes_digest
+
+
+# Maximum number of failures kept in the summary
+MAX_REPORTED_ERRORS = 20
+
+# Manifest file name used by --incremental, inside the output directory
+DEFAULT_MANIFEST_NAME = '.enhance_manifest.jsonl'
+
+
+def _init_worker() -> None:
+    """Keep OpenCV single-threaded inside pool workers to avoid oversubscription."""
+    cv2.setNumThreads(1)
+
+
+def _enhance_one(
+    input_path: str,
+    output_path: str,
+    params: Dict
+) -> Tuple[str, Optional[str], int, Optional[str]]:
+    """
+    Decode, enhance and encode a single file inside a worker process.
+
+    Returns:
+        (input_path, error message or None, number of pixels processed,
+        content hash of the input or None on failure)
+    """
+    try:
+        # Read the bytes once: they are both hashed for the manifest and decoded
+        with open(input_path, 'rb') as f:
+            data = f.read()
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError(f"Could not read image from {input_path}")
+
+        enhanced = get_shared_enhancer().enhance_image(
+            image,
+            clip_limit=params['clip_limit'],
+            gamma=params['gamma'],
+            brightness_boost=params['brightness'],
+            saturation_mode=params['saturation_mode'],
+            bgr=True
+        )
+
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        if not cv2.imwrite(output_path, enhanced):
+            raise ValueError(f"Could not write image to {output_path}")
+        return input_path, None, image.shape[0] * image.shape[1], bytes_digest(data)
+    except Exception as e:
+        return input_path, str(e), 0, None
+
+
+def _print_progress(summary: Dict) -> None:
+    """Default progress callback: one status line on stderr."""
+    print(
+        f"\r{summary['succeeded']} done, {summary['failed']} failed, "
+        f"{summary['images_per_second']:.1f} img/s, "
+        f"{summary['megapixels_per_second']:.1f} MP/s",
+        end='',
+        file=sys.stderr,
+        flush=True
+    )
+
+
+def enhance_batch(
+    jobs: Iterable[Tuple[str, str]],
+    clip_limit: float = 2.0,
+    gamma: float = 1.2,
+    brightness: float = 1.1,
+    saturation_mode: str = 'hsv',
+    workers: Optional[int] = None,
+    max_in_flight: Optional[int] = None,
+    progress: Optional[Callable[[Dict], None]] = None,
+    progress_interval: float = 1.0,
+    manifest: Optional[BatchManifest] = None
+) -> Dict:
+    """
+    Enhance a stream of (input_path, output_path) pairs in parallel.
+
+    Jobs are consumed lazily and at most max_in_flight files are queued at
+    once, so very long job lists do not pile up in memory.
+
+    With a manifest, inputs already enhanced into the same output with the
+    same parameters, and unchanged since, are skipped; every newly
+    enhanced file is recorded as soon as it finishes, so an interrupted
+    run resumes where it stopped.
+
+    Args:
+        jobs: Iterable of (input_path, output_path) pairs
+        clip_limit: CLAHE clip limit parameter
+        gamma: Gamma correction parameter
+        brightness: Brightness boost parameter
+        saturation_mode: 'hsv' or 'lab', see LowLightEnhancer.enhance_image
+        workers: Number of worker processes (default: CPU count). With 1,
+            files are processed in the calling process
+        max_in_flight: Maximum number of queued files (default: 4 per worker)
+        progress: Called with the running summary at most every
+            progress_interval seconds and once at the end
+        progress_interval: Seconds between progress callbacks
+        manifest: Processed-file manifest for incremental runs
+
+    Returns:
+        Summary dict with counts (including skipped files), elapsed time,
+        throughput and the first few errors as (input_path, message) pairs
+    """
+    check_saturation_mode(saturation_mode)
+
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 4
+    params = {
+        'clip_limit': clip_limit,
+        'gamma': gamma,
+        'brightness': brightness,
+        'saturation_mode': saturation_mode,
+    }
+
+    summary = {
+        'succeeded': 0,
+        'failed': 0,
+        'skipped': 0,
+        'pixels': 0,
+        'elapsed': 0.0,
+        'images_per_second': 0.0,
+        'megapixels_per_second': 0.0,
+        'errors': [],
+    }
+    start = time.perf_counter()
+    last_report = start
+
+    # Input (size, mtime) captured when each job was queued, for the manifest
+    queued_stats = {}
+
+    def pending_jobs():
+        """Yield the jobs that still need work, counting skipped ones."""
+        for input_path, output_path in jobs:
+            input_path, output_path = str(input_path), str(output_path)
+            if manifest is not None:
+                if manifest.is_current(input_path, output_path, params):
+                    summary['skipped'] += 1
+                    continue
+                try:
+                    stat = os.stat(input_path)
+                    queued_stats[input_path] = (output_path, stat.st_size, stat.st_mtime_ns)
+                except OSError:
+                    pass
+            yield input_path, output_path
+
+    def record(result):
+        nonlocal last_report
+        input_path, error, pixels, digest = result
+        queued = queued_stats.pop(input_path, None)
+        if error is None:
+            summary['succeeded'] += 1
+            summary['pixels'] += pixels
+            if manifest is not None and queued is not None:
+                output_path, size, mtime_ns = queued
+                manifest.record(input_path, output_path, params, digest, size, mtime_ns)
+        else:
+            summary['failed'] += 1
+            if len(summary['errors']) < MAX_REPORTED_ERRORS:
+                summary['errors'].append((input_path, error))
+
+        now = time.perf_counter()
+        elapsed = now - start
+        summary['elapsed'] = elapsed
+        if elapsed > 0:
+            summary['images_per_second'] = (summary['succeeded'] + summary['failed']) / elapsed
+            summary['megapixels_per_second'] = summary['pixels'] / 1e6 / elapsed
+        if progress and now - last_report >= progress_interval:
+            last_report = now
+            progress(summary)
+
+    if workers == 1:
+        for input_path, output_path in pending_jobs():
+            record(_enhance_one(input_path, output_path, params))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            pending = set()
+            for input_path, output_path in pending_jobs():
+                if len(pending) >= max_in_flight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        record(future.result())
+                pending.add(pool.submit(_enhance_one, input_path, output_path, params))
+
+            for future in wait(pending).done:
+                record(future.result())
+
+    summary['elapsed'] = time.perf_counter() - start
+    if progress:
+        progress(summary)
+    return summary
+
+
+def iter_directory_jobs(
+    input_dir: str,
+    output_dir: str,
+    pattern: str = '*.jpg',
+    prefix: str = 'enhanced_',
+    recursive: bool = False
+) -> Iterator[Tuple[str, str]]:
+    """
+    Yield (input_path, output_path) pairs for files matching pattern.
+
+    Outputs keep the input's relative path, with prefix added to the file name.
+    """
+    input_root = Path(input_dir)
+    output_root = Path(output_dir)
+    paths = input_root.rglob(pattern) if recursive else input_root.glob(pattern)
+
+    for image_path in paths:
+        if not image_path.is_file():
+            continue
+        relative = image_path.relative_to(input_root)
+        output_path = output_root / relative.parent / f"{prefix}{relative.name}"
+        yield str(image_path), str(output_path)
+
+
+def enhance_directory(
+    input_dir: str,
+    output_dir: str,
+    pattern: str = '*.jpg',
+    prefix: str = 'enhanced_',
+    recursive: bool = False,
+    incremental: bool = False,
+    manifest_path: Optional[str] = None,
+    **kwargs
+) -> Dict:
+    """
+    Enhance every image in a directory in parallel.
+
+    Args:
+        input_dir: Directory containing input images
+        output_dir: Directory to save enhanced images
+        pattern: Glob pattern selecting input files
+        prefix: Prefix added to output file names
+        recursive: Also search subdirectories, mirroring them in output_dir
+        incremental: Skip files that are unchanged since a previous run,
+            tracked in a manifest inside output_dir
+        manifest_path: Manifest file to use instead (implies incremental)
+        **kwargs: Passed on to enhance_batch
+
+    Returns:
+        Summary dict from enhance_batch
+    """
+    if not Path(input_dir).is_dir():
+        raise ValueError(f"Input directory not found: {input_dir}")
+    os.makedirs(output_dir, exist_ok=True)
+
+    jobs = iter_directory_jobs(input_dir, output_dir, pattern, prefix, recursive)
+    if not (incremental or manifest_path):
+        return enhance_batch(jobs, **kwargs)
+
+    manifest_path = manifest_path or os.path.join(output_dir, DEFAULT_MANIFEST_NAME)
+    with BatchManifest(manifest_path) as manifest:
+        return enhance_batch(jobs, manifest=manifest, **kwargs)
+
+
+def main(argv=None) -> int:
+    """Command-line entry point."""
+    parser = argparse.ArgumentParser(
+        description="Enhance all low-light images in a directory in parallel."
+    )
+    parser.add_argument('input_dir', help="directory containing input images")
+    parser.add_argument('output_dir', help="directory to save enhanced images")
+    parser.add_argument('--pattern', default='*.jpg', help="glob pattern for input files (default: *.jpg)")
+    parser.add_argument('--prefix', default='enhanced_', help="prefix for output file names (default: enhanced_)")
+    parser.add_argument('--recursive', action='store_true', help="also process subdirectories")
+    parser.add_argument('--clip-limit', type=float, default=2.0, help="CLAHE clip limit (default: 2.0)")
+    parser.add_argument('--gamma', type=float, default=1.2, help="gamma correction (default: 1.2)")
+    parser.add_argument('--brightness', type=float, default=1.1, help="brightness boost (default: 1.1)")
+    parser.add_argument('--saturation-mode', choices=SATURATION_MODES, default='hsv',
+                        help="saturation boost mode (default: hsv)")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('--max-in-flight', type=int, default=None,
+                        help="maximum queued files (default: 4 per worker)")
+    parser.add_argument('--incremental', action='store_true',
+                        help=f"skip files unchanged since the last run (manifest: OUTPUT_DIR/{DEFAULT_MANIFEST_NAME})")
+    parser.add_argument('--manifest', default=None, help="manifest file for incremental runs (implies --incremental)")
+    parser.add_argument('--quiet', action='store_true', help="do not print progress")
+    args = parser.parse_args(argv)
+
+    summary = enhance_directory(
+        args.input_dir,
+        args.output_dir,
+        pattern=args.pattern,
+        prefix=args.prefix,
+        recursive=args.recursive,
+        incremental=args.incremental,
+        manifest_path=args.manifest,
+        clip_limit=args.clip_limit,
+        gamma=args.gamma,
+        brightness=args.brightness,
+        saturation_mode=args.saturation_mode,
+        workers=args.workers,
+        max_in_flight=args.max_in_flight,
+        progress=None if args.quiet else _print_progress
+    )
+    if not args.quiet:
+        print(file=sys.stderr)
+
+    print(
+        f"Enhanced {summary['succeeded']} images ({summary['pixels'] / 1e6:.1f} MP) "
+        f"in {summary['elapsed']:.1f}s: {summary['images_per_second']:.1f} img/s, "
+        f"{summary['megapixels_per_second']:.1f} MP/s"
+    )
+    if summary['skipped']:
+        print(f"Skipped {summary['skipped']} unchanged images")
+    for input_path, error in summary['errors']:
+        print(f"Failed: {input_path}: {error}", file=sys.stderr)
+    if summary['failed'] > len(summary['errors']):
+        print(f"... and {summary['failed'] - len(summary['errors'])} more failures", file=sys.stderr)
+
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
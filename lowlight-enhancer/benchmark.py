@@ -0,0 +1,521 @@
+"""
+Benchmarks for the Low-Light Image Enhancer.
+Run with `python benchmark.py` to measure per-call overhead of the enhancer.
+
+Run `python benchmark.py --suite` for the regression suite: enhance_image,
+enhance_image_file and the /enhance route on synthetic images from 0.3 to
+48 MP, with per-stage timings and peak memory, compared against a stored
+baseline JSON:
+
+    python benchmark.py --suite --update-baseline   # record a baseline
+    python benchmark.py --suite                     # compare against it
+
+The comparison prints each case next to its baseline figures and exits 1
+if any case regressed past the thresholds. benchmark_baseline.json in the
+repository was recorded on a single-core Linux container; record your own
+before relying on the comparison.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from admission import read_image_header
+from enhancer import (
+    ENHANCEMENT_PRESETS,
+    LowLightEnhancer,
+    enhance_image_file,
+    get_shared_enhancer,
+)
+
+
+def _time_per_call(func, repeat=200):
+    """Return the mean wall time of func() in milliseconds."""
+    func()  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def synthetic_image(width, height, seed=0):
+    """
+    Create a dark RGB test image with some low-frequency structure.
+
+    checks.py uses the same images, so the output for a seed must not change.
+    """
+    rng = np.random.default_rng(seed)
+    coarse = (rng.random((height // 16 + 1, width // 16 + 1, 3)) * 90).astype(np.uint8)
+    return cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+
+
+def bench_clahe_reuse(repeat=200):
+    """Compare creating a CLAHE object per call with reusing a cached one."""
+    print("CLAHE object reuse (320x240 L channel)")
+
+    l_channel = cv2.cvtColor(synthetic_image(320, 240), cv2.COLOR_RGB2LAB)[:, :, 0].copy()
+    enhancer = LowLightEnhancer()
+
+    def create_per_call():
+        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        clahe.apply(l_channel)
+
+    def cached():
+        enhancer._get_clahe(2.0).apply(l_channel)
+
+    fresh_ms = _time_per_call(create_per_call, repeat)
+    cached_ms = _time_per_call(cached, repeat)
+    print(f"  createCLAHE per call: {fresh_ms:.3f} ms")
+    print(f"  cached CLAHE:         {cached_ms:.3f} ms")
+    print(f"  saved per call:       {fresh_ms - cached_ms:.3f} ms\n")
+
+
+def bench_shared_enhancer(repeat=200):
+    """Compare a new LowLightEnhancer per request with the shared instance."""
+    print("Enhancer reuse (320x240 RGB image)")
+
+    image = synthetic_image(320, 240)
+
+    def new_per_call():
+        LowLightEnhancer().enhance_image(image)
+
+    def shared():
+        get_shared_enhancer().enhance_image(image)
+
+    fresh_ms = _time_per_call(new_per_call, repeat)
+    shared_ms = _time_per_call(shared, repeat)
+    print(f"  new enhancer per call: {fresh_ms:.3f} ms")
+    print(f"  shared enhancer:       {shared_ms:.3f} ms")
+    print(f"  saved per call:        {fresh_ms - shared_ms:.3f} ms\n")
+
+
+def traced_peak(func, repeat):
+    """Return the peak traced allocation, in bytes, while calling func() repeat times."""
+    func()  # warm-up: CLAHE objects, LUTs and workspaces are created here
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        for _ in range(repeat):
+            func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - baseline
+
+
+def bench_steady_state_allocations(repeat=20):
+    """Measure per-frame allocations with and without caller-provided buffers."""
+    print("Steady-state allocations (640x480 RGB frames)")
+
+    image = synthetic_image(640, 480)
+    out = np.empty_like(image)
+    enhancer = get_shared_enhancer()
+
+    def allocating():
+        enhancer.enhance_image(image)
+
+    def reusing():
+        enhancer.enhance_image(image, out=out)
+
+    frame_bytes = image.nbytes
+    allocating_peak = traced_peak(allocating, repeat)
+    reusing_peak = traced_peak(reusing, repeat)
+    print(f"  frame size:                 {frame_bytes} bytes")
+    print(f"  peak allocated, new arrays: {allocating_peak} bytes")
+    print(f"  peak allocated, out=:       {reusing_peak} bytes\n")
+
+
+def _child_peak_rss(func):
+    """
+    Run func() in a forked child and return the child's peak RSS in bytes.
+
+    Unlike tracemalloc this also sees memory allocated inside Pillow and
+    OpenCV. Returns None where fork is unavailable.
+    """
+    import multiprocessing
+    import resource
+
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return None
+
+    def run(conn):
+        func()
+        # ru_maxrss is in kilobytes on Linux
+        conn.send(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+        conn.close()
+
+    context = multiprocessing.get_context('fork')
+    parent_conn, child_conn = context.Pipe(duplex=False)
+    process = context.Process(target=run, args=(child_conn,))
+    process.start()
+    peak = parent_conn.recv()
+    process.join()
+    return peak
+
+
+def _load_app():
+    """Import the Flask app without creating its uploads folder here."""
+    # app.py creates its uploads folder relative to the working directory
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        from app import app, result_cache
+    finally:
+        os.chdir(cwd)
+    return app, result_cache
+
+
+def bench_request_memory(width=4000, height=3000):
+    """Profile peak traced memory of one /enhance request, in frame-size units."""
+    print(f"Per-request memory profile ({width}x{height} JPEG upload, binary JPEG response)")
+
+    app, result_cache = _load_app()
+
+    image = synthetic_image(width, height)
+    ok, encoded = cv2.imencode('.jpg', image)
+    upload = encoded.tobytes()
+    frame_bytes = image.nbytes
+    client = app.test_client()
+
+    def request():
+        # Disable the result cache so every request does the full work
+        result_cache.max_bytes = 0
+        response = client.post('/enhance', data={
+            'image': (io.BytesIO(upload), 'frame.jpg'),
+            'response': 'binary',
+            'format': 'jpeg',
+        })
+        assert response.status_code == 200, response.get_json()
+
+    peak = traced_peak(request, 1)
+    print(f"  frame size:          {frame_bytes / 1e6:.1f} MB")
+    print(f"  peak numpy/Python:   {peak / 1e6:.1f} MB ({peak / frame_bytes:.1f}x frame)")
+
+    # Reading the header from a view of the request buffer must not copy the upload
+    view = io.BytesIO(upload).getbuffer()
+    header_peak = traced_peak(lambda: read_image_header(view), 1)
+    print(f"  header read:         {header_peak / 1e6:.2f} MB (upload {len(upload) / 1e6:.1f} MB)")
+
+    # Peak RSS above an idle child also counts Pillow's and OpenCV's own buffers
+    idle_rss = _child_peak_rss(lambda: None)
+    request_rss = _child_peak_rss(request)
+    if idle_rss is not None:
+        growth = request_rss - idle_rss
+        print(f"  peak RSS growth:     {growth / 1e6:.1f} MB ({growth / frame_bytes:.1f}x frame)")
+    print()
+
+
+# Suite image sizes as name -> (width, height)
+SUITE_SIZES = {
+    '0.3mp': (640, 480),
+    '2mp': (1920, 1080),
+    '12mp': (4000, 3000),
+    '48mp': (8000, 6000),
+}
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# Allowed slowdown / memory growth relative to the baseline before a case fails
+DEFAULT_TIME_THRESHOLD = 0.25
+DEFAULT_MEMORY_THRESHOLD = 0.10
+
+# Time budget per timed case, used to pick the number of repeats
+CASE_SECONDS = 2.0
+MAX_REPEAT = 20
+
+
+def _median_ms(func):
+    """
+    Return the median wall time of func() in milliseconds.
+
+    Runs func once to warm up and to size the number of repeats to about
+    CASE_SECONDS, so large images are timed fewer times than small ones.
+    """
+    start = time.perf_counter()
+    func()
+    first = time.perf_counter() - start
+    repeat = max(3, min(MAX_REPEAT, int(CASE_SECONDS / max(first, 1e-6))))
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def _stage_timings(enhancer, image, clip_limit, gamma, brightness):
+    """Time each stage of the default (hsv) pipeline on an RGB image."""
+    l, a, b = enhancer._split_lab(image, False)
+    l_equalized = enhancer._get_clahe(clip_limit).apply(l)
+    l_toned = enhancer._apply_tone_curve(l_equalized, gamma, brightness)
+    rgb = cv2.cvtColor(cv2.merge([l_toned, a, b]), cv2.COLOR_LAB2RGB)
+
+    return {
+        'to_lab': _median_ms(lambda: enhancer._split_lab(image, False)),
+        'clahe': _median_ms(lambda: enhancer._get_clahe(clip_limit).apply(l)),
+        'tone_curve': _median_ms(
+            lambda: enhancer._apply_tone_curve(l_equalized, gamma, brightness)
+        ),
+        'from_lab': _median_ms(
+            lambda: cv2.cvtColor(cv2.merge([l_toned, a, b]), cv2.COLOR_LAB2RGB)
+        ),
+        'saturation': _median_ms(lambda: enhancer._boost_saturation(rgb, 1.1)),
+    }
+
+
+def _suite_case(func):
+    """Return the timing and peak traced memory of one case."""
+    return {
+        'ms': round(_median_ms(func), 3),
+        'peak_mb': round(traced_peak(func, 1) / 1e6, 2),
+    }
+
+
+def run_suite(sizes=None, presets=None, http=True, verbose=True):
+    """
+    Run the regression suite.
+
+    Args:
+        sizes: Names from SUITE_SIZES to run (default: all)
+        presets: Names from ENHANCEMENT_PRESETS to time enhance_image with
+            (default: all)
+        http: Also benchmark the /enhance route through the Flask test client
+        verbose: Print each result as it is measured
+
+    Returns:
+        Dict with an 'environment' description and 'results' mapping case
+        name -> {'ms', 'peak_mb'} (plus 'stages' for the stage breakdown)
+    """
+    sizes = sizes or list(SUITE_SIZES)
+    presets = presets or list(ENHANCEMENT_PRESETS)
+    enhancer = get_shared_enhancer()
+    results = {}
+
+    def record(name, result):
+        results[name] = result
+        if verbose:
+            line = f"  {name:<32} {result['ms']:>10.2f} ms"
+            if 'peak_mb' in result:
+                line += f" {result['peak_mb']:>9.1f} MB peak"
+            print(line)
+            for stage, ms in result.get('stages', {}).items():
+                print(f"    {stage:<30} {ms:>10.2f} ms")
+
+    if http:
+        app, result_cache = _load_app()
+        client = app.test_client()
+
+    workdir = tempfile.mkdtemp()
+    for size in sizes:
+        width, height = SUITE_SIZES[size]
+        image = synthetic_image(width, height)
+        if verbose:
+            print(f"{size} ({width}x{height})")
+
+        for preset in presets:
+            clip_limit, gamma, brightness = ENHANCEMENT_PRESETS[preset]
+            record(f"enhance_image/{size}/{preset}", _suite_case(
+                lambda: enhancer.enhance_image(image, clip_limit, gamma, brightness)
+            ))
+
+        clip_limit, gamma, brightness = ENHANCEMENT_PRESETS['medium']
+        record(f"enhance_image/{size}/medium-lab", _suite_case(
+            lambda: enhancer.enhance_image(
+                image, clip_limit, gamma, brightness, saturation_mode='lab'
+            )
+        ))
+        stages = {
+            stage: round(ms, 3) for stage, ms in
+            _stage_timings(enhancer, image, clip_limit, gamma, brightness).items()
+        }
+        record(f"stages/{size}/medium", {
+            'ms': round(sum(stages.values()), 3), 'stages': stages,
+        })
+
+        input_path = os.path.join(workdir, f"{size}.jpg")
+        output_path = os.path.join(workdir, f"{size}_enhanced.jpg")
+        cv2.imwrite(input_path, image)
+
+        def file_case():
+            with contextlib.redirect_stdout(io.StringIO()):
+                enhance_image_file(input_path, output_path, clip_limit, gamma, brightness)
+
+        record(f"enhance_image_file/{size}/medium", _suite_case(file_case))
+
+        if http:
+            with open(input_path, 'rb') as f:
+                upload = f.read()
+
+            def http_case():
+                # Keep the result cache out of the measurement
+                result_cache.max_bytes = 0
+                response = client.post('/enhance', data={
+                    'image': (io.BytesIO(upload), 'frame.jpg'),
+                    'clip_limit': clip_limit,
+                    'gamma': gamma,
+                    'brightness': brightness,
+                    'response': 'binary',
+                    'format': 'jpeg',
+                })
+                assert response.status_code == 200, response.get_json()
+
+            record(f"http_enhance/{size}/medium", _suite_case(http_case))
+
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'opencv_threads': cv2.getNumThreads(),
+        },
+        'results': results,
+    }
+
+
+def compare_to_baseline(
+    report,
+    baseline,
+    time_threshold=DEFAULT_TIME_THRESHOLD,
+    memory_threshold=DEFAULT_MEMORY_THRESHOLD
+):
+    """
+    Compare suite results against a baseline report.
+
+    Returns:
+        List of (case, description) regressions; cases missing from either
+        report are skipped
+    """
+    regressions = []
+    for name, result in report['results'].items():
+        previous = baseline['results'].get(name)
+        if previous is None:
+            continue
+        if result['ms'] > previous['ms'] * (1 + time_threshold):
+            regressions.append((
+                name,
+                f"time {previous['ms']:.2f} -> {result['ms']:.2f} ms "
+                f"(+{(result['ms'] / previous['ms'] - 1) * 100:.0f}%)"
+            ))
+        if 'peak_mb' in result and 'peak_mb' in previous and \
+                result['peak_mb'] > previous['peak_mb'] * (1 + memory_threshold) + 0.1:
+            regressions.append((
+                name,
+                f"peak memory {previous['peak_mb']:.1f} -> {result['peak_mb']:.1f} MB"
+            ))
+    return regressions
+
+
+def print_comparison(report, baseline):
+    """Print each case's time and peak memory next to its baseline figures."""
+    print(f"\n{'case':<34} {'baseline':>10} {'now':>10} {'change':>8} {'peak MB':>17}")
+    for name, result in report['results'].items():
+        previous = baseline['results'].get(name)
+        if previous is None:
+            print(f"{name:<34} {'-':>10} {result['ms']:>10.2f}")
+            continue
+        change = (result['ms'] / previous['ms'] - 1) * 100 if previous['ms'] else 0.0
+        line = f"{name:<34} {previous['ms']:>10.2f} {result['ms']:>10.2f} {change:>+7.0f}%"
+        if 'peak_mb' in result and 'peak_mb' in previous:
+            line += f" {previous['peak_mb']:>8.1f} -> {result['peak_mb']:.1f}"
+        print(line)
+
+
+def main_suite(args):
+    """Run the regression suite from parsed command-line arguments."""
+    print("=" * 60)
+    print("Low-Light Image Enhancer - Benchmark Suite")
+    print("=" * 60 + "\n")
+
+    report = run_suite(sizes=args.sizes, presets=args.presets, http=not args.no_http)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline saved to: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --update-baseline to record one")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('environment') != report['environment']:
+        print("\n⚠ Baseline was recorded in a different environment:")
+        print(f"  baseline: {baseline.get('environment')}")
+        print(f"  current:  {report['environment']}")
+
+    print_comparison(report, baseline)
+    regressions = compare_to_baseline(
+        report, baseline, args.time_threshold, args.memory_threshold
+    )
+    if not regressions:
+        print(f"\nNo regressions against {args.baseline}")
+        return 0
+    print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+    for name, description in regressions:
+        print(f"  {name}: {description}")
+    return 1
+
+
+def main_micro():
+    """Run all microbenchmarks."""
+    print("=" * 60)
+    print("Low-Light Image Enhancer - Microbenchmarks")
+    print("=" * 60 + "\n")
+
+    bench_clahe_reuse()
+    bench_shared_enhancer()
+    bench_steady_state_allocations()
+    bench_request_memory()
+
+
+def main(argv=None) -> int:
+    """Command-line entry point."""
+    parser = argparse.ArgumentParser(description="Benchmark the low-light enhancer.")
+    parser.add_argument('--suite', action='store_true',
+                        help="run the regression suite instead of the microbenchmarks")
+    parser.add_argument('--sizes', nargs='+', choices=list(SUITE_SIZES), default=None,
+                        help="image sizes for the suite (default: all)")
+    parser.add_argument('--presets', nargs='+', choices=list(ENHANCEMENT_PRESETS), default=None,
+                        help="parameter presets for the suite (default: all)")
+    parser.add_argument('--no-http', action='store_true', help="skip the /enhance route cases")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help="baseline JSON file (default: benchmark_baseline.json)")
+    parser.add_argument('--update-baseline', action='store_true',
+                        help="save the results as the new baseline instead of comparing")
+    parser.add_argument('--output', default=None, help="also write the results to this JSON file")
+    parser.add_argument('--time-threshold', type=float, default=DEFAULT_TIME_THRESHOLD,
+                        help=f"allowed slowdown as a fraction (default: {DEFAULT_TIME_THRESHOLD})")
+    parser.add_argument('--memory-threshold', type=float, default=DEFAULT_MEMORY_THRESHOLD,
+                        help=f"allowed peak memory growth as a fraction (default: {DEFAULT_MEMORY_THRESHOLD})")
+    args = parser.parse_args(argv)
+
+    if args.suite:
+        return main_suite(args)
+    main_micro()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
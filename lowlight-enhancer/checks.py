@@ -0,0 +1,226 @@
+"""
+Correctness checks for the Low-Light Image Enhancer.
+Run with `python checks.py`; exits with status 1 if any check fails.
+
+The optimized pipeline is compared against a copy of the original
+implementation on fixed synthetic images, with an allowed difference per
+mode: the default 'hsv' mode must match exactly, the 'lab' saturation
+mode within a few levels. The tiled CLAHE stage is compared against
+cv2.CLAHE on the whole image, within one level. Enhancing into
+caller-provided buffers must not allocate image-sized arrays, and
+/variants must not answer an upload with a session's smaller thumbnails.
+"""
+
+import base64
+import io
+import sys
+
+import cv2
+import numpy as np
+
+from benchmark import synthetic_image, traced_peak
+from enhancer import ENHANCEMENT_PRESETS, EnhancementWorkspace, get_shared_enhancer
+from tiled import apply_clahe_luts, compute_clahe_luts
+
+# Fixed test images as (width, height, seed); odd sizes exercise CLAHE
+# tiles that do not divide the image evenly
+CHECK_IMAGES = [(640, 480, 0), (1000, 1200, 1), (333, 257, 2)]
+
+# Allowed absolute difference from the reference, in 8-bit levels, as
+# (max, mean, 99th percentile) per saturation mode
+SATURATION_MODE_TOLERANCE = {
+    'hsv': (0, 0.0, 0),
+    'lab': (16, 2.5, 8),
+}
+
+
+def reference_enhance(image, clip_limit=2.0, gamma=1.2, brightness_boost=1.1):
+    """The original enhance_image for RGB input, kept as the reference output."""
+    lab = cv2.cvtColor(image, cv2.COLOR_RGB2LAB)
+    l, a, b = cv2.split(lab)
+
+    clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=(8, 8))
+    l_enhanced = clahe.apply(l)
+
+    inv_gamma = 1.0 / gamma
+    table = np.array([((i / 255.0) ** inv_gamma) * 255 for i in range(256)]).astype(np.uint8)
+    l_enhanced = cv2.LUT(l_enhanced, table)
+    l_enhanced = np.clip(l_enhanced * brightness_boost, 0, 255).astype(np.uint8)
+
+    enhanced_rgb = cv2.cvtColor(cv2.merge([l_enhanced, a, b]), cv2.COLOR_LAB2RGB)
+
+    hsv = cv2.cvtColor(enhanced_rgb, cv2.COLOR_RGB2HSV).astype(np.float32)
+    hsv[:, :, 1] = np.clip(hsv[:, :, 1] * 1.1, 0, 255)
+    return cv2.cvtColor(hsv.astype(np.uint8), cv2.COLOR_HSV2RGB)
+
+
+def difference_stats(actual, expected):
+    """Return the (max, mean, 99th percentile) absolute difference of two images."""
+    diff = np.abs(actual.astype(np.int16) - expected.astype(np.int16))
+    return int(diff.max()), float(diff.mean()), float(np.percentile(diff, 99))
+
+
+def within(stats, tolerance):
+    """True if each of (max, mean, p99) is at most its bound in tolerance."""
+    return all(value <= bound for value, bound in zip(stats, tolerance))
+
+
+def check_pipeline_equivalence():
+    """Compare enhance_image, with and without out=, against the reference."""
+    print("Pipeline vs. original implementation")
+    enhancer = get_shared_enhancer()
+    ok = True
+    for width, height, seed in CHECK_IMAGES:
+        image = synthetic_image(width, height, seed)
+        out = np.empty_like(image)
+        for preset, (clip_limit, gamma, brightness) in ENHANCEMENT_PRESETS.items():
+            expected = reference_enhance(image, clip_limit, gamma, brightness)
+            for mode, tolerance in SATURATION_MODE_TOLERANCE.items():
+                cases = {
+                    'rgb': enhancer.enhance_image(
+                        image, clip_limit, gamma, brightness, saturation_mode=mode
+                    ),
+                    'bgr': cv2.cvtColor(enhancer.enhance_image(
+                        cv2.cvtColor(image, cv2.COLOR_RGB2BGR), clip_limit, gamma,
+                        brightness, saturation_mode=mode, bgr=True
+                    ), cv2.COLOR_BGR2RGB),
+                    'out=': enhancer.enhance_image(
+                        image, clip_limit, gamma, brightness, saturation_mode=mode, out=out
+                    ),
+                }
+                for case, actual in cases.items():
+                    stats = difference_stats(actual, expected)
+                    if not within(stats, tolerance):
+                        ok = False
+                        print(f"  FAIL {width}x{height} {preset} {mode} {case}: "
+                              f"max {stats[0]}, mean {stats[1]:.2f}, p99 {stats[2]:.0f} "
+                              f"(allowed {tolerance})")
+    print(f"  {'ok' if ok else 'failed'}\n")
+    return ok
+
+
+# Allowed difference between the tiled and the whole-image CLAHE stage, in
+# levels of the equalized L channel. OpenCV builds that round the
+# interpolation differently (e.g. with fused multiply-add) are off by 1
+TILED_CLAHE_TOLERANCE = 1
+
+
+def check_tiled_equivalence():
+    """Compare the tiled CLAHE stage with cv2.CLAHE on the whole image."""
+    print("Tiled vs. whole-image CLAHE")
+    enhancer = get_shared_enhancer()
+    ok = True
+    for width, height, seed in CHECK_IMAGES:
+        image = synthetic_image(width, height, seed)
+        l = cv2.cvtColor(image, cv2.COLOR_RGB2LAB)[:, :, 0]
+        for clip_limit in sorted({preset[0] for preset in ENHANCEMENT_PRESETS.values()}):
+            expected = enhancer._get_clahe(clip_limit).apply(l)
+            luts, cell_size = compute_clahe_luts(
+                image, clip_limit, enhancer.tile_grid_size, chunk_pixels=100_000
+            )
+            # Tiles of an odd size, so they do not line up with the CLAHE cells
+            tile_size = 211
+            tiled = np.empty_like(l)
+            for y0 in range(0, height, tile_size):
+                for x0 in range(0, width, tile_size):
+                    tile = l[y0:y0 + tile_size, x0:x0 + tile_size]
+                    tiled[y0:y0 + tile_size, x0:x0 + tile_size] = apply_clahe_luts(
+                        tile, luts, cell_size, (y0, x0)
+                    )
+            stats = difference_stats(tiled, expected)
+            if stats[0] > TILED_CLAHE_TOLERANCE:
+                ok = False
+                print(f"  FAIL {width}x{height} clip {clip_limit}: max {stats[0]}, "
+                      f"mean {stats[1]:.2f} (allowed {TILED_CLAHE_TOLERANCE})")
+    print(f"  {'ok' if ok else 'failed'}\n")
+    return ok
+
+
+# Largest traced allocation allowed per call with out=, as a fraction of
+# the frame size
+MAX_REUSE_PEAK_FRACTION = 0.01
+
+
+def check_steady_state_allocations(repeat=20):
+    """Check that enhance_image with out= allocates no image-sized buffers."""
+    print("Steady-state allocations with out=")
+    enhancer = get_shared_enhancer()
+    image = synthetic_image(640, 480)
+    out = np.empty_like(image)
+    workspace = EnhancementWorkspace(image.shape)
+    limit = int(image.nbytes * MAX_REUSE_PEAK_FRACTION)
+    cases = {
+        'hsv, out=': lambda: enhancer.enhance_image(image, out=out),
+        'lab, out=': lambda: enhancer.enhance_image(image, saturation_mode='lab', out=out),
+        'hsv, out= + workspace=': lambda: enhancer.enhance_image(
+            image, out=out, workspace=workspace
+        ),
+    }
+    ok = True
+    for case, func in cases.items():
+        peak = traced_peak(func, repeat)
+        if peak > limit:
+            ok = False
+            print(f"  FAIL {case}: peak {peak} bytes (allowed {limit}, frame {image.nbytes})")
+    print(f"  {'ok' if ok else 'failed'}\n")
+    return ok
+
+
+def _thumbnail_sizes(response):
+    """Return {preset: (width, height)} of a /variants JSON response."""
+    sizes = {}
+    for variant in response.get_json()['variants']:
+        encoded = base64.b64decode(variant['image'].partition(',')[2])
+        thumbnail = cv2.imdecode(np.frombuffer(encoded, np.uint8), cv2.IMREAD_COLOR)
+        sizes[variant['name']] = (thumbnail.shape[1], thumbnail.shape[0])
+    return sizes
+
+
+def check_variants_cache():
+    """Check that /variants by token does not answer later uploads from the cache."""
+    print("/variants cache: token vs. upload")
+    from app import app
+
+    image = synthetic_image(1600, 1200, seed=3)
+    _, png = cv2.imencode('.png', cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+    upload = lambda **fields: {'image': (io.BytesIO(png.tobytes()), 'check.png'), **fields}
+    client = app.test_client()
+    token = client.post('/upload', data=upload(max_side='640')).get_json()['token']
+
+    # A token request first, then the same image uploaded with the same fields
+    by_token = client.post('/variants', data={'token': token, 'max_side': '1600'})
+    by_upload = client.post('/variants', data=upload(max_side='1600'))
+    ok = True
+    if max(max(size) for size in _thumbnail_sizes(by_token).values()) > 640:
+        ok = False
+        print(f"  FAIL token thumbnails larger than the 640px proxy: {_thumbnail_sizes(by_token)}")
+    if by_upload.headers.get('X-Cache') != 'MISS':
+        ok = False
+        print(f"  FAIL upload after token: X-Cache {by_upload.headers.get('X-Cache')}")
+    if set(_thumbnail_sizes(by_upload).values()) != {(1600, 1200)}:
+        ok = False
+        print(f"  FAIL upload thumbnails: {_thumbnail_sizes(by_upload)}, expected 1600x1200")
+    print(f"  {'ok' if ok else 'failed'}\n")
+    return ok
+
+
+CHECKS = [
+    check_pipeline_equivalence,
+    check_tiled_equivalence,
+    check_steady_state_allocations,
+    check_variants_cache,
+]
+
+
+def main() -> int:
+    """Run every check; return 1 if any failed."""
+    failed = [check.__name__ for check in CHECKS if not check()]
+    if failed:
+        print(f"{len(failed)} check(s) failed: {', '.join(failed)}")
+        return 1
+    print(f"All {len(CHECKS)} checks passed")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,25 +3,171 @@ Low-Light Image Enhancement Module
 A standalone module for enhancing low-light images.
 """
 
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Mapping, Optional, Tuple
+
 import numpy as np
 import cv2
-from typing import Tuple
+
+from exposure import LUT, SKIP, ExposurePolicy, ExposureReport, get_default_policy
+from timing import stage
+
+
+@lru_cache(maxsize=256)
+def tone_curve(gamma: float, brightness_boost: float) -> np.ndarray:
+    """
+    Build the combined gamma + brightness lookup table for the L channel.
+    
+    The table is cached per (gamma, brightness_boost) pair and is read-only,
+    so it can be shared between calls and threads.
+    
+    Args:
+        gamma: Gamma correction value (>1 brightens)
+        brightness_boost: Overall brightness multiplier
+        
+    Returns:
+        uint8 lookup table of 256 entries for use with cv2.LUT
+    """
+    inv_gamma = 1.0 / gamma
+    levels = np.arange(256, dtype=np.float64) / 255.0
+    # Truncate after each step so the fused table matches applying the
+    # gamma table and the brightness multiply one after the other
+    gamma_table = ((levels ** inv_gamma) * 255).astype(np.uint8)
+    table = np.clip(gamma_table * brightness_boost, 0, 255).astype(np.uint8)
+    table.setflags(write=False)
+    return table
+
+
+@lru_cache(maxsize=32)
+def saturation_curve(factor: float) -> np.ndarray:
+    """
+    Build the lookup table that scales an HSV saturation channel.
+    
+    Matches scaling the channel in float32, clipping and truncating back
+    to uint8, without casting the whole image to float.
+    """
+    levels = np.arange(256, dtype=np.float32)
+    table = np.clip(levels * np.float32(factor), 0, 255).astype(np.uint8)
+    table.setflags(write=False)
+    return table
+
+
+@lru_cache(maxsize=32)
+def chroma_curve(factor: float) -> np.ndarray:
+    """
+    Build the lookup table that scales a LAB a/b chroma channel.
+    
+    OpenCV stores 8-bit a/b channels offset by 128, so the table scales
+    the distance from neutral grey rather than the raw value.
+    """
+    levels = np.arange(256, dtype=np.float64) - 128
+    table = np.clip(np.round(levels * factor + 128), 0, 255).astype(np.uint8)
+    table.setflags(write=False)
+    return table
+
+
+@lru_cache(maxsize=256)
+def lab_curve(gamma: float, brightness_boost: float, chroma_factor: float) -> np.ndarray:
+    """
+    Build a 3-channel LUT that applies the tone curve to L and scales a/b.
+    
+    Lets the buffer-reusing pipeline finish the LAB stage with one in-place
+    cv2.LUT call instead of a split/merge.
+    """
+    table = np.stack([
+        tone_curve(gamma, brightness_boost),
+        chroma_curve(chroma_factor),
+        chroma_curve(chroma_factor),
+    ], axis=-1).reshape(1, 256, 3)
+    table.setflags(write=False)
+    return table
+
+
+@lru_cache(maxsize=32)
+def hsv_curve(factor: float) -> np.ndarray:
+    """Build a 3-channel LUT that scales only the S channel of an HSV image."""
+    identity = np.arange(256, dtype=np.uint8)
+    table = np.stack(
+        [identity, saturation_curve(factor), identity], axis=-1
+    ).reshape(1, 256, 3)
+    table.setflags(write=False)
+    return table
+
+
+SATURATION_MODES = ('hsv', 'lab')
+
+
+def check_saturation_mode(saturation_mode: str) -> None:
+    """Raise ValueError if saturation_mode is not a supported mode."""
+    if saturation_mode not in SATURATION_MODES:
+        raise ValueError(
+            f"saturation_mode must be one of {SATURATION_MODES}, "
+            f"got {saturation_mode!r}"
+        )
+
+# Named parameter sets as (clip_limit, gamma, brightness_boost)
+ENHANCEMENT_PRESETS = {
+    'light': (1.5, 1.1, 1.05),
+    'medium': (2.0, 1.2, 1.1),
+    'strong': (2.5, 1.4, 1.2),
+    'ultra': (3.5, 1.8, 1.3),
+}
+
+# Number of CLAHE objects each thread keeps around per enhancer
+CLAHE_CACHE_SIZE = 16
+
+
+class EnhancementWorkspace:
+    """
+    Preallocated scratch buffers for enhancing images of one shape.
+    
+    Pass the same workspace (or let the enhancer keep one per thread) to
+    enhance_image together with out= to enhance a stream of same-size images
+    without allocating new arrays per frame.
+    """
+    
+    def __init__(self, shape: Tuple[int, ...]):
+        """Allocate buffers for images of the given (height, width, 3) shape."""
+        if len(shape) != 3 or shape[2] != 3:
+            raise ValueError(f"Expected an image shape (height, width, 3), got {shape}")
+        self.shape = tuple(shape)
+        height, width = shape[:2]
+        self.lab = np.empty((height, width, 3), dtype=np.uint8)
+        self.l = np.empty((height, width), dtype=np.uint8)
+        self.l_equalized = np.empty((height, width), dtype=np.uint8)
+        self.hsv = np.empty((height, width, 3), dtype=np.uint8)
 
 
 class LowLightEnhancer:
-    """Enhances low-light images using CLAHE and adaptive techniques."""
+    """
+    Enhances low-light images using CLAHE and adaptive techniques.
+    
+    An instance can be shared between threads: the only mutable state is the
+    CLAHE object cache, which is kept per thread because cv2.CLAHE reuses
+    internal buffers and is not safe to call concurrently.
+    
+    Each pipeline stage (to_lab, clahe, tone_curve, from_lab, saturation) is
+    recorded by the timing.StageTimer active on the calling thread, if any.
+    """
     
     def __init__(self):
         """Initialize the enhancer with default parameters."""
         self.clip_limit = 2.0
         self.tile_grid_size = (8, 8)
+        self._local = threading.local()
         
     def enhance_image(
         self, 
         image: np.ndarray,
         clip_limit: float = 2.0,
         gamma: float = 1.2,
-        brightness_boost: float = 1.1
+        brightness_boost: float = 1.1,
+        saturation_mode: str = 'hsv',
+        bgr: Optional[bool] = None,
+        out: Optional[np.ndarray] = None,
+        workspace: Optional[EnhancementWorkspace] = None
     ) -> np.ndarray:
         """
         Enhance a low-light image using multiple techniques.
@@ -31,47 +177,267 @@ class LowLightEnhancer:
             clip_limit: CLAHE clip limit (higher = more contrast)
             gamma: Gamma correction value (>1 brightens)
             brightness_boost: Overall brightness multiplier
+            saturation_mode: 'hsv' boosts saturation after converting back
+                to RGB (original behaviour); 'lab' scales the a/b chroma
+                channels while the image is still in LAB, which skips the
+                HSV round trip at the cost of small per-pixel differences
+            bgr: True if the image is in BGR channel order (as returned by
+                cv2.imread). BGR input is converted to LAB directly, with no
+                intermediate RGB copy. None falls back to _detect_bgr
+            out: Optional preallocated uint8 array with the same shape as
+                image to write the result into. When given, every stage
+                writes into reusable scratch buffers, so repeated calls on
+                same-size images allocate no new arrays
+            workspace: Scratch buffers to use with out; by default each
+                thread keeps one workspace for the last image shape it saw
             
         Returns:
-            Enhanced image as numpy array (same format as input)
+            Enhanced image as numpy array (same format as input), which is
+            out when it was given
         """
+        check_saturation_mode(saturation_mode)
+        
         # Detect if image is RGB or BGR
-        is_bgr = self._detect_bgr(image)
+        is_bgr = self._detect_bgr(image) if bgr is None else bgr
         
-        # Convert to RGB if BGR
-        if is_bgr:
-            image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        else:
-            image_rgb = image
+        if out is not None or workspace is not None:
+            return self._enhance_into(
+                image, out, workspace, clip_limit, gamma, brightness_boost,
+                saturation_mode, is_bgr
+            )
         
-        # Convert RGB to LAB color space for better color preservation
-        lab = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2LAB)
-        l, a, b = cv2.split(lab)
+        # Convert to LAB color space for better color preservation
+        l, a, b = self._split_lab(image, is_bgr)
         
         # Apply CLAHE (Contrast Limited Adaptive Histogram Equalization) to L channel
-        clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=self.tile_grid_size)
-        l_enhanced = clahe.apply(l)
+        with stage('clahe'):
+            clahe = self._get_clahe(clip_limit)
+            l_enhanced = clahe.apply(l)
         
-        # Apply gamma correction for brightness
-        l_enhanced = self._apply_gamma_correction(l_enhanced, gamma)
+        return self._finish(
+            l_enhanced, a, b, gamma, brightness_boost, saturation_mode, is_bgr
+        )
+    
+    def enhance_auto(
+        self,
+        image: np.ndarray,
+        clip_limit: float = 2.0,
+        gamma: float = 1.2,
+        brightness_boost: float = 1.1,
+        saturation_mode: str = 'hsv',
+        bgr: Optional[bool] = None,
+        out: Optional[np.ndarray] = None,
+        policy: Optional[ExposurePolicy] = None,
+        report: Optional[ExposureReport] = None
+    ) -> Tuple[np.ndarray, ExposureReport]:
+        """
+        Enhance an image only as much as its exposure calls for.
         
-        # Apply brightness boost
-        l_enhanced = np.clip(l_enhanced * brightness_boost, 0, 255).astype(np.uint8)
+        Lightness is measured on a strided subsample first (the 'analysis'
+        stage). Well-exposed images are returned as they are, slightly dark
+        ones with enough contrast get only the tone curve, applied to each
+        channel with one LUT pass, and the rest run through enhance_image.
         
-        # Merge channels back
-        enhanced_lab = cv2.merge([l_enhanced, a, b])
+        Args:
+            image, clip_limit, gamma, brightness_boost, saturation_mode, bgr,
+                out: As for enhance_image
+            policy: Decision thresholds (default: the shared default policy)
+            report: A decision already made for this image, e.g. by a caller
+                that analysed it to pick where to enhance it
+            
+        Returns:
+            (enhanced image, ExposureReport). For a 'skip' decision the image
+            is the input itself (or a copy in out, when given)
+        """
+        check_saturation_mode(saturation_mode)
+        is_bgr = self._detect_bgr(image) if bgr is None else bgr
+        if report is None:
+            with stage('analysis'):
+                report = (policy or get_default_policy()).analyze(image, is_bgr)
+        
+        if report.decision == SKIP:
+            if out is None:
+                return image, report
+            np.copyto(out, image)
+            return out, report
+        if report.decision == LUT:
+            with stage('tone_curve'):
+                table = tone_curve(float(gamma), float(brightness_boost))
+                return cv2.LUT(image, table, dst=out), report
+        
+        enhanced = self.enhance_image(
+            image, clip_limit, gamma, brightness_boost, saturation_mode,
+            bgr=is_bgr, out=out
+        )
+        return enhanced, report
+    
+    def prepare(self, image: np.ndarray, bgr: Optional[bool] = None) -> "PreparedImage":
+        """
+        Convert an image to LAB once for repeated enhancement.
         
-        # Convert back to RGB
-        enhanced_rgb = cv2.cvtColor(enhanced_lab, cv2.COLOR_LAB2RGB)
+        Use this when the same image is enhanced with several parameter
+        sets: CLAHE results are kept per clip limit, so changing only gamma
+        or brightness re-runs just the tone curve and saturation stages.
+        
+        Args:
+            image: Input image as numpy array (RGB or BGR)
+            bgr: True if the image is in BGR channel order
+            
+        Returns:
+            PreparedImage handle
+        """
+        is_bgr = self._detect_bgr(image) if bgr is None else bgr
+        return PreparedImage(self, image, is_bgr)
+    
+    def enhance_variants(
+        self,
+        image: np.ndarray,
+        presets: Mapping[str, Tuple[float, float, float]] = ENHANCEMENT_PRESETS,
+        saturation_mode: str = 'hsv',
+        bgr: Optional[bool] = None
+    ) -> Dict[str, np.ndarray]:
+        """
+        Enhance one image with several parameter sets, sharing the work.
+        
+        The LAB conversion runs once and CLAHE runs once per distinct clip
+        limit; only the tone curve and saturation stages run per variant.
+        
+        Args:
+            image: Input image as numpy array (RGB or BGR)
+            presets: Mapping of name -> (clip_limit, gamma, brightness_boost)
+            saturation_mode: 'hsv' or 'lab', see enhance_image
+            bgr: True if the image is in BGR channel order
+            
+        Returns:
+            Dict of name -> enhanced image, in the order of presets
+        """
+        check_saturation_mode(saturation_mode)
+        return self.prepare(image, bgr).render_variants(presets, saturation_mode)
+    
+    def _enhance_into(
+        self,
+        image: np.ndarray,
+        out: Optional[np.ndarray],
+        workspace: Optional[EnhancementWorkspace],
+        clip_limit: float,
+        gamma: float,
+        brightness_boost: float,
+        saturation_mode: str,
+        is_bgr: bool
+    ) -> np.ndarray:
+        """
+        Run the enhancement pipeline entirely in preallocated buffers.
+        
+        Produces the same pixels as the allocating path: the L channel is
+        equalized into a scratch plane and written back into the LAB buffer,
+        then tone curve and chroma scaling run as one in-place 3-channel LUT.
+        """
+        if image.ndim != 3 or image.shape[2] != 3 or image.dtype != np.uint8:
+            raise ValueError("Buffer reuse requires a uint8 image with 3 channels")
+        if out is None:
+            out = np.empty_like(image)
+        elif (out.shape != image.shape or out.dtype != np.uint8
+              or not out.flags.c_contiguous):
+            raise ValueError(
+                "out must be a C-contiguous uint8 array with the same shape as image"
+            )
+        if workspace is None:
+            workspace = self._get_workspace(image.shape)
+        elif workspace.shape != image.shape:
+            raise ValueError(
+                f"Workspace shape {workspace.shape} does not match image shape {image.shape}"
+            )
+        
+        lab = workspace.lab
+        with stage('to_lab'):
+            cv2.cvtColor(image, cv2.COLOR_BGR2LAB if is_bgr else cv2.COLOR_RGB2LAB, dst=lab)
+            cv2.extractChannel(lab, 0, dst=workspace.l)
+        with stage('clahe'):
+            self._get_clahe(clip_limit).apply(workspace.l, workspace.l_equalized)
+            cv2.insertChannel(workspace.l_equalized, lab, 0)
+        
+        chroma_factor = 1.1 if saturation_mode == 'lab' else 1.0
+        with stage('tone_curve'):
+            cv2.LUT(lab, lab_curve(float(gamma), float(brightness_boost), chroma_factor), dst=lab)
+        with stage('from_lab'):
+            cv2.cvtColor(lab, cv2.COLOR_LAB2BGR if is_bgr else cv2.COLOR_LAB2RGB, dst=out)
+        
+        if saturation_mode == 'hsv':
+            hsv = workspace.hsv
+            with stage('saturation'):
+                cv2.cvtColor(out, cv2.COLOR_BGR2HSV if is_bgr else cv2.COLOR_RGB2HSV, dst=hsv)
+                cv2.LUT(hsv, hsv_curve(1.1), dst=hsv)
+                cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR if is_bgr else cv2.COLOR_HSV2RGB, dst=out)
+        
+        return out
+    
+    def _get_workspace(self, shape: Tuple[int, ...]) -> EnhancementWorkspace:
+        """Return this thread's workspace, reallocating it if the shape changed."""
+        workspace = getattr(self._local, 'workspace', None)
+        if workspace is None or workspace.shape != tuple(shape):
+            workspace = self._local.workspace = EnhancementWorkspace(shape)
+        return workspace
+    
+    def _split_lab(self, image: np.ndarray, is_bgr: bool) -> Tuple[np.ndarray, ...]:
+        """Convert an RGB/BGR image to LAB and split it into L, a, b planes."""
+        with stage('to_lab'):
+            lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB if is_bgr else cv2.COLOR_RGB2LAB)
+            return cv2.split(lab)
+    
+    def _finish(
+        self,
+        l_equalized: np.ndarray,
+        a: np.ndarray,
+        b: np.ndarray,
+        gamma: float,
+        brightness_boost: float,
+        saturation_mode: str,
+        is_bgr: bool
+    ) -> np.ndarray:
+        """
+        Run the stages after CLAHE: tone curve, saturation boost and the
+        conversion back to the input channel order.
+        """
+        with stage('tone_curve'):
+            # Apply gamma correction and brightness boost in a single LUT pass
+            l_enhanced = self._apply_tone_curve(l_equalized, gamma, brightness_boost)
+            
+            # Apply slight saturation boost on the chroma channels
+            if saturation_mode == 'lab':
+                a, b = self._boost_chroma(a, b, factor=1.1)
+        
+        with stage('from_lab'):
+            # Merge channels back
+            enhanced_lab = cv2.merge([l_enhanced, a, b])
+            
+            # Convert back to the input channel order
+            enhanced = cv2.cvtColor(
+                enhanced_lab, cv2.COLOR_LAB2BGR if is_bgr else cv2.COLOR_LAB2RGB
+            )
         
         # Apply slight saturation boost
-        enhanced_rgb = self._boost_saturation(enhanced_rgb, factor=1.1)
+        if saturation_mode == 'hsv':
+            with stage('saturation'):
+                enhanced = self._boost_saturation(enhanced, factor=1.1, bgr=is_bgr)
+        
+        return enhanced
+    
+    def _get_clahe(self, clip_limit: float) -> "cv2.CLAHE":
+        """Return a cached CLAHE object for this thread, creating it if needed."""
+        cache = getattr(self._local, 'clahe_cache', None)
+        if cache is None:
+            cache = self._local.clahe_cache = OrderedDict()
         
-        # Convert back to BGR if input was BGR
-        if is_bgr:
-            return cv2.cvtColor(enhanced_rgb, cv2.COLOR_RGB2BGR)
+        key = (float(clip_limit), tuple(self.tile_grid_size))
+        clahe = cache.get(key)
+        if clahe is None:
+            clahe = cv2.createCLAHE(clipLimit=key[0], tileGridSize=key[1])
+            cache[key] = clahe
+            if len(cache) > CLAHE_CACHE_SIZE:
+                cache.popitem(last=False)
         else:
-            return enhanced_rgb
+            cache.move_to_end(key)
+        return clahe
     
     def _detect_bgr(self, image: np.ndarray) -> bool:
         """Detect if image is likely in BGR format (heuristic)."""
@@ -79,20 +445,146 @@ class LowLightEnhancer:
         # For now, assume it's BGR if loaded with cv2.imread
         return False  # Default to RGB
     
-    def _apply_gamma_correction(self, image: np.ndarray, gamma: float) -> np.ndarray:
-        """Apply gamma correction to brighten the image."""
-        inv_gamma = 1.0 / gamma
-        table = np.array([
-            ((i / 255.0) ** inv_gamma) * 255 
-            for i in range(256)
-        ]).astype(np.uint8)
-        return cv2.LUT(image, table)
+    def _apply_tone_curve(
+        self,
+        image: np.ndarray,
+        gamma: float,
+        brightness_boost: float
+    ) -> np.ndarray:
+        """Apply gamma correction and brightness boost with one cached LUT."""
+        return cv2.LUT(image, tone_curve(float(gamma), float(brightness_boost)))
     
-    def _boost_saturation(self, image: np.ndarray, factor: float) -> np.ndarray:
+    def _boost_saturation(
+        self,
+        image: np.ndarray,
+        factor: float,
+        bgr: bool = False
+    ) -> np.ndarray:
         """Boost color saturation."""
-        hsv = cv2.cvtColor(image, cv2.COLOR_RGB2HSV).astype(np.float32)
-        hsv[:, :, 1] = np.clip(hsv[:, :, 1] * factor, 0, 255)
-        return cv2.cvtColor(hsv.astype(np.uint8), cv2.COLOR_HSV2RGB)
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV if bgr else cv2.COLOR_RGB2HSV)
+        h, s, v = cv2.split(hsv)
+        s = cv2.LUT(s, saturation_curve(float(factor)))
+        return cv2.cvtColor(
+            cv2.merge([h, s, v]), cv2.COLOR_HSV2BGR if bgr else cv2.COLOR_HSV2RGB
+        )
+    
+    def _boost_chroma(
+        self,
+        a: np.ndarray,
+        b: np.ndarray,
+        factor: float
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Boost color saturation by scaling the LAB a/b channels."""
+        table = chroma_curve(float(factor))
+        return cv2.LUT(a, table), cv2.LUT(b, table)
+
+
+class PreparedImage:
+    """
+    An image held as LAB planes, with CLAHE results cached per clip limit.
+    
+    Created by LowLightEnhancer.prepare. Rendering with a clip limit that was
+    already used only runs the tone curve, saturation and colour conversion.
+    Safe to render from several threads.
+    """
+    
+    # Number of equalized L planes kept (one per recently used clip limit)
+    MAX_EQUALIZED = 2
+    
+    def __init__(self, enhancer: LowLightEnhancer, image: np.ndarray, is_bgr: bool):
+        """Split image into LAB planes; see LowLightEnhancer.prepare."""
+        self._enhancer = enhancer
+        self.is_bgr = is_bgr
+        self.shape = image.shape
+        self.l, self.a, self.b = enhancer._split_lab(image, is_bgr)
+        self._equalized = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the planes and cached CLAHE results."""
+        with self._lock:
+            cached = sum(plane.nbytes for plane in self._equalized.values())
+        return self.l.nbytes + self.a.nbytes + self.b.nbytes + cached
+    
+    @property
+    def max_nbytes(self) -> int:
+        """Memory the image can grow to once MAX_EQUALIZED CLAHE results are cached."""
+        return self.l.nbytes * (1 + self.MAX_EQUALIZED) + self.a.nbytes + self.b.nbytes
+    
+    def equalized(self, clip_limit: float) -> np.ndarray:
+        """Return the CLAHE'd L plane for clip_limit, computing it if needed."""
+        key = float(clip_limit)
+        with self._lock:
+            plane = self._equalized.get(key)
+            if plane is not None:
+                self._equalized.move_to_end(key)
+                return plane
+            
+            # Computed under the lock so concurrent renders share the result
+            with stage('clahe'):
+                plane = self._enhancer._get_clahe(key).apply(self.l)
+            self._equalized[key] = plane
+            if len(self._equalized) > self.MAX_EQUALIZED:
+                self._equalized.popitem(last=False)
+            return plane
+    
+    def render(
+        self,
+        clip_limit: float = 2.0,
+        gamma: float = 1.2,
+        brightness_boost: float = 1.1,
+        saturation_mode: str = 'hsv'
+    ) -> np.ndarray:
+        """
+        Produce the enhanced image for a parameter set.
+        
+        Returns the same pixels as LowLightEnhancer.enhance_image on the
+        original image, in the original channel order.
+        """
+        check_saturation_mode(saturation_mode)
+        return self._enhancer._finish(
+            self.equalized(clip_limit), self.a, self.b, gamma,
+            brightness_boost, saturation_mode, self.is_bgr
+        )
+    
+    def render_variants(
+        self,
+        presets: Mapping[str, Tuple[float, float, float]],
+        saturation_mode: str = 'hsv'
+    ) -> Dict[str, np.ndarray]:
+        """
+        Render several (clip_limit, gamma, brightness_boost) parameter sets.
+        
+        Returns:
+            Dict of name -> enhanced image, in the order of presets
+        """
+        # Render grouped by clip limit so each CLAHE result is computed once
+        by_clip = sorted(presets.items(), key=lambda item: float(item[1][0]))
+        rendered = {
+            name: self.render(clip_limit, gamma, brightness, saturation_mode)
+            for name, (clip_limit, gamma, brightness) in by_clip
+        }
+        return {name: rendered[name] for name in presets}
+
+
+_shared_enhancer: Optional[LowLightEnhancer] = None
+_shared_enhancer_lock = threading.Lock()
+
+
+def get_shared_enhancer() -> LowLightEnhancer:
+    """
+    Return the process-wide enhancer instance.
+    
+    Reusing one instance lets every thread keep its CLAHE objects between
+    calls instead of rebuilding them for each image.
+    """
+    global _shared_enhancer
+    if _shared_enhancer is None:
+        with _shared_enhancer_lock:
+            if _shared_enhancer is None:
+                _shared_enhancer = LowLightEnhancer()
+    return _shared_enhancer
 
 
 def enhance_image_file(
@@ -117,14 +609,11 @@ def enhance_image_file(
     if image is None:
         raise ValueError(f"Could not read image from {input_path}")
     
-    # Enhance
-    enhancer = LowLightEnhancer()
-    # OpenCV reads as BGR, so we convert to RGB
-    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    enhanced = enhancer.enhance_image(image_rgb, clip_limit, gamma, brightness)
-    
-    # Convert back to BGR for saving
-    enhanced_bgr = cv2.cvtColor(enhanced, cv2.COLOR_RGB2BGR)
+    # Enhance (OpenCV reads as BGR, which the enhancer handles directly)
+    enhancer = get_shared_enhancer()
+    enhanced_bgr = enhancer.enhance_image(
+        image, clip_limit, gamma, brightness, bgr=True
+    )
     
     # Save
     cv2.imwrite(output_path, enhanced_bgr)
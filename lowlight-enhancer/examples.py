@@ -3,7 +3,7 @@ Examples of using the Low-Light Image Enhancer programmatically.
 This script demonstrates various ways to use the enhancer module in your own code.
 """
 
-from enhancer import LowLightEnhancer, enhance_image_file
+from enhancer import ENHANCEMENT_PRESETS, LowLightEnhancer, enhance_image_file
 import cv2
 import numpy as np
 from PIL import Image
@@ -95,23 +95,24 @@ def example_batch_processing():
     """Process multiple images at once."""
     print("Example 5: Batch processing")
     
-    import glob
-    from pathlib import Path
-    
-    # Get all jpg images in a directory
-    input_dir = Path('input_images')
-    output_dir = Path('output_images')
-    output_dir.mkdir(exist_ok=True)
-    
-    # Process each image
-    for image_path in input_dir.glob('*.jpg'):
-        output_path = output_dir / f"enhanced_{image_path.name}"
-        
-        print(f"Processing {image_path.name}...", end=' ')
-        enhance_image_file(str(image_path), str(output_path))
-        print("✓")
+    from batch import enhance_directory
+    
+    # Enhance all jpg images in a directory, spread across all CPU cores.
+    # The same run is available from the command line:
+    #   python batch.py input_images output_images --pattern "*.jpg"
+    summary = enhance_directory(
+        'input_images',
+        'output_images',
+        pattern='*.jpg',
+        prefix='enhanced_',
+        # Skip images already enhanced by an earlier run (--incremental)
+        incremental=True
+    )
     
-    print(f"All images processed and saved to {output_dir}/\n")
+    print(f"✓ {summary['succeeded']} images processed "
+          f"({summary['images_per_second']:.1f} img/s), "
+          f"{summary['skipped']} unchanged, {summary['failed']} failed")
+    print("All images processed and saved to output_images/\n")
 
 
 # Example 6: Progressive enhancement levels
@@ -121,32 +122,17 @@ def example_progressive_enhancement():
     
     enhancer = LowLightEnhancer()
     
-    # Load image
+    # Load image (OpenCV returns BGR, which the enhancer handles directly)
     image = cv2.imread('input.jpg')
-    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    
-    # Create different enhancement levels
-    levels = {
-        'light': (1.5, 1.1, 1.05),
-        'medium': (2.0, 1.2, 1.1),
-        'strong': (2.5, 1.4, 1.2),
-        'ultra': (3.5, 1.8, 1.3),
-    }
-    
-    for level_name, (clip, gamma, brightness) in levels.items():
-        print(f"Creating {level_name} enhancement...", end=' ')
-        
-        enhanced = enhancer.enhance_image(
-            image_rgb,
-            clip_limit=clip,
-            gamma=gamma,
-            brightness_boost=brightness
-        )
-        
-        # Save
-        enhanced_bgr = cv2.cvtColor(enhanced, cv2.COLOR_RGB2BGR)
+    
+    # The LAB conversion is shared by all levels and CLAHE runs once per
+    # distinct clip limit, instead of repeating the full pipeline per level.
+    # ENHANCEMENT_PRESETS maps each level to (clip_limit, gamma, brightness)
+    variants = enhancer.enhance_variants(image, ENHANCEMENT_PRESETS, bgr=True)
+    
+    for level_name, enhanced_bgr in variants.items():
         cv2.imwrite(f'output_{level_name}.jpg', enhanced_bgr)
-        print("✓")
+        print(f"✓ {level_name} enhancement saved to output_{level_name}.jpg")
     
     print("All enhancement levels created\n")
 
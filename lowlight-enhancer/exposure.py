@@ -0,0 +1,185 @@
+"""
+Exposure analysis for skipping work on images that are already well lit.
+Lightness statistics are computed on a strided subsample of the image,
+which costs a small fraction of one enhancement, and an ExposurePolicy
+turns them into one of three decisions:
+
+- skip: the image is well exposed and is returned untouched
+- lut: the image is a little dark but has enough contrast, so only the
+  tone curve is applied, as one LUT pass over the pixels
+- full: the whole pipeline runs
+"""
+
+import threading
+from typing import Optional
+
+import cv2
+import numpy as np
+
+SKIP = 'skip'
+LUT = 'lut'
+FULL = 'full'
+DECISIONS = (SKIP, LUT, FULL)
+
+# Every ANALYSIS_STRIDE-th pixel of every ANALYSIS_STRIDE-th row is sampled
+ANALYSIS_STRIDE = 8
+
+# Lightness (0-255) at or below which a pixel counts as shadow
+SHADOW_LEVEL = 50
+
+
+class ExposureStats:
+    """Lightness statistics of a sampled image, on the LAB L scale (0-255)."""
+
+    def __init__(self, mean: float, p5: float, p95: float, shadow_fraction: float, samples: int):
+        """
+        Args:
+            mean: Mean lightness
+            p5: 5th percentile of lightness
+            p95: 95th percentile of lightness
+            shadow_fraction: Fraction of samples at or below SHADOW_LEVEL
+            samples: Number of pixels sampled
+        """
+        self.mean = mean
+        self.p5 = p5
+        self.p95 = p95
+        self.shadow_fraction = shadow_fraction
+        self.samples = samples
+
+    @property
+    def spread(self) -> float:
+        """Width of the central 90% of the lightness range."""
+        return self.p95 - self.p5
+
+    def to_dict(self) -> dict:
+        return {
+            'mean': round(self.mean, 1),
+            'p5': self.p5,
+            'p95': self.p95,
+            'spread': self.spread,
+            'shadow_fraction': round(self.shadow_fraction, 4),
+            'samples': self.samples,
+        }
+
+
+def measure_exposure(image: np.ndarray, bgr: bool = True, stride: int = ANALYSIS_STRIDE) -> ExposureStats:
+    """
+    Compute lightness statistics from a strided subsample of an image.
+
+    Args:
+        image: uint8 image with 3 channels
+        bgr: True if the image is in BGR channel order
+        stride: Sampling step in both directions
+    """
+    sample = np.ascontiguousarray(image[::stride, ::stride])
+    lab = cv2.cvtColor(sample, cv2.COLOR_BGR2LAB if bgr else cv2.COLOR_RGB2LAB)
+    histogram = cv2.calcHist([lab], [0], None, [256], [0, 256]).ravel()
+    samples = int(histogram.sum())
+    cumulative = np.cumsum(histogram)
+    return ExposureStats(
+        mean=float(np.dot(histogram, np.arange(256)) / samples),
+        p5=int(np.searchsorted(cumulative, 0.05 * samples)),
+        p95=int(np.searchsorted(cumulative, 0.95 * samples)),
+        shadow_fraction=float(cumulative[SHADOW_LEVEL] / samples),
+        samples=samples,
+    )
+
+
+class ExposureReport:
+    """The decision made for one image and the statistics behind it."""
+
+    def __init__(self, decision: str, reason: str, stats: ExposureStats):
+        self.decision = decision
+        self.reason = reason
+        self.stats = stats
+
+    def to_dict(self) -> dict:
+        return {'decision': self.decision, 'reason': self.reason, **self.stats.to_dict()}
+
+    def header_value(self) -> str:
+        """Format the report for a response header, e.g. 'lut; mean=96.4; spread=141'."""
+        return (f'{self.decision}; mean={self.stats.mean:.1f}; spread={self.stats.spread:.0f}; '
+                f'shadows={self.stats.shadow_fraction:.3f}')
+
+
+class ExposurePolicy:
+    """
+    Thresholds that map ExposureStats to a decision, with a count of the
+    decisions made so the thresholds can be tuned against real traffic.
+
+    Safe to share between threads.
+    """
+
+    def __init__(
+        self,
+        skip_mean: float = 115.0,
+        lut_mean: float = 80.0,
+        min_spread: float = 120.0,
+        max_shadow_fraction: float = 0.2,
+        stride: int = ANALYSIS_STRIDE
+    ):
+        """
+        Args:
+            skip_mean: Mean lightness from which a well-spread image is
+                left untouched
+            lut_mean: Mean lightness from which a well-spread image only
+                gets the tone curve
+            min_spread: Smallest p95 - p5 lightness spread that counts as
+                enough contrast to do without CLAHE
+            max_shadow_fraction: Largest share of shadow pixels an image may
+                have and still skip CLAHE
+            stride: Sampling step for measure_exposure
+        """
+        self.skip_mean = skip_mean
+        self.lut_mean = lut_mean
+        self.min_spread = min_spread
+        self.max_shadow_fraction = max_shadow_fraction
+        self.stride = stride
+        self._lock = threading.Lock()
+        self._decisions = dict.fromkeys(DECISIONS, 0)
+
+    def decide(self, stats: ExposureStats) -> ExposureReport:
+        """Choose skip, lut or full for an image's statistics."""
+        if stats.spread < self.min_spread:
+            decision, reason = FULL, 'low contrast'
+        elif stats.shadow_fraction > self.max_shadow_fraction:
+            decision, reason = FULL, 'deep shadows'
+        elif stats.mean >= self.skip_mean:
+            decision, reason = SKIP, 'well exposed'
+        elif stats.mean >= self.lut_mean:
+            decision, reason = LUT, 'slightly dark'
+        else:
+            decision, reason = FULL, 'dark'
+        with self._lock:
+            self._decisions[decision] += 1
+        return ExposureReport(decision, reason, stats)
+
+    def analyze(self, image: np.ndarray, bgr: bool = True) -> ExposureReport:
+        """Measure an image and decide how to enhance it."""
+        return self.decide(measure_exposure(image, bgr, self.stride))
+
+    def stats(self) -> dict:
+        """Return the thresholds and the number of images per decision."""
+        with self._lock:
+            decisions = dict(self._decisions)
+        return {
+            'skip_mean': self.skip_mean,
+            'lut_mean': self.lut_mean,
+            'min_spread': self.min_spread,
+            'max_shadow_fraction': self.max_shadow_fraction,
+            'decisions': decisions,
+        }
+
+
+_default_policy: Optional[ExposurePolicy] = None
+_default_policy_lock = threading.Lock()
+
+
+def get_default_policy() -> ExposurePolicy:
+    """Return the process-wide policy with the default thresholds."""
+    global _default_policy
+    if _default_policy is None:
+        with _default_policy_lock:
+            if _default_policy is None:
+                _default_policy = ExposurePolicy()
+    return _default_policy
@@ -0,0 +1,271 @@
+"""
+Background job queue for the enhancer web app.
+Large enhancement requests are submitted as jobs and run on a small, fixed
+pool of worker threads, so they cannot tie up the request workers that
+serve interactive previews. Clients poll or stream the job status and
+fetch the result when it is done.
+
+Jobs and their results live in the memory of the process that accepted
+them. The app must therefore run as a single process with request threads,
+e.g. `gunicorn -w 1 --threads 8 app:app`: with several worker processes a
+status, events or result request can reach a process that does not know
+the job and get a 404. Each open /jobs/<id>/events stream also holds a
+request thread until the job finishes.
+"""
+
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Callable, Iterator, Optional
+
+# Job states; 'done' and 'failed' are final
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Number of recent jobs whose queue wait is kept for percentiles
+WAIT_SAMPLES = 200
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class Job:
+    """One submitted unit of work and its result."""
+
+    def __init__(self, func: Callable[[], bytes], mimetype: str):
+        """
+        Args:
+            func: Called on a worker thread; returns the encoded result
+            mimetype: MIME type of the result
+        """
+        self.id = uuid.uuid4().hex
+        self.func = func
+        self.mimetype = mimetype
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created = time.monotonic()
+        self.started = None
+        self.finished = None
+
+    @property
+    def final(self) -> bool:
+        """True once the job has either finished or failed."""
+        return self.status in (DONE, FAILED)
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the stored result."""
+        return len(self.result) if self.result is not None else 0
+
+    def to_dict(self, position: Optional[int] = None) -> dict:
+        """Describe the job for status responses."""
+        now = time.monotonic()
+        info = {'job_id': self.id, 'status': self.status}
+        if position is not None:
+            info['position'] = position
+        info['wait_seconds'] = round((self.started or now) - self.created, 3)
+        if self.started is not None:
+            info['run_seconds'] = round((self.finished or now) - self.started, 3)
+        if self.error is not None:
+            info['error'] = self.error
+        return info
+
+
+class JobQueue:
+    """
+    Bounded FIFO job queue served by a fixed number of worker threads.
+
+    Worker threads are started on the first submit, so each process that
+    forks from the app (for example gunicorn workers) starts its own.
+    Finished jobs are kept for result_ttl seconds, within a byte budget.
+    """
+
+    def __init__(
+        self,
+        workers: int = 1,
+        max_queued: int = 16,
+        result_ttl: float = 600,
+        max_result_bytes: int = 256 * 1024 * 1024
+    ):
+        """
+        Args:
+            workers: Number of jobs run at once
+            max_queued: Jobs that may wait before submit raises QueueFull
+            result_ttl: Seconds finished jobs are kept
+            max_result_bytes: Memory budget for finished results
+        """
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self.max_result_bytes = max_result_bytes
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._pending = deque()
+        self._jobs = OrderedDict()
+        self._finished = OrderedDict()
+        self._result_bytes = 0
+        self._threads = []
+        self._running = 0
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.expired = 0
+
+    def _start_workers(self) -> None:
+        """Start the worker threads if this process has none yet."""
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _purge(self, now: float) -> None:
+        """Drop finished jobs past the TTL or over the result budget (oldest first)."""
+        while self._finished:
+            job_id, job = next(iter(self._finished.items()))
+            if now - job.finished <= self.result_ttl and \
+                    self._result_bytes <= self.max_result_bytes:
+                break
+            self._finished.pop(job_id)
+            self._jobs.pop(job_id, None)
+            self._result_bytes -= job.nbytes
+            self.expired += 1
+
+    def submit(self, func: Callable[[], bytes], mimetype: str) -> Job:
+        """
+        Queue a job.
+
+        Raises:
+            QueueFull: if max_queued jobs are already waiting
+        """
+        job = Job(func, mimetype)
+        with self._lock:
+            self._purge(time.monotonic())
+            if len(self._pending) >= self.max_queued:
+                self.rejected += 1
+                raise QueueFull(f"{len(self._pending)} jobs already queued")
+            self._start_workers()
+            self._pending.append(job)
+            self._jobs[job.id] = job
+            self.submitted += 1
+            self._changed.notify_all()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Return the job with this id, or None if unknown or expired."""
+        with self._lock:
+            self._purge(time.monotonic())
+            return self._jobs.get(job_id)
+
+    def _position_locked(self, job: Job) -> Optional[int]:
+        """Return how many jobs are ahead of a queued job, or None if it is not queued."""
+        try:
+            return self._pending.index(job)
+        except ValueError:
+            return None
+
+    def describe(self, job: Job) -> dict:
+        """Return the job's status dict, including its queue position."""
+        with self._lock:
+            return job.to_dict(self._position_locked(job))
+
+    def watch(self, job: Job, timeout: float = 15.0) -> Iterator[Optional[dict]]:
+        """
+        Yield the job's status each time its state or queue position changes,
+        ending with the final status.
+
+        Yields None when nothing changed for timeout seconds, so callers
+        streaming to a client can send a keep-alive.
+        """
+        last_state = None
+        while True:
+            with self._changed:
+                deadline = time.monotonic() + timeout
+                state = (job.status, self._position_locked(job))
+                while state == last_state:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._changed.wait(remaining)
+                    state = (job.status, self._position_locked(job))
+                info = job.to_dict(state[1]) if state != last_state else None
+            yield info
+            if info is not None:
+                last_state = state
+                if job.final:
+                    return
+
+    def _work(self) -> None:
+        """Worker thread: run queued jobs one at a time."""
+        while True:
+            with self._changed:
+                while not self._pending:
+                    self._changed.wait()
+                job = self._pending.popleft()
+                job.status = RUNNING
+                job.started = time.monotonic()
+                self._waits.append(job.started - job.created)
+                self._running += 1
+                self._changed.notify_all()
+
+            try:
+                result, error = job.func(), None
+            except Exception as e:
+                result, error = None, str(e) or type(e).__name__
+
+            with self._changed:
+                job.func = None
+                job.finished = time.monotonic()
+                self._running -= 1
+                if error is None:
+                    job.result = result
+                    job.status = DONE
+                    self.completed += 1
+                else:
+                    job.error = error
+                    job.status = FAILED
+                    self.failed += 1
+                self._finished[job.id] = job
+                self._result_bytes += job.nbytes
+                self._purge(job.finished)
+                self._changed.notify_all()
+
+    def stats(self) -> dict:
+        """Return queue depth, counters and queue wait times in seconds."""
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                'queued': len(self._pending),
+                'running': self._running,
+                'workers': self.workers,
+                'max_queued': self.max_queued,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'expired': self.expired,
+                'result_bytes': self._result_bytes,
+                'wait_seconds': {
+                    'samples': len(waits),
+                    'mean': sum(waits) / len(waits) if waits else 0.0,
+                    'p50': _percentile(waits, 0.5),
+                    'p95': _percentile(waits, 0.95),
+                    'max': waits[-1] if waits else 0.0,
+                },
+            }
+
+
+def _percentile(sorted_values, fraction: float) -> float:
+    """Return the nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
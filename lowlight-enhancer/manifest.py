@@ -0,0 +1,188 @@
+"""
+Processed-file manifest for incremental batch runs.
+Each successfully enhanced file is appended to a JSON Lines manifest with
+its size, modification time, content hash, the parameters used and the
+output it produced. Later runs skip inputs whose entry still matches, and
+a run that was interrupted resumes after the last recorded file.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+from typing import Dict, Optional
+
+# Bumped when a change to the enhancer makes old outputs stale
+MANIFEST_VERSION = 1
+
+# Rewrite the manifest on load when it holds this many superseded lines
+COMPACT_MIN_STALE = 1000
+
+
+def file_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Return the content hash of a file, read in chunks."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def bytes_digest(data: bytes) -> str:
+    """Return the content hash of file contents already in memory."""
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def _ends_without_newline(path: str) -> bool:
+    """True if the file is non-empty and its last byte is not a newline."""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return False
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b'\n'
+
+
+class BatchManifest:
+    """
+    Append-only record of processed files, keyed by input path.
+
+    Entries are flushed as each file completes, so the manifest is
+    consistent up to the last finished file even if the run is killed.
+    Not safe to share between concurrent runs.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Manifest file; created on the first record
+        """
+        self.path = path
+        self._entries: Dict[str, dict] = {}
+        self._file = None
+        self._load()
+
+    def _load(self) -> None:
+        """Read existing entries; later lines for the same input win."""
+        if not os.path.exists(self.path):
+            return
+        lines = 0
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                lines += 1
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A run killed mid-write can leave a truncated last line
+                    continue
+                if entry.get('version') == MANIFEST_VERSION:
+                    self._entries[entry['input']] = entry
+        if lines - len(self._entries) >= COMPACT_MIN_STALE:
+            self.compact()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, input_path: str) -> Optional[dict]:
+        """Return the entry recorded for an input, if any."""
+        return self._entries.get(os.path.abspath(input_path))
+
+    def is_current(self, input_path: str, output_path: str, params: Dict) -> bool:
+        """
+        True if input_path was already enhanced into output_path with params
+        and neither file has changed since.
+
+        Size and mtime are compared first; the input is only hashed when its
+        mtime changed but its size did not (e.g. after a copy or touch).
+        """
+        entry = self.get(input_path)
+        if entry is None or entry['params'] != params or \
+                entry['output'] != os.path.abspath(output_path):
+            return False
+        try:
+            input_stat = os.stat(input_path)
+            output_stat = os.stat(output_path)
+        except OSError:
+            return False
+        if output_stat.st_size != entry['output_size'] or input_stat.st_size != entry['size']:
+            return False
+        if input_stat.st_mtime_ns == entry['mtime_ns']:
+            return True
+        if file_digest(input_path) != entry['hash']:
+            return False
+        # Same content under a new mtime: remember it so the next run skips the hash
+        self._append(dict(entry, mtime_ns=input_stat.st_mtime_ns))
+        return True
+
+    def record(
+        self,
+        input_path: str,
+        output_path: str,
+        params: Dict,
+        digest: str,
+        size: int,
+        mtime_ns: int
+    ) -> None:
+        """
+        Record a successfully enhanced file.
+
+        Args:
+            input_path: Input file
+            output_path: Output file that was written
+            params: Enhancement parameters used
+            digest: Content hash of the input as it was processed
+            size: Input size in bytes when the job was queued
+            mtime_ns: Input modification time when the job was queued
+        """
+        self._append({
+            'version': MANIFEST_VERSION,
+            'input': os.path.abspath(input_path),
+            'size': size,
+            'mtime_ns': mtime_ns,
+            'hash': digest,
+            'params': params,
+            'output': os.path.abspath(output_path),
+            'output_size': os.path.getsize(output_path),
+            'completed_at': time.time(),
+        })
+
+    def _append(self, entry: dict) -> None:
+        """Append one entry and flush it to disk."""
+        self._entries[entry['input']] = entry
+        if self._file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+            if _ends_without_newline(self.path):
+                # Terminate a line left truncated by a killed run, so the
+                # first new entry does not end up joined onto it
+                self._file.write('\n')
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+
+    def compact(self) -> None:
+        """Rewrite the manifest with only the current entry per input."""
+        self.close()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                for entry in self._entries.values():
+                    f.write(json.dumps(entry) + '\n')
+            os.replace(tmp_path, self.path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def close(self) -> None:
+        """Close the manifest file; it is reopened on the next record."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "BatchManifest":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,168 @@
+"""
+Aggregated request metrics for the enhancer web app.
+Stage timings from timing.StageTimer are folded into histograms and
+exposed in the Prometheus text format on /metrics.
+"""
+
+import bisect
+import threading
+from typing import Collection, Dict, Iterable, List, Mapping, Tuple
+
+# Histogram bucket upper bounds in seconds
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+class Histogram:
+    """Cumulative-bucket histogram, as used by Prometheus."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Record one value. Not locked; see StageMetrics."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value: str) -> str:
+    """Escape a Prometheus label value."""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels: Mapping[str, str]) -> str:
+    """Format a Prometheus label set."""
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(str(value))}"' for key, value in labels.items()) + '}'
+
+
+def _format_number(value: float) -> str:
+    """Format a sample value the way Prometheus expects."""
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class StageMetrics:
+    """
+    Thread-safe histograms of request and stage durations per endpoint.
+    """
+
+    def __init__(self, prefix: str = 'enhancer', buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        Args:
+            prefix: Prefix of the exported metric names
+            buckets: Histogram bucket upper bounds in seconds
+        """
+        self.prefix = prefix
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._requests: Dict[Tuple[str, str], Histogram] = {}
+        self._stages: Dict[Tuple[str, str], Histogram] = {}
+
+    def _histogram(self, table: Dict, key: Tuple[str, str]) -> Histogram:
+        """Return the histogram for key, creating it if needed."""
+        histogram = table.get(key)
+        if histogram is None:
+            histogram = table[key] = Histogram(self.buckets)
+        return histogram
+
+    def observe(
+        self,
+        endpoint: str,
+        stages: Mapping[str, float],
+        total: float,
+        status: int = 200
+    ) -> None:
+        """
+        Record one request.
+
+        Args:
+            endpoint: Name of the endpoint or job type
+            stages: Seconds per stage, e.g. StageTimer.stages
+            total: Total seconds of the request
+            status: HTTP status code
+        """
+        with self._lock:
+            self._histogram(self._requests, (endpoint, str(status))).observe(total)
+            for name, seconds in stages.items():
+                self._histogram(self._stages, (endpoint, name)).observe(seconds)
+
+    def render(self) -> List[str]:
+        """Return the histograms as Prometheus text format lines."""
+        with self._lock:
+            requests = {k: _snapshot(h) for k, h in sorted(self._requests.items())}
+            stages = {k: _snapshot(h) for k, h in sorted(self._stages.items())}
+
+        lines = []
+        name = f'{self.prefix}_request_duration_seconds'
+        lines.append(f'# HELP {name} Request duration by endpoint and status.')
+        lines.append(f'# TYPE {name} histogram')
+        for (endpoint, status), snapshot in requests.items():
+            lines.extend(self._histogram_lines(
+                name, {'endpoint': endpoint, 'status': status}, snapshot
+            ))
+
+        name = f'{self.prefix}_stage_duration_seconds'
+        lines.append(f'# HELP {name} Time spent per pipeline stage and endpoint.')
+        lines.append(f'# TYPE {name} histogram')
+        for (endpoint, stage), snapshot in stages.items():
+            lines.extend(self._histogram_lines(
+                name, {'endpoint': endpoint, 'stage': stage}, snapshot
+            ))
+        return lines
+
+    def _histogram_lines(
+        self,
+        name: str,
+        labels: Dict[str, str],
+        snapshot: Tuple[List[int], float, int]
+    ) -> Iterable[str]:
+        """Yield the bucket, sum and count lines of one histogram."""
+        counts, total, count = snapshot
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            bucket_labels = dict(labels, le=_format_number(bound))
+            yield f'{name}_bucket{_labels(bucket_labels)} {cumulative}'
+        yield f'{name}_sum{_labels(labels)} {_format_number(total)}'
+        yield f'{name}_count{_labels(labels)} {count}'
+
+
+def _snapshot(histogram: Histogram) -> Tuple[List[int], float, int]:
+    """Copy a histogram's state."""
+    return list(histogram.counts), histogram.sum, histogram.count
+
+
+def render_stats(
+    prefix: str,
+    stats: Mapping,
+    help_text: str,
+    counters: Collection[str] = ()
+) -> List[str]:
+    """
+    Render the numeric values of a stats() dict in the Prometheus text format.
+
+    Keys listed in counters are monotonic and exported as counters, so
+    rate() works on them; the rest are gauges. A nested dict listed in
+    counters is a counter throughout. Nested dicts become metrics named
+    after their key path; other values are skipped.
+    """
+    lines = []
+    for key, value in stats.items():
+        name = f'{prefix}_{key}'
+        if isinstance(value, Mapping):
+            lines.extend(render_stats(
+                name, value, help_text, value.keys() if key in counters else ()
+            ))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f"# TYPE {name} {'counter' if key in counters else 'gauge'}")
+            lines.append(f'{name} {_format_number(value)}')
+    return lines
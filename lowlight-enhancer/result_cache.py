@@ -0,0 +1,187 @@
+"""
+Content-addressed cache for enhancement results.
+Results are keyed by a hash of the uploaded bytes plus the enhancement
+parameters and output format, so re-submitting the same photo with the same
+settings skips decoding and enhancement entirely.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+def content_digest(data: bytes) -> str:
+    """Return the hex digest identifying an upload's content."""
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def make_cache_key(digest: str, params: tuple, output_format: str) -> str:
+    """
+    Build a cache key for an upload.
+
+    Args:
+        digest: content_digest of the raw uploaded bytes
+        params: Enhancement parameters, e.g. (clip_limit, gamma, brightness)
+        output_format: Identifies the encoded output, e.g. 'jpeg:90'
+
+    Returns:
+        Hex digest identifying the result
+    """
+    key = hashlib.blake2b(digest.encode(), digest_size=20)
+    key.update(repr((tuple(float(p) for p in params), output_format)).encode())
+    return key.hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier LRU cache of encoded results with byte budgets.
+
+    The memory tier holds the most recently used results. The optional disk
+    tier keeps a larger set, including results from previous runs, as one
+    file per key, and promotes entries back into memory on a hit.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        disk_dir: Optional[str] = None,
+        disk_max_bytes: int = 0
+    ):
+        """
+        Args:
+            max_bytes: Memory budget in bytes (0 disables the memory tier)
+            disk_dir: Directory for the disk tier (None disables it)
+            disk_max_bytes: Disk budget in bytes
+        """
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir if disk_dir and disk_max_bytes > 0 else None
+        self.disk_max_bytes = disk_max_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    def _load_disk_index(self) -> None:
+        """Index existing cache files, oldest first, and trim to the budget."""
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            if name.endswith('.tmp') or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._disk[name] = size
+            self._disk_bytes += size
+        self._trim_disk()
+
+    def _disk_path(self, key: str) -> str:
+        """Return the file path for a disk-tier entry."""
+        return os.path.join(self.disk_dir, key)
+
+    def _trim_disk(self) -> None:
+        """Evict the least recently used disk entries until under budget."""
+        while self._disk_bytes > self.disk_max_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+
+    def _store_memory(self, key: str, value: bytes) -> None:
+        """Insert into the memory tier, evicting least recently used entries."""
+        if len(value) > self.max_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = value
+        self._memory_bytes += len(value)
+        while self._memory_bytes > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _store_disk(self, key: str, value: bytes) -> None:
+        """Write an entry to the disk tier."""
+        if len(value) > self.disk_max_bytes:
+            return
+        # Write to a temporary file first so readers never see partial files
+        fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            os.replace(tmp_path, self._disk_path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self._lock:
+            self._disk_bytes -= self._disk.pop(key, 0)
+            self._disk[key] = len(value)
+            self._disk_bytes += len(value)
+            self._trim_disk()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the cached value for key, or None on a miss."""
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return value
+            on_disk = key in self._disk
+
+        if on_disk:
+            try:
+                with open(self._disk_path(key), 'rb') as f:
+                    value = f.read()
+            except OSError:
+                value = None
+            if value is not None:
+                with self._lock:
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                    self._store_memory(key, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, value: bytes) -> None:
+        """Store value under key in every enabled tier."""
+        with self._lock:
+            self._store_memory(key, value)
+        if self.disk_dir:
+            self._store_disk(key, value)
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and current sizes."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'memory_max_bytes': self.max_bytes,
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_bytes,
+                'disk_max_bytes': self.disk_max_bytes if self.disk_dir else 0,
+            }
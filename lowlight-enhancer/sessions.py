@@ -0,0 +1,134 @@
+"""
+Upload-once image sessions for the enhancer web app.
+An uploaded image is decoded and converted to LAB once, then kept under a
+token so that later requests only send parameters.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from enhancer import PreparedImage
+
+
+class ImageSession:
+    """A recently uploaded image, prepared at full and preview resolution."""
+
+    def __init__(
+        self,
+        token: str,
+        data: bytes,
+        full: PreparedImage,
+        preview: PreparedImage
+    ):
+        """
+        Args:
+            token: Content digest of the upload, used as the session token
+            data: Raw uploaded bytes (needed for responses that include the original)
+            full: Full-resolution prepared image
+            preview: Downscaled prepared image for live previews
+        """
+        self.token = token
+        self.data = data
+        self.full = full
+        self.preview = preview
+        self.last_used = time.monotonic()
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the session."""
+        return len(self.data) + self.full.nbytes + self.preview.nbytes
+
+    @property
+    def max_nbytes(self) -> int:
+        """Memory the session can grow to as renders cache CLAHE planes."""
+        return len(self.data) + self.full.max_nbytes + self.preview.max_nbytes
+
+
+class SessionStore:
+    """
+    Thread-safe LRU store of image sessions with a byte budget and idle TTL.
+
+    Each session is charged its largest size when it is stored, including
+    the PreparedImage.MAX_EQUALIZED CLAHE planes that later renders may
+    cache, so the budget holds however the sessions are used.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        """
+        Args:
+            max_bytes: Memory budget in bytes
+            ttl: Seconds a session may stay unused before it expires
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def _remove(self, token: str) -> None:
+        """Drop a session and its accounted size."""
+        self._sessions.pop(token, None)
+        self._bytes -= self._sizes.pop(token, 0)
+
+    def _purge_expired(self, now: float) -> None:
+        """Remove sessions idle for longer than the TTL (oldest first)."""
+        while self._sessions:
+            token, session = next(iter(self._sessions.items()))
+            if now - session.last_used <= self.ttl:
+                break
+            self._remove(token)
+            self.expired += 1
+
+    def get(self, token: str) -> Optional[ImageSession]:
+        """Return the session for token and mark it used, or None if unknown."""
+        now = time.monotonic()
+        with self._lock:
+            self._purge_expired(now)
+            session = self._sessions.get(token)
+            if session is not None:
+                session.last_used = now
+                self._sessions.move_to_end(token)
+            return session
+
+    def put(self, session: ImageSession) -> bool:
+        """
+        Store a session, evicting least recently used ones to fit the budget.
+
+        Returns:
+            False if the session alone is larger than the budget
+        """
+        size = session.max_nbytes
+        if size > self.max_bytes:
+            return False
+
+        with self._lock:
+            self._purge_expired(time.monotonic())
+            self._remove(session.token)
+            while self._sessions and self._bytes + size > self.max_bytes:
+                token = next(iter(self._sessions))
+                self._remove(token)
+                self.evicted += 1
+            self._sessions[session.token] = session
+            self._sizes[session.token] = size
+            self._bytes += size
+            self.created += 1
+        return True
+
+    def stats(self) -> dict:
+        """Return counters and current sizes."""
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'created': self.created,
+                'expired': self.expired,
+                'evicted': self.evicted,
+            }
@@ -0,0 +1,309 @@
+"""
+Tiled Low-Light Image Enhancement
+Enhance images that are too large to hold in memory several times over,
+such as drone mosaics, one tile at a time.
+
+CLAHE is the only stage that looks beyond a single pixel. Instead of running
+cv2.CLAHE per tile (which would produce visible seams), the per-cell lookup
+tables are computed once for the whole image in a streaming first pass and
+then interpolated per pixel in the second pass the way OpenCV does for a
+whole image. Peak memory therefore depends on the tile size, not the image
+size, when the input and output are memory-mapped arrays.
+
+The equalized L channel matches cv2.CLAHE to within one level. It is
+identical on the OpenCV 4.x builds we tested, but builds that round the
+interpolation differently (e.g. with fused multiply-add) differ by 1 on many
+pixels, which the tone curve can enlarge in dark areas. `python checks.py`
+verifies the bound.
+
+Usage:
+    python tiled.py mosaic.npy mosaic_enhanced.npy --tile-size 2048
+"""
+
+import argparse
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+from enhancer import (
+    SATURATION_MODES,
+    LowLightEnhancer,
+    check_saturation_mode,
+    get_shared_enhancer,
+)
+
+
+HIST_SIZE = 256
+
+
+def _reflect_101(indices: np.ndarray, size: int) -> np.ndarray:
+    """Map padded indices past the end back into range (cv2.BORDER_REFLECT_101)."""
+    return np.where(indices < size, indices, 2 * (size - 1) - indices)
+
+
+def _clahe_geometry(
+    height: int,
+    width: int,
+    tile_grid_size: Tuple[int, int]
+) -> Tuple[int, int, int, int]:
+    """
+    Return the padded size and CLAHE cell size OpenCV uses for an image.
+
+    Returns:
+        (padded_height, padded_width, cell_height, cell_width)
+    """
+    tiles_x, tiles_y = tile_grid_size
+    if width % tiles_x == 0 and height % tiles_y == 0:
+        padded_height, padded_width = height, width
+    else:
+        # OpenCV pads both axes whenever either one is not divisible
+        padded_height = height + tiles_y - height % tiles_y
+        padded_width = width + tiles_x - width % tiles_x
+    return padded_height, padded_width, padded_height // tiles_y, padded_width // tiles_x
+
+
+def compute_clahe_luts(
+    image: np.ndarray,
+    clip_limit: float = 2.0,
+    tile_grid_size: Tuple[int, int] = (8, 8),
+    bgr: bool = False,
+    chunk_pixels: int = 4 * 1024 * 1024
+) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """
+    Compute the CLAHE lookup table of every grid cell for a whole image.
+
+    The image is read in row bands of about chunk_pixels pixels, so it can be
+    a memory-mapped array that never fits in memory at once.
+
+    Args:
+        image: RGB/BGR uint8 image (may be a numpy memmap)
+        clip_limit: CLAHE clip limit
+        tile_grid_size: CLAHE grid as (tiles_x, tiles_y)
+        bgr: True if the image is in BGR channel order
+        chunk_pixels: Approximate number of pixels converted per band
+
+    Returns:
+        (luts, cell_size) where luts has shape (tiles_y, tiles_x, 256) and
+        cell_size is (cell_height, cell_width)
+    """
+    height, width = image.shape[:2]
+    tiles_x, tiles_y = tile_grid_size
+    padded_height, padded_width, cell_height, cell_width = _clahe_geometry(
+        height, width, tile_grid_size
+    )
+    to_lab = cv2.COLOR_BGR2LAB if bgr else cv2.COLOR_RGB2LAB
+
+    columns = _reflect_101(np.arange(padded_width), width)
+    cell_columns = (np.arange(padded_width) // cell_width).astype(np.int64)
+    hist = np.zeros(tiles_y * tiles_x * HIST_SIZE, dtype=np.int64)
+
+    band_rows = max(1, chunk_pixels // padded_width)
+    for y0 in range(0, padded_height, band_rows):
+        y1 = min(y0 + band_rows, padded_height)
+        rows = _reflect_101(np.arange(y0, y1), height)
+        if y1 <= height:
+            band = np.ascontiguousarray(image[y0:y1])
+        else:
+            band = np.ascontiguousarray(image[rows])
+        l = cv2.cvtColor(band, to_lab)[:, :, 0]
+        if padded_width != width:
+            l = l[:, columns]
+
+        cells = (np.arange(y0, y1) // cell_height)[:, None] * tiles_x + cell_columns
+        hist += np.bincount(
+            (cells * HIST_SIZE + l).ravel(), minlength=hist.size
+        )
+
+    hist = hist.reshape(tiles_y, tiles_x, HIST_SIZE)
+    cell_area = cell_height * cell_width
+
+    if clip_limit > 0:
+        limit = max(int(clip_limit * cell_area / HIST_SIZE), 1)
+        clipped = np.maximum(hist - limit, 0).sum(axis=2)
+        hist = np.minimum(hist, limit)
+        redist_batch = clipped // HIST_SIZE
+        residual = clipped - redist_batch * HIST_SIZE
+        hist += redist_batch[:, :, None]
+        for ty in range(tiles_y):
+            for tx in range(tiles_x):
+                r = int(residual[ty, tx])
+                if r:
+                    step = max(HIST_SIZE // r, 1)
+                    hist[ty, tx, np.arange(0, HIST_SIZE, step)[:r]] += 1
+
+    lut_scale = np.float32((HIST_SIZE - 1) / cell_area)
+    cumulative = np.cumsum(hist, axis=2).astype(np.float32)
+    luts = np.clip(np.rint(cumulative * lut_scale), 0, 255).astype(np.uint8)
+    return luts, (cell_height, cell_width)
+
+
+def _interpolation_weights(
+    start: int,
+    stop: int,
+    cell: int,
+    tiles: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Return neighbouring cell indices and weights for a range of pixel positions."""
+    pos = np.arange(start, stop, dtype=np.float32) * np.float32(1.0 / cell) - np.float32(0.5)
+    first = np.floor(pos)
+    weight = (pos - first).astype(np.float32)
+    first = first.astype(np.int64)
+    return np.maximum(first, 0), np.minimum(first + 1, tiles - 1), weight
+
+
+def apply_clahe_luts(
+    l: np.ndarray,
+    luts: np.ndarray,
+    cell_size: Tuple[int, int],
+    origin: Tuple[int, int] = (0, 0)
+) -> np.ndarray:
+    """
+    Equalize an L-channel tile with precomputed CLAHE lookup tables.
+
+    Args:
+        l: L channel of the tile (uint8)
+        luts: Lookup tables from compute_clahe_luts
+        cell_size: (cell_height, cell_width) from compute_clahe_luts
+        origin: (y, x) position of the tile in the full image
+
+    Returns:
+        Equalized L channel, within one level of cv2.CLAHE on the full image
+    """
+    tiles_y, tiles_x = luts.shape[:2]
+    y0, x0 = origin
+    height, width = l.shape
+    ty1, ty2, ya = _interpolation_weights(y0, y0 + height, cell_size[0], tiles_y)
+    tx1, tx2, xa = _interpolation_weights(x0, x0 + width, cell_size[1], tiles_x)
+
+    tables = luts.astype(np.float32)
+    ya = ya[:, None]
+    xa1 = np.float32(1) - xa
+    top = tables[ty1[:, None], tx1, l] * xa1 + tables[ty1[:, None], tx2, l] * xa
+    bottom = tables[ty2[:, None], tx1, l] * xa1 + tables[ty2[:, None], tx2, l] * xa
+    result = top * (np.float32(1) - ya) + bottom * ya
+    return np.clip(np.rint(result), 0, 255).astype(np.uint8)
+
+
+def enhance_tiled(
+    image: np.ndarray,
+    out: Optional[np.ndarray] = None,
+    clip_limit: float = 2.0,
+    gamma: float = 1.2,
+    brightness_boost: float = 1.1,
+    saturation_mode: str = 'hsv',
+    bgr: bool = False,
+    tile_size: int = 1024,
+    enhancer: Optional[LowLightEnhancer] = None
+) -> np.ndarray:
+    """
+    Enhance a large image tile by tile.
+
+    The result has no seams and matches LowLightEnhancer.enhance_image on
+    the whole image, except that the CLAHE stage may differ by one level
+    (see the module docstring).
+
+    Args:
+        image: RGB/BGR uint8 image (may be a numpy memmap)
+        out: Output array of the same shape (may be a numpy memmap);
+            allocated in memory if not given
+        clip_limit: CLAHE clip limit
+        gamma: Gamma correction value
+        brightness_boost: Overall brightness multiplier
+        saturation_mode: 'hsv' or 'lab', see LowLightEnhancer.enhance_image
+        bgr: True if the image is in BGR channel order
+        tile_size: Edge length of the square tiles processed at once
+        enhancer: Enhancer to use (default: the shared enhancer)
+
+    Returns:
+        The output array
+    """
+    check_saturation_mode(saturation_mode)
+    if image.ndim != 3 or image.shape[2] != 3 or image.dtype != np.uint8:
+        raise ValueError("enhance_tiled expects a uint8 image with 3 channels")
+    if out is None:
+        out = np.empty_like(image)
+    elif out.shape != image.shape or out.dtype != image.dtype:
+        raise ValueError("out must have the same shape and dtype as image")
+
+    enhancer = enhancer or get_shared_enhancer()
+    luts, cell_size = compute_clahe_luts(
+        image, clip_limit, enhancer.tile_grid_size, bgr,
+        chunk_pixels=tile_size * tile_size
+    )
+
+    height, width = image.shape[:2]
+    for y0 in range(0, height, tile_size):
+        y1 = min(y0 + tile_size, height)
+        for x0 in range(0, width, tile_size):
+            x1 = min(x0 + tile_size, width)
+            tile = np.ascontiguousarray(image[y0:y1, x0:x1])
+            l, a, b = enhancer._split_lab(tile, bgr)
+            l_equalized = apply_clahe_luts(l, luts, cell_size, (y0, x0))
+            out[y0:y1, x0:x1] = enhancer._finish(
+                l_equalized, a, b, gamma, brightness_boost, saturation_mode, bgr
+            )
+        if isinstance(out, np.memmap):
+            # Write finished rows back so dirty pages do not accumulate
+            out.flush()
+
+    return out
+
+
+def enhance_npy_file(
+    input_path: str,
+    output_path: str,
+    tile_size: int = 1024,
+    **kwargs
+) -> None:
+    """
+    Enhance an image stored as a .npy array, memory-mapping input and output.
+
+    Args:
+        input_path: Path to an (H, W, 3) uint8 .npy file
+        output_path: Path of the .npy file to create
+        tile_size: Edge length of the square tiles processed at once
+        **kwargs: Passed on to enhance_tiled
+    """
+    image = np.load(input_path, mmap_mode='r')
+    out = np.lib.format.open_memmap(
+        output_path, mode='w+', dtype=image.dtype, shape=image.shape
+    )
+    try:
+        enhance_tiled(image, out, tile_size=tile_size, **kwargs)
+        out.flush()
+    finally:
+        del out
+
+
+def main(argv=None) -> None:
+    """Command-line entry point."""
+    parser = argparse.ArgumentParser(
+        description="Enhance a very large image stored as a .npy array, tile by tile."
+    )
+    parser.add_argument('input', help="input (H, W, 3) uint8 .npy file")
+    parser.add_argument('output', help="output .npy file")
+    parser.add_argument('--tile-size', type=int, default=1024, help="tile edge length (default: 1024)")
+    parser.add_argument('--clip-limit', type=float, default=2.0, help="CLAHE clip limit (default: 2.0)")
+    parser.add_argument('--gamma', type=float, default=1.2, help="gamma correction (default: 1.2)")
+    parser.add_argument('--brightness', type=float, default=1.1, help="brightness boost (default: 1.1)")
+    parser.add_argument('--saturation-mode', choices=SATURATION_MODES, default='hsv',
+                        help="saturation boost mode (default: hsv)")
+    parser.add_argument('--bgr', action='store_true', help="array is in BGR channel order")
+    args = parser.parse_args(argv)
+
+    enhance_npy_file(
+        args.input,
+        args.output,
+        tile_size=args.tile_size,
+        clip_limit=args.clip_limit,
+        gamma=args.gamma,
+        brightness_boost=args.brightness,
+        saturation_mode=args.saturation_mode,
+        bgr=args.bgr
+    )
+    print(f"Enhanced image saved to: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Lightweight per-stage timers.
+Code marks its stages with `with stage('clahe'):`. The time is recorded
+only while a StageTimer is active on the current thread, so instrumented
+code costs one thread-local lookup per stage when nobody is measuring.
+"""
+
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Optional
+
+_local = threading.local()
+_inactive = nullcontext()
+
+
+class StageTimer:
+    """
+    Collects the wall time spent in named stages on one thread.
+
+    Use it as a context manager to make it the thread's active timer;
+    timers can be nested, and the previous one is restored on exit.
+    Repeated stages are summed.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.start = time.perf_counter()
+        self._previous = None
+
+    def __enter__(self) -> "StageTimer":
+        self._previous = getattr(_local, 'timer', None)
+        _local.timer = self
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        _local.timer = self._previous
+        self._previous = None
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time the enclosed block as stage name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float) -> None:
+        """Add seconds to stage name."""
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds since the timer was created."""
+        return time.perf_counter() - self.start
+
+    def server_timing(self, total: bool = True) -> str:
+        """
+        Format the stages as a Server-Timing header value, e.g.
+        'decode;dur=12.1, clahe;dur=4.0, total;dur=30.2'.
+        """
+        entries = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.stages.items()]
+        if total:
+            entries.append(f'total;dur={self.elapsed * 1000:.1f}')
+        return ', '.join(entries)
+
+
+def current_timer() -> Optional[StageTimer]:
+    """Return the active timer of the current thread, if any."""
+    return getattr(_local, 'timer', None)
+
+
+def stage(name: str):
+    """Time a block as stage name if a timer is active on this thread."""
+    timer = getattr(_local, 'timer', None)
+    if timer is None:
+        return _inactive
+    return timer.stage(name)
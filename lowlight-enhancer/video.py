@@ -0,0 +1,469 @@
+"""
+Video and Frame-Stream Low-Light Enhancement
+Enhance dashcam or CCTV footage frame by frame.
+
+A FrameStreamEnhancer keeps everything that does not depend on the pixels
+between frames: CLAHE objects, tone lookup tables, scratch buffers and a
+small ring of output frames. Tone parameters are smoothed over time so that
+adaptive exposure does not flicker, and decoding, enhancement and encoding
+run on separate threads (OpenCV releases the GIL), so a video is processed
+as a pipeline rather than one stage at a time.
+
+Usage:
+    python video.py dashcam.mp4 dashcam_enhanced.mp4 --target-luminance 110
+"""
+
+import argparse
+import math
+import queue
+import sys
+import threading
+import time
+from typing import Dict, Iterable, Iterator, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+from enhancer import (
+    SATURATION_MODES,
+    EnhancementWorkspace,
+    LowLightEnhancer,
+    check_saturation_mode,
+    get_shared_enhancer,
+)
+
+
+# Smoothed gamma/brightness values are rounded to this step, so consecutive
+# frames hit the cached tone LUTs instead of building a new table per frame
+PARAM_STEP = 0.01
+
+# Range adaptive exposure may move gamma within
+ADAPTIVE_GAMMA_RANGE = (1.0, 2.5)
+
+# Every n-th pixel in each direction is sampled to measure frame luminance
+LUMINANCE_STRIDE = 8
+
+# Frames queued between pipeline stages
+DEFAULT_QUEUE_SIZE = 4
+
+
+class FrameRing:
+    """
+    A fixed ring of preallocated frames, handed out round-robin.
+
+    A frame returned by next() is overwritten after `size` more calls, so
+    consumers must be done with it (or copy it) by then.
+    """
+
+    def __init__(self, size: int):
+        """
+        Args:
+            size: Number of frames in the ring
+        """
+        if size < 1:
+            raise ValueError("FrameRing needs at least one frame")
+        self.size = size
+        self._frames = []
+        self._index = 0
+
+    def next(self, shape: Tuple[int, ...]) -> np.ndarray:
+        """Return the next frame of the ring, reallocating all frames if the shape changed."""
+        if not self._frames or self._frames[0].shape != tuple(shape):
+            self._frames = [np.empty(shape, dtype=np.uint8) for _ in range(self.size)]
+            self._index = 0
+        frame = self._frames[self._index]
+        self._index = (self._index + 1) % self.size
+        return frame
+
+
+class ToneSmoother:
+    """
+    Exponential moving average of the gamma/brightness tone parameters.
+
+    Frames move the parameters toward their target by (1 - smoothing) of
+    the remaining distance, so a sudden change in exposure target (headlights,
+    a parameter change from the caller) fades in over several frames.
+    """
+
+    def __init__(self, gamma: float, brightness_boost: float, smoothing: float = 0.9):
+        """
+        Args:
+            gamma: Initial gamma
+            brightness_boost: Initial brightness multiplier
+            smoothing: Weight of the previous value, 0 (none) to <1
+        """
+        if not 0.0 <= smoothing < 1.0:
+            raise ValueError(f"smoothing must be in [0, 1), got {smoothing}")
+        self.smoothing = smoothing
+        self.gamma = float(gamma)
+        self.brightness_boost = float(brightness_boost)
+
+    def update(self, gamma: float, brightness_boost: float) -> Tuple[float, float]:
+        """
+        Move toward a new target and return the quantized parameters to use.
+        """
+        weight = 1.0 - self.smoothing
+        self.gamma += (gamma - self.gamma) * weight
+        self.brightness_boost += (brightness_boost - self.brightness_boost) * weight
+        return _quantize(self.gamma), _quantize(self.brightness_boost)
+
+
+def _quantize(value: float) -> float:
+    """Round a tone parameter to PARAM_STEP."""
+    return round(round(value / PARAM_STEP) * PARAM_STEP, 6)
+
+
+def frame_luminance(frame: np.ndarray, bgr: bool = True) -> float:
+    """
+    Return the mean LAB lightness (0-255) of a frame from a strided subsample.
+    """
+    sample = np.ascontiguousarray(frame[::LUMINANCE_STRIDE, ::LUMINANCE_STRIDE])
+    lab = cv2.cvtColor(sample, cv2.COLOR_BGR2LAB if bgr else cv2.COLOR_RGB2LAB)
+    return float(lab[:, :, 0].mean())
+
+
+def adaptive_gamma(luminance: float, target_luminance: float) -> float:
+    """
+    Return the gamma that maps a mean lightness onto the target lightness.
+
+    Solves (luminance / 255) ** (1 / gamma) == target / 255, limited to
+    ADAPTIVE_GAMMA_RANGE.
+    """
+    low, high = ADAPTIVE_GAMMA_RANGE
+    current = min(max(luminance, 1.0), 254.0) / 255.0
+    target = min(max(target_luminance, 1.0), 254.0) / 255.0
+    return min(max(math.log(current) / math.log(target), low), high)
+
+
+class FrameStreamEnhancer:
+    """
+    Enhances a sequence of same-size frames with reused state.
+
+    Each call to enhance() writes into the next frame of an output ring and
+    a workspace that live as long as the stream, so steady-state frames
+    allocate no image-sized arrays. Not safe to call from several threads at
+    once; use one instance per stream.
+    """
+
+    def __init__(
+        self,
+        clip_limit: float = 2.0,
+        gamma: float = 1.2,
+        brightness_boost: float = 1.1,
+        saturation_mode: str = 'lab',
+        bgr: bool = True,
+        smoothing: float = 0.9,
+        target_luminance: Optional[float] = None,
+        buffers: int = DEFAULT_QUEUE_SIZE + 2,
+        enhancer: Optional[LowLightEnhancer] = None
+    ):
+        """
+        Args:
+            clip_limit: CLAHE clip limit
+            gamma: Gamma correction value; the starting point when
+                target_luminance is set
+            brightness_boost: Overall brightness multiplier
+            saturation_mode: 'hsv' or 'lab', see LowLightEnhancer.enhance_image
+                ('lab' is cheaper per frame)
+            bgr: True if frames are in BGR channel order (cv2.VideoCapture)
+            smoothing: Weight of the previous tone parameters, 0 to <1
+            target_luminance: If set, gamma adapts per frame so the mean
+                lightness (0-255) of the input moves toward this value
+            buffers: Number of output frames in the ring; a returned frame
+                stays valid for buffers - 1 further calls
+            enhancer: Enhancer to use (default: the shared enhancer)
+        """
+        check_saturation_mode(saturation_mode)
+        self.clip_limit = clip_limit
+        self.saturation_mode = saturation_mode
+        self.bgr = bgr
+        self.target_luminance = target_luminance
+        self.smoother = ToneSmoother(gamma, brightness_boost, smoothing)
+        self.frames = 0
+        self._gamma = gamma
+        self._brightness_boost = brightness_boost
+        self._enhancer = enhancer or get_shared_enhancer()
+        self._ring = FrameRing(buffers)
+        self._workspace = None
+        self._params_lock = threading.Lock()
+
+    def set_params(
+        self,
+        gamma: Optional[float] = None,
+        brightness_boost: Optional[float] = None,
+        clip_limit: Optional[float] = None
+    ) -> None:
+        """
+        Change parameters mid-stream. Gamma and brightness fade in through
+        the smoother; the clip limit applies from the next frame.
+        """
+        with self._params_lock:
+            if gamma is not None:
+                self._gamma = gamma
+            if brightness_boost is not None:
+                self._brightness_boost = brightness_boost
+            if clip_limit is not None:
+                self.clip_limit = clip_limit
+
+    def current_params(self) -> Tuple[float, float, float]:
+        """Return the (clip_limit, gamma, brightness_boost) used for the last frame."""
+        return (
+            self.clip_limit,
+            _quantize(self.smoother.gamma),
+            _quantize(self.smoother.brightness_boost),
+        )
+
+    def enhance(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Enhance one frame.
+
+        Returns:
+            The enhanced frame, a ring buffer owned by this stream
+        """
+        with self._params_lock:
+            clip_limit = self.clip_limit
+            gamma = self._gamma
+            brightness_boost = self._brightness_boost
+
+        if self.target_luminance is not None:
+            gamma = adaptive_gamma(
+                frame_luminance(frame, self.bgr), self.target_luminance
+            )
+        gamma, brightness_boost = self.smoother.update(gamma, brightness_boost)
+
+        if self._workspace is None or self._workspace.shape != frame.shape:
+            self._workspace = EnhancementWorkspace(frame.shape)
+        out = self._ring.next(frame.shape)
+        self._enhancer.enhance_image(
+            frame, clip_limit, gamma, brightness_boost, self.saturation_mode,
+            bgr=self.bgr, out=out, workspace=self._workspace
+        )
+        self.frames += 1
+        return out
+
+
+_DONE = object()
+
+
+class _StageError:
+    """Carries an exception raised in a pipeline thread to the consumer."""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def pipelined(items: Iterable, queue_size: int = DEFAULT_QUEUE_SIZE) -> Iterator:
+    """
+    Iterate over items on a background thread, queue_size items ahead.
+
+    Exceptions raised by items are re-raised in the consumer. Closing the
+    returned generator stops the background thread.
+    """
+    buffer = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except BaseException as error:
+            put(_StageError(error))
+            return
+        finally:
+            # Stop upstream stages too when the consumer went away
+            close = getattr(items, 'close', None)
+            if close is not None:
+                close()
+        put(_DONE)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _StageError):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def enhance_frames(
+    frames: Iterable[np.ndarray],
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    stream: Optional[FrameStreamEnhancer] = None,
+    **kwargs
+) -> Iterator[np.ndarray]:
+    """
+    Enhance an iterator of frames, reading ahead on a background thread.
+
+    Yielded frames are reused ring buffers: each stays valid until the
+    generator has yielded `buffers - 1` more frames (see FrameStreamEnhancer).
+    Copy a frame to keep it longer.
+
+    Args:
+        frames: Iterable of same-size uint8 frames
+        queue_size: Frames read ahead of the enhancer
+        stream: Stream enhancer to use; created from kwargs if not given
+        **kwargs: Passed on to FrameStreamEnhancer
+
+    Yields:
+        Enhanced frames, in order
+    """
+    stream = stream or FrameStreamEnhancer(**kwargs)
+    for frame in pipelined(frames, queue_size):
+        yield stream.enhance(frame)
+
+
+def read_video_frames(
+    capture: cv2.VideoCapture,
+    buffers: int = DEFAULT_QUEUE_SIZE + 2
+) -> Iterator[np.ndarray]:
+    """
+    Yield the frames of an open capture, decoding into a ring of buffers.
+
+    Each frame stays valid for buffers - 1 further frames.
+    """
+    width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    ring = FrameRing(buffers)
+    shape = (height, width, 3)
+    while True:
+        ok, frame = capture.read(ring.next(shape))
+        if not ok:
+            return
+        if frame.shape != shape:
+            # Some backends report a different size than they decode
+            shape = frame.shape
+        yield frame
+
+
+def enhance_video_file(
+    input_path: Union[str, int],
+    output_path: str,
+    codec: str = 'mp4v',
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    max_frames: Optional[int] = None,
+    **kwargs
+) -> Dict:
+    """
+    Enhance a video file (or camera index) into a new video file.
+
+    Decoding, enhancement and encoding each run on their own thread with
+    queue_size frames between stages.
+
+    Args:
+        input_path: Video file path or URL, or a camera index
+        output_path: Path of the video file to write
+        codec: FourCC of the output codec
+        queue_size: Frames buffered between pipeline stages
+        max_frames: Stop after this many frames (for cameras and streams)
+        **kwargs: Passed on to FrameStreamEnhancer
+
+    Returns:
+        Summary dict with frames, elapsed, frames_per_second and the
+        source fps
+    """
+    capture = cv2.VideoCapture(input_path)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video {input_path}")
+
+    writer = None
+    enhanced_frames = None
+    # Every frame can be queued, held by a stage or being written into
+    buffers = queue_size + 2
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+        stream = FrameStreamEnhancer(bgr=True, buffers=buffers, **kwargs)
+        frames = read_video_frames(capture, buffers)
+        if max_frames is not None:
+            frames = (frame for _, frame in zip(range(max_frames), frames))
+
+        start = time.perf_counter()
+        enhanced_frames = pipelined(
+            enhance_frames(frames, queue_size, stream), queue_size
+        )
+        for enhanced in enhanced_frames:
+            if writer is None:
+                height, width = enhanced.shape[:2]
+                writer = cv2.VideoWriter(
+                    output_path, cv2.VideoWriter_fourcc(*codec), fps, (width, height)
+                )
+                if not writer.isOpened():
+                    raise ValueError(f"Could not open {output_path} for writing with codec {codec}")
+            writer.write(enhanced)
+        elapsed = time.perf_counter() - start
+    finally:
+        if enhanced_frames is not None:
+            enhanced_frames.close()
+        capture.release()
+        if writer is not None:
+            writer.release()
+
+    return {
+        'frames': stream.frames,
+        'elapsed': elapsed,
+        'frames_per_second': stream.frames / elapsed if elapsed > 0 else 0.0,
+        'source_fps': fps,
+    }
+
+
+def main(argv=None) -> int:
+    """Command-line entry point."""
+    parser = argparse.ArgumentParser(
+        description="Enhance low-light video footage frame by frame."
+    )
+    parser.add_argument('input', help="input video file, URL or camera index")
+    parser.add_argument('output', help="output video file")
+    parser.add_argument('--codec', default='mp4v', help="output FourCC codec (default: mp4v)")
+    parser.add_argument('--clip-limit', type=float, default=2.0, help="CLAHE clip limit (default: 2.0)")
+    parser.add_argument('--gamma', type=float, default=1.2, help="gamma correction (default: 1.2)")
+    parser.add_argument('--brightness', type=float, default=1.1, help="brightness boost (default: 1.1)")
+    parser.add_argument('--saturation-mode', choices=SATURATION_MODES, default='lab',
+                        help="saturation boost mode (default: lab)")
+    parser.add_argument('--target-luminance', type=float, default=None,
+                        help="adapt gamma per frame toward this mean lightness, 0-255 (default: off)")
+    parser.add_argument('--smoothing', type=float, default=0.9,
+                        help="temporal smoothing of tone parameters, 0 to <1 (default: 0.9)")
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE,
+                        help=f"frames buffered between stages (default: {DEFAULT_QUEUE_SIZE})")
+    parser.add_argument('--max-frames', type=int, default=None, help="stop after this many frames")
+    args = parser.parse_args(argv)
+
+    source = int(args.input) if args.input.isdigit() else args.input
+    summary = enhance_video_file(
+        source,
+        args.output,
+        codec=args.codec,
+        queue_size=args.queue_size,
+        max_frames=args.max_frames,
+        clip_limit=args.clip_limit,
+        gamma=args.gamma,
+        brightness_boost=args.brightness,
+        saturation_mode=args.saturation_mode,
+        target_luminance=args.target_luminance,
+        smoothing=args.smoothing
+    )
+    print(
+        f"Enhanced {summary['frames']} frames in {summary['elapsed']:.1f}s: "
+        f"{summary['frames_per_second']:.1f} fps (source {summary['source_fps']:.1f} fps)"
+    )
+    print(f"Enhanced video saved to: {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
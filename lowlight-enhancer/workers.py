@@ -0,0 +1,278 @@
+"""
+Shared-memory process pool for enhancement in the web app.
+Request threads hand decoded frames to persistent worker processes through
+multiprocessing.shared_memory segments instead of pickling arrays. The
+worker enhances straight into the output half of the segment and the
+request thread encodes from a view of it, so each frame is copied once
+(into the segment) on the way in and not at all on the way out.
+
+The pool is off unless ENHANCE_PROCESSES is set (a number, or 'auto' for
+one process per CPU). Each gunicorn worker creates its own pool on first
+use, after the fork.
+"""
+
+import atexit
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Callable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from enhancer import get_shared_enhancer
+from timing import stage
+
+# Segments are sized in whole multiples of this many bytes so that
+# similar-size frames can reuse each other's segments
+SEGMENT_ALIGNMENT = 1024 * 1024
+
+# Pooled segments each worker process keeps attached between calls
+WORKER_ATTACHED_SEGMENTS = 4
+
+# Pooled segments attached in this worker process: name -> SharedMemory
+_attached = OrderedDict()
+
+
+def _init_worker() -> None:
+    """Keep OpenCV single-threaded in workers; the pool provides the parallelism."""
+    cv2.setNumThreads(1)
+
+
+def _attach(name: str, pooled: bool) -> shared_memory.SharedMemory:
+    """
+    Return this worker's attachment to a segment. Attachments to pooled
+    segments are kept for reuse; others are the caller's to close.
+    """
+    segment = _attached.get(name)
+    if segment is not None:
+        _attached.move_to_end(name)
+        return segment
+    segment = shared_memory.SharedMemory(name=name)
+    if pooled:
+        _attached[name] = segment
+        if len(_attached) > WORKER_ATTACHED_SEGMENTS:
+            _, evicted = _attached.popitem(last=False)
+            evicted.close()
+    return segment
+
+
+def _enhance_shared(
+    name: str,
+    shape: Tuple[int, ...],
+    clip_limit: float,
+    gamma: float,
+    brightness_boost: float,
+    saturation_mode: str,
+    bgr: bool,
+    pooled: bool
+) -> None:
+    """
+    Worker side: enhance the frame at the start of a segment into the
+    frame-sized region right after it.
+
+    Segments the parent unlinks after the call (pooled=False) are closed
+    here straight away, so their memory is freed as soon as the parent
+    lets go of them rather than when this worker evicts its attachment.
+    """
+    segment = _attach(name, pooled)
+    nbytes = int(np.prod(shape))
+    image = np.ndarray(shape, dtype=np.uint8, buffer=segment.buf)
+    out = np.ndarray(shape, dtype=np.uint8, buffer=segment.buf, offset=nbytes)
+    try:
+        get_shared_enhancer().enhance_image(
+            image, clip_limit, gamma, brightness_boost, saturation_mode,
+            bgr=bgr, out=out
+        )
+    finally:
+        # Views must not outlive this call, or the segment cannot be closed
+        del image, out
+        if not pooled:
+            segment.close()
+
+
+class SharedMemoryPool:
+    """
+    A process pool that exchanges frames through reusable shared memory.
+
+    Safe to use from many request threads at once; each call takes its own
+    segment from a free list, so concurrent frames never share a buffer.
+    """
+
+    def __init__(self, processes: Optional[int] = None, max_pooled_bytes: int = 256 * 1024 * 1024):
+        """
+        Args:
+            processes: Worker processes (default: CPU count)
+            max_pooled_bytes: Segments kept for reuse, in bytes. Segments
+                created while this budget is taken are unlinked after use
+        """
+        self.processes = processes or os.cpu_count() or 1
+        self.max_pooled_bytes = max_pooled_bytes
+        # forkserver avoids forking the multi-threaded server process itself
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context(method),
+            initializer=_init_worker
+        )
+        self._lock = threading.Lock()
+        self._free: List[shared_memory.SharedMemory] = []
+        self._pooled_bytes = 0
+        # Bytes of all pooled segments, free or in use
+        self._kept_bytes = 0
+        self._in_use = 0
+        self.calls = 0
+        self.segments_created = 0
+
+    def _acquire(self, nbytes: int) -> Tuple[shared_memory.SharedMemory, bool]:
+        """
+        Take the smallest free segment of at least nbytes, or create one.
+
+        Returns:
+            (segment, pooled): pooled segments go back to the free list
+            after use; the others are unlinked
+        """
+        size = -(-nbytes // SEGMENT_ALIGNMENT) * SEGMENT_ALIGNMENT
+        with self._lock:
+            fitting = [s for s in self._free if s.size >= nbytes]
+            if fitting:
+                segment = min(fitting, key=lambda s: s.size)
+                self._free.remove(segment)
+                self._pooled_bytes -= segment.size
+                self._in_use += 1
+                return segment, True
+            self._in_use += 1
+            self.segments_created += 1
+            pooled = self._kept_bytes + size <= self.max_pooled_bytes
+            if pooled:
+                self._kept_bytes += size
+        try:
+            return shared_memory.SharedMemory(create=True, size=size), pooled
+        except Exception:
+            with self._lock:
+                self._in_use -= 1
+                if pooled:
+                    self._kept_bytes -= size
+            raise
+
+    def _release(self, segment: shared_memory.SharedMemory, pooled: bool) -> None:
+        """Return a pooled segment to the free list, or unlink a transient one."""
+        with self._lock:
+            self._in_use -= 1
+            if pooled:
+                self._free.append(segment)
+                self._pooled_bytes += segment.size
+                return
+        segment.close()
+        segment.unlink()
+
+    def enhance(
+        self,
+        image: np.ndarray,
+        clip_limit: float = 2.0,
+        gamma: float = 1.2,
+        brightness_boost: float = 1.1,
+        saturation_mode: str = 'lab',
+        bgr: bool = True,
+        consume: Optional[Callable[[np.ndarray], Any]] = None
+    ) -> Any:
+        """
+        Enhance an image in a worker process.
+
+        Args:
+            image: uint8 image with 3 channels
+            clip_limit, gamma, brightness_boost, saturation_mode, bgr:
+                As for LowLightEnhancer.enhance_image
+            consume: Called with the enhanced image as a view of shared
+                memory, e.g. to encode it; the view must not be kept
+
+        Returns:
+            What consume returned, or a copy of the enhanced image if no
+            consume was given
+        """
+        if image.ndim != 3 or image.shape[2] != 3 or image.dtype != np.uint8:
+            raise ValueError("The worker pool expects a uint8 image with 3 channels")
+        consume = consume or np.array
+        nbytes = image.nbytes
+        segment, pooled = self._acquire(2 * nbytes)
+        try:
+            with stage('to_shared'):
+                np.ndarray(image.shape, dtype=np.uint8, buffer=segment.buf)[...] = image
+            with stage('worker'):
+                self._executor.submit(
+                    _enhance_shared, segment.name, image.shape, float(clip_limit),
+                    float(gamma), float(brightness_boost), saturation_mode, bgr, pooled
+                ).result()
+            with self._lock:
+                self.calls += 1
+            return consume(
+                np.ndarray(image.shape, dtype=np.uint8, buffer=segment.buf, offset=nbytes)
+            )
+        finally:
+            self._release(segment, pooled)
+
+    def stats(self) -> dict:
+        """Return the pool size, call counter and shared memory usage."""
+        with self._lock:
+            return {
+                'processes': self.processes,
+                'calls': self.calls,
+                'segments_in_use': self._in_use,
+                'segments_free': len(self._free),
+                'segments_created': self.segments_created,
+                'pooled_bytes': self._pooled_bytes,
+            }
+
+    def shutdown(self) -> None:
+        """Stop the workers and unlink all free segments."""
+        self._executor.shutdown()
+        with self._lock:
+            free, self._free = self._free, []
+            self._pooled_bytes = 0
+            self._kept_bytes -= sum(segment.size for segment in free)
+        for segment in free:
+            segment.close()
+            segment.unlink()
+
+
+def configured_processes() -> int:
+    """Return the worker process count from ENHANCE_PROCESSES (0 when disabled)."""
+    value = os.environ.get('ENHANCE_PROCESSES', '0').strip().lower()
+    if value == 'auto':
+        return os.cpu_count() or 1
+    return max(0, int(value or 0))
+
+
+_pool: Optional[SharedMemoryPool] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool() -> Optional[SharedMemoryPool]:
+    """
+    Return this process's shared-memory pool, or None if ENHANCE_PROCESSES
+    is not set.
+
+    The pool is created on first use in each process, so a pool created
+    before a fork (for example in a gunicorn master with --preload) is not
+    shared with the forked workers.
+    """
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+    processes = configured_processes()
+    if not processes:
+        return None
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = SharedMemoryPool(
+                processes,
+                max_pooled_bytes=int(os.environ.get('ENHANCE_SHM_POOL_MB', 256)) * 1024 * 1024
+            )
+            _pool_pid = os.getpid()
+            # Unlink pooled segments on exit instead of leaving them to the resource tracker
+            atexit.register(_pool.shutdown)
+    return _pool